@@ -0,0 +1,80 @@
+"""Work for the GUI that runs on a QThreadPool instead of the GUI thread."""
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Slot
+
+
+class TaskSignals(QObject):
+    finished = Signal(int, object)  # generation, result
+    failed = Signal(int, object)  # generation, exception
+
+
+class Task(QRunnable):
+    """Runs fn(*args) in a pool thread. The result, or the exception it
+    raised, is emitted with the generation of the task."""
+
+    def __init__(self, generation: int, fn, *args):
+        super().__init__()
+        self.generation = generation
+        self.fn = fn
+        self.args = args
+        self.signals = TaskSignals()
+        # The runner keeps the task until its result arrives:
+        self.setAutoDelete(False)
+
+    def run(self):
+        try:
+            result = self.fn(*self.args)
+        except Exception as e:
+            self.signals.failed.emit(self.generation, e)
+            return
+        self.signals.finished.emit(self.generation, result)
+
+
+class LatestJobRunner(QObject):
+    """Runs one job at a time in a thread pool. Each submit() bumps the
+    generation number and replaces the pending job, so a burst of submits
+    while a job runs only runs the latest one afterwards. Results of jobs
+    older than the latest submit are thrown away. finished and failed are
+    emitted in the thread of the runner, before the next job starts."""
+
+    finished = Signal(object)
+    failed = Signal(object)
+
+    def __init__(self, pool: QThreadPool | None = None, parent=None):
+        super().__init__(parent)
+        self.pool = pool or QThreadPool.globalInstance()
+        self.generation = 0
+        self.running = None
+        self.pending = None
+
+    def submit(self, fn, *args):
+        self.generation += 1
+        self.pending = (fn, args)
+        if self.running is None:
+            self._start_pending()
+
+    def busy(self) -> bool:
+        return self.running is not None or self.pending is not None
+
+    def _start_pending(self):
+        fn, args = self.pending
+        self.pending = None
+        # Connected to slots of this object, so they are queued to its thread:
+        self.running = Task(self.generation, fn, *args)
+        self.running.signals.finished.connect(self._on_finished)
+        self.running.signals.failed.connect(self._on_failed)
+        self.pool.start(self.running)
+
+    @Slot(int, object)
+    def _on_finished(self, generation: int, result):
+        self._done(generation, self.finished, result)
+
+    @Slot(int, object)
+    def _on_failed(self, generation: int, error):
+        self._done(generation, self.failed, error)
+
+    def _done(self, generation: int, signal, value):
+        self.running = None
+        if generation == self.generation:
+            signal.emit(value)
+        if self.pending is not None:
+            self._start_pending()
@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+
+import memory_profile
+import tracing
+from build_manifest import BuildManifest, is_up_to_date, room_hash
+from json_builder import build_json_and_uasset
+from room_lint import lint_room
+from template_cache import template_fingerprint, template_stats
+from tracing import span
+from uassetgen import get_session
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+LARGEST_ROOMS = 5  # Rooms listed in the memory summary
+
+
+@dataclass
+class RoomResult:
+    file: Path
+    status: str = "built"  # "built", "skipped", "linted" (lint only) or "failed"
+    error: str | None = None
+    room_hash: str | None = None
+    output: Path | None = None
+    # Counters of the process that built the room, see log_worker_stats:
+    pid: int = 0
+    worker_stats: dict = field(default_factory=dict)
+    issues: list = field(default_factory=list)  # room_lint.LintIssue, when linted
+    lint_error: str | None = None  # Why the linter failed on the room, which is still built
+    spans: list = field(default_factory=list)  # Trace events of the process since its last room, when tracing
+    # memory_profile.end() of the whole room, with the peak RSS of its process, when profiling memory:
+    memory: dict = field(default_factory=dict)
+
+
+def room_files(directories: list) -> list[Path]:
+    return [file for directory in directories for file in Path(directory).glob("*.json")]
+
+
+def build_room_file(
+    file: Path, previous: dict | None = None, fingerprint: str = "", incremental: bool = False, native: bool = False,
+    lint: bool = False, build: bool = True
+) -> RoomResult:
+    """Builds one room file. With incremental=True the build is skipped when
+    the room hash matches the previous manifest entry and its uasset exists.
+    With lint=True the room is linted first, and with build=False only
+    linted. A linter error does not stop the build: it is kept in
+    lint_error, and only fails the rooms that are only linted."""
+    result = RoomResult(file)
+    with memory_profile.measure() as memory:
+        try:
+            with open(file, 'r') as room_file:
+                room_json = json.load(room_file)
+            if lint:
+                try:
+                    with span("lint_room"):
+                        result.issues = lint_room(room_json)
+                except Exception as e:
+                    result.lint_error = f"{type(e).__name__}: {e}"
+            if not build:
+                if result.lint_error is not None:
+                    raise RuntimeError(f"Lint failed: {result.lint_error}")
+                result.status = "linted"
+            else:
+                result.room_hash = room_hash(room_json, fingerprint, "native" if native else "uassetapi")
+                if incremental and is_up_to_date(previous, result.room_hash):
+                    result.status = "skipped"
+                    result.output = Path(previous["output"])
+                else:
+                    result.output = build_json_and_uasset(room_json, native)
+        except Exception as e:
+            result.status = "failed"
+            result.error = str(e)
+    result.pid = os.getpid()
+    result.worker_stats = {"templates": template_stats(), "uasset": get_session().stats()}
+    result.spans = tracing.drain()
+    if memory:
+        result.memory = {**memory, "peak_rss_bytes": memory_profile.peak_rss_bytes()}
+    return result
+
+
+def _init_worker(log_level: int, warm_up: bool, trace: bool, memory: bool):
+    logging.basicConfig(level=log_level, format=LOG_FORMAT)
+    if trace:
+        # The events go back with the results, the main process writes them.
+        # A forked worker also drops the events it inherited:
+        tracing.enable(memory=memory)
+        tracing.drain()
+    if not warm_up:
+        return
+    # Every worker keeps its own CLR and template cache for all the rooms it gets:
+    try:
+        get_session().warm_up()
+    except Exception as e:
+        logging.error(f"Could not load UAssetAPI in worker {os.getpid()}: {e}")
+
+
+def run_batch(
+    directories: list, jobs: int = 1, incremental: bool = False, native: bool = False, lint: bool = False, build: bool = True
+) -> list[RoomResult]:
+    """Builds the uasset of every room JSON in the directories. With jobs > 1
+    the rooms are spread over a pool of worker processes, jobs=0 uses one
+    worker per core. With incremental=True, rooms that did not change since
+    the build recorded in the manifest are skipped. native=True writes the
+    uassets with uasset_writer instead of UAssetAPI. lint=True also lints
+    every room in the worker that builds it, and build=False only lints."""
+    if jobs < 0:
+        raise ValueError(f"jobs must be 0 or more, got {jobs}")
+    if native and build:
+        logging.warning(
+            "The native writer is experimental: its output has not been compared with UAssetAPI yet "
+            "(python uasset_writer.py example_rooms/*.json). Check the uassets before shipping them."
+        )
+    files = room_files(directories)
+    manifest = BuildManifest.load()
+    previous = [manifest.get(file) for file in files]
+    process = partial(
+        build_room_file, fingerprint=template_fingerprint(), incremental=incremental, native=native, lint=lint, build=build
+    )
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(files) < 2:
+        results = map(process, files, previous)
+        executor = None
+    else:
+        logging.info(f"{'Building' if build else 'Linting'} {len(files)} rooms with {jobs} worker processes.")
+        executor = ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(
+                logging.getLogger().getEffectiveLevel(), build and not native, tracing.enabled(), tracing.memory_enabled()
+            ),
+        )
+        # A lint takes milliseconds, so the rooms only linted go to the workers in bunches:
+        chunksize = 1 if build else max(1, len(files) // (4 * jobs))
+        results = executor.map(process, files, previous, chunksize=chunksize)
+
+    collected = []
+
+    def collect(result: RoomResult):
+        for issue in result.issues:
+            logging.warning(f"Lint of {result.file}: {issue}")
+        if result.lint_error is not None and result.status != "failed":
+            logging.error(f"Could not lint {result.file}, built it anyway: {result.lint_error}")
+        if result.memory:
+            logging.debug(
+                f"Memory of {result.file}: {_mib(result.memory['peak_bytes'])} MiB traced at its peak, "
+                f"RSS {_mib(result.memory['rss_bytes'])} MiB after it"
+            )
+        if result.error is not None:
+            logging.error(f"Error when processing {result.file}: {result.error}")
+        elif result.status == "built":
+            manifest.record(result.file, result.room_hash, result.output)
+        collected.append(result)
+
+    try:
+        try:
+            for result in results:
+                collect(result)
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed when out of memory), the pool takes
+            # no more rooms. The results come in file order, so the rooms
+            # without one are the ones left:
+            logging.error(f"A worker process died, {len(files) - len(collected)} rooms are left unprocessed: {e}")
+            for file in files[len(collected):]:
+                collect(RoomResult(file, status="failed", error=f"Worker process died: {e}"))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        manifest.save()
+
+    if build:
+        log_worker_stats(collected)
+    log_summary(collected)
+    if lint:
+        log_lint_summary(collected)
+    if tracing.enabled():
+        events = [event for result in collected for event in result.spans]
+        tracing.extend(events)
+        log_trace_summary(events)
+    if tracing.memory_enabled():
+        log_memory_summary(collected, events)
+    return collected
+
+
+def log_worker_stats(results: list[RoomResult]):
+    # The counters only grow, so the last result of each process has its
+    # totals. The rooms left by a dead worker have none:
+    last_per_worker = {r.pid: r.worker_stats for r in results if r.worker_stats}
+    for pid, stats in last_per_worker.items():
+        logging.info(f"Worker {pid} template cache: {stats['templates']}")
+        logging.info(f"Worker {pid} UAssetAPI session: {stats['uasset']}")
+
+
+def log_summary(results: list[RoomResult]):
+    counts = {"built": 0, "skipped": 0, "linted": 0, "failed": 0}
+    for result in results:
+        counts[result.status] += 1
+    logging.info(
+        f"Batch finished: {counts['built']} built, {counts['skipped']} skipped, {counts['linted']} only linted, {counts['failed']} failed."
+    )
+
+
+def log_lint_summary(results: list[RoomResult]):
+    checks = {}
+    for result in results:
+        for issue in result.issues:
+            checks[issue.check] = checks.get(issue.check, 0) + 1
+    flagged = sum(1 for result in results if result.issues)
+    logging.info(f"Lint found {sum(checks.values())} issues in {flagged} of {len(results)} rooms: {checks}")
+    lint_failed = sum(1 for result in results if result.lint_error is not None)
+    if lint_failed:
+        logging.error(f"The linter failed on {lint_failed} rooms, see the errors above.")
+
+
+def log_trace_summary(events: list):
+    logging.info("Time per stage, summed over the rooms and workers:\n" + tracing.summary_table(events))
+
+
+def _mib(size: int) -> str:
+    return f"{size / 2**20:.1f}"
+
+
+def log_memory_summary(results: list[RoomResult], events: list):
+    """Memory per stage, the rooms with the largest peaks and the peak RSS
+    of every worker: a pool of jobs workers needs about jobs times the
+    largest one."""
+    logging.info("Memory per stage, largest over the rooms and workers:\n" + memory_profile.summary_table(events))
+    measured = [result for result in results if result.memory]
+    largest = sorted(measured, key=lambda result: result.memory["peak_bytes"], reverse=True)[:LARGEST_ROOMS]
+    for result in largest:
+        logging.info(
+            f"Room {result.file}: {_mib(result.memory['peak_bytes'])} MiB traced at its peak, "
+            f"RSS {_mib(result.memory['rss_bytes'])} MiB after it"
+        )
+    # The peak RSS only grows, so the last result of each process has the largest:
+    peak_per_worker = {result.pid: result.memory["peak_rss_bytes"] for result in measured}
+    for pid, peak in peak_per_worker.items():
+        logging.info(f"Worker {pid} peak RSS: {_mib(peak)} MiB")
@@ -0,0 +1,10 @@
+"""Benchmarks of the editor stages on parametric synthetic rooms.
+
+Run from the repository root, so the templates and libs are found:
+
+    python -m benchmarks run [--quick] [--sweep lines points ...] [--output results.json]
+    python -m benchmarks compare old.json new.json
+    python -m benchmarks room --lines 100 --points 20 --output room.json
+"""
+from benchmarks.stages import STAGES, SWEEPS, compare, run_suite, run_sweep, time_stage
+from benchmarks.synthetic import DEFAULT_ROOM, synthetic_room
@@ -0,0 +1,99 @@
+import argparse
+import json
+import logging
+from pathlib import Path
+
+from benchmarks.stages import QUICK_VALUES, REPEATS, STAGES, SWEEPS, compare, run_suite
+from benchmarks.synthetic import DEFAULT_ROOM, synthetic_room
+
+RESULTS_DIR = Path("benchmarks") / "results"
+
+
+def _ms(seconds: float | None) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.2f}"
+
+
+def print_suite(results: dict):
+    for parameter, sweep in results["sweeps"].items():
+        print(f"\n{parameter}: {', '.join(map(str, sweep['values']))}  (best of {results['repeats']} samples, ms per call)")
+        for stage, timing in sweep["stages"].items():
+            exponent = "" if timing["exponent"] is None else f"  ~ {parameter}^{timing['exponent']:.2f}"
+            times = " ".join(f"{_ms(t):>9}" for t in timing["min_s"])
+            print(f"  {stage:<20}{times}{exponent}")
+            if "error" in timing:
+                print(f"  {'':<20}{timing['error']}")
+
+
+def print_comparison(rows: list):
+    print(f"{'sweep':<10}{'value':>7}  {'stage':<20}{'old ms':>10}{'new ms':>10}{'ratio':>8}")
+    for row in rows:
+        flag = "  <- slower" if row["regression"] else ""
+        print(
+            f"{row['sweep']:<10}{str(row['value']):>7}  {row['stage']:<20}"
+            f"{_ms(row['old_s']):>10}{_ms(row['new_s']):>10}{row['ratio']:>8.2f}{flag}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks of the editor stages on synthetic rooms")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Time every stage over the sweeps and save the results as JSON.")
+    run.add_argument("--sweep", nargs="+", choices=list(SWEEPS), default=list(SWEEPS), help="Sweeps to run, all by default.")
+    run.add_argument("--stage", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to time, all by default.")
+    run.add_argument("--repeats", type=int, default=REPEATS, help="Timed samples of each stage, the best one is kept.")
+    run.add_argument("--quick", action="store_true", help=f"Only the first {QUICK_VALUES} values of each sweep.")
+    run.add_argument("--output", type=Path, help=f"Results file. Defaults to {RESULTS_DIR}/<commit>.json.")
+
+    diff = commands.add_parser("compare", help="Compare the best times of two results files.")
+    diff.add_argument("old", type=Path)
+    diff.add_argument("new", type=Path)
+    diff.add_argument("--threshold", type=float, default=1.2, help="Ratio new / old past which a time is a regression.")
+
+    room = commands.add_parser("room", help="Write a synthetic room JSON, to open it in the editor.")
+    for parameter, default in DEFAULT_ROOM.items():
+        if isinstance(default, bool):
+            room.add_argument(f"--{parameter.replace('_', '-')}", action="store_true", default=default)
+        else:
+            room.add_argument(f"--{parameter.replace('_', '-')}", type=int, default=default)
+    room.add_argument("--seed", type=int, default=0)
+    room.add_argument("--output", type=Path, required=True)
+
+    args = parser.parse_args()
+    # The builder logs every file it writes and every template it loads:
+    logging.basicConfig(level=logging.WARNING)
+
+    match args.command:
+        case "run":
+            results = run_suite(
+                {name: SWEEPS[name] for name in args.sweep}, args.stage, args.repeats, args.quick,
+                progress=lambda parameter: print(f"Sweeping {parameter}...", flush=True),
+            )
+            print_suite(results)
+            output = args.output
+            if output is None:
+                name = results["commit"] or "results"
+                output = RESULTS_DIR / f"{name}{'-dirty' if results['dirty'] else ''}.json"
+            output.parent.mkdir(parents=True, exist_ok=True)
+            with open(output, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"\nResults written to {output}")
+        case "compare":
+            with open(args.old, "r") as f:
+                old = json.load(f)
+            with open(args.new, "r") as f:
+                new = json.load(f)
+            rows = compare(old, new, args.threshold)
+            print(f"{old.get('commit')} -> {new.get('commit')}")
+            print_comparison(rows)
+            slower = sum(row["regression"] for row in rows)
+            print(f"{slower} of {len(rows)} times are more than {args.threshold:g}x slower.")
+        case "room":
+            parameters = {parameter: getattr(args, parameter) for parameter in DEFAULT_ROOM}
+            with open(args.output, "w") as f:
+                json.dump(synthetic_room(args.seed, **parameters), f, indent=4)
+            print(f"Room written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
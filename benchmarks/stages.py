@@ -0,0 +1,198 @@
+"""Timing of every stage of the editor on synthetic rooms, and scaling sweeps.
+
+A stage is timed alone on an already prepared input, so the stages of
+build_json_and_uasset are apart: build_asset_json makes the asset JSON,
+then write_uasset_bytes (the native writer) or JSON_to_uasset (UAssetAPI,
+without writing the file) serialize it. room_geometry is what
+room_plotter_3d computes before touching GL items: the specs of every
+feature, by layer.
+
+A sweep changes one parameter of synthetic_room and times every stage at
+each value. The exponent of a stage is the slope of its time against the
+parameter on a log-log scale: 1 is linear, 2 quadratic.
+"""
+import json
+import platform
+import subprocess
+import sys
+import timeit
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.synthetic import DEFAULT_ROOM, synthetic_room
+
+STAGES = (
+    "parse_room_json", "validate_room", "build_asset_json", "write_uasset_bytes", "JSON_to_uasset", "room_geometry", "lint_room"
+)
+# Parameter values of every sweep. The other parameters keep their DEFAULT_ROOM value:
+SWEEPS = {
+    "lines": [5, 10, 20, 40, 80, 160],
+    "points": [5, 10, 20, 40, 80, 160],
+    "entrances": [4, 16, 64, 256],
+    "pillars": [2, 8, 32, 128],
+    "selectors": [1, 4, 16, 64],
+    "pe": [False, True],
+}
+QUICK_VALUES = 3  # Values of each sweep kept with quick=True
+REPEATS = 3  # Timed samples of each stage
+MIN_SAMPLE_S = 0.05  # A sample calls the stage until it lasts this long
+
+
+def _room_geometry(room_json: dict):
+    from room_viewer import layer_specs, room_features
+
+    layers = {}
+    for (layer, _), source in room_features(room_json).items():
+        layers.setdefault(layer, []).append(source)
+    return {layer: layer_specs(layer, sources) for layer, sources in layers.items()}
+
+
+def _json_to_uasset(asset: dict):
+    from uassetgen import get_session
+
+    return get_session().deserialize(asset).WriteData()
+
+
+def stage_functions(room_json: dict) -> dict:
+    """A function without arguments running each stage on the room. The
+    writers get the asset JSON of the room, built once."""
+    from json_builder import build_asset_json, parse_room_json
+    from room_lint import lint_room
+    from room_validator import validate_room
+    from uasset_writer import write_uasset_bytes
+
+    asset = []
+
+    def built() -> dict:
+        if not asset:
+            asset.append(build_asset_json(room_json))
+        return asset[0]
+
+    return {
+        "parse_room_json": lambda: parse_room_json(room_json),
+        "validate_room": lambda: validate_room(room_json),
+        "build_asset_json": lambda: build_asset_json(room_json),
+        "write_uasset_bytes": lambda: write_uasset_bytes(built()),
+        "JSON_to_uasset": lambda: _json_to_uasset(built()),
+        "room_geometry": lambda: _room_geometry(room_json),
+        "lint_room": lambda: lint_room(room_json),
+    }
+
+
+def time_stage(fn, repeats: int = REPEATS) -> dict:
+    """Best and mean time per call over repeats samples. A sample calls fn
+    as many times as it takes to last MIN_SAMPLE_S, so short stages are not
+    lost in the timer noise, and the calls that find that number warm up
+    the caches (templates, the UAssetAPI runtime). The garbage collector
+    stays on, as it is when building."""
+    timer = timeit.Timer(fn, setup="import gc; gc.enable()")
+    number = 1
+    while timer.timeit(number) < MIN_SAMPLE_S:
+        number *= 2
+    samples = [elapsed / number for elapsed in timer.repeat(repeats, number)]
+    return {"min_s": min(samples), "mean_s": sum(samples) / len(samples), "calls": number}
+
+
+def room_size(room_json: dict) -> dict:
+    return {
+        "ffill_points": sum(len(line["Points"]) for line in room_json["FloodFillLines"].values()),
+        "entrances": len(room_json["Entrances"]),
+        "pillar_points": sum(len(p["Points"]) for p in room_json.get("FloodFillPillars", {}).values()),
+        "json_bytes": len(json.dumps(room_json)),
+    }
+
+
+def scaling_exponent(values: list, times: list) -> float | None:
+    """Slope of log(time) against log(value), or None when the values are
+    not sizes (PE or not) or a stage did not run at every value."""
+    if len(values) < 2 or any(isinstance(v, bool) or v <= 0 for v in values) or None in times:
+        return None
+    slope, _ = np.polyfit(np.log(values), np.log(times), 1)
+    return float(slope)
+
+
+def run_sweep(parameter: str, values: list, stages=STAGES, repeats: int = REPEATS, base: dict | None = None) -> dict:
+    """Times the stages on the room of every value of the parameter. A stage
+    that fails (e.g. UAssetAPI is not available) keeps its error and is not
+    run again in the sweep."""
+    base = dict(base or {})
+    results = {
+        "values": list(values), "sizes": [], "stages": {stage: {"min_s": [], "mean_s": [], "calls": []} for stage in stages}
+    }
+    errors = {}
+    for value in values:
+        room_json = synthetic_room(**{**base, parameter: value})
+        results["sizes"].append(room_size(room_json))
+        functions = stage_functions(room_json)
+        for stage in stages:
+            timing = results["stages"][stage]
+            measured = {"min_s": None, "mean_s": None, "calls": 0}
+            if stage not in errors:
+                try:
+                    measured = time_stage(functions[stage], repeats)
+                except Exception as e:
+                    errors[stage] = f"{type(e).__name__}: {e}"
+            for key, measure in measured.items():
+                timing[key].append(measure)
+    for stage, timing in results["stages"].items():
+        timing["exponent"] = scaling_exponent(values, timing["min_s"])
+        if stage in errors:
+            timing["error"] = errors[stage]
+    return results
+
+
+def git_commit() -> dict:
+    """Short hash of HEAD and whether the tree has changes, when in a git tree."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+
+def run_suite(sweeps: dict = SWEEPS, stages=STAGES, repeats: int = REPEATS, quick: bool = False, progress=None) -> dict:
+    """Every sweep, with what is needed to compare runs: the commit, the
+    machine and the parameters. progress(parameter) is called before each
+    sweep."""
+    results = {
+        **git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "machine": f"{platform.system()} {platform.machine()} {platform.processor()}".strip(),
+        "repeats": repeats,
+        "base_room": DEFAULT_ROOM,
+        "sweeps": {},
+    }
+    for parameter, values in sweeps.items():
+        if progress is not None:
+            progress(parameter)
+        results["sweeps"][parameter] = run_sweep(parameter, values[:QUICK_VALUES] if quick else values, stages, repeats)
+    return results
+
+
+def compare(old: dict, new: dict, threshold: float = 1.2) -> list[dict]:
+    """One row per (sweep, value, stage) timed in both runs, with the ratio
+    of the best times, new / old. regression is set past threshold."""
+    rows = []
+    for parameter, sweep in new["sweeps"].items():
+        previous = old["sweeps"].get(parameter)
+        if previous is None:
+            continue
+        for stage, timing in sweep["stages"].items():
+            before = previous["stages"].get(stage)
+            if before is None:
+                continue
+            old_times = dict(zip(map(json.dumps, previous["values"]), before["min_s"]))
+            for value, new_s in zip(sweep["values"], timing["min_s"]):
+                old_s = old_times.get(json.dumps(value))
+                if old_s is None or new_s is None:
+                    continue
+                ratio = new_s / old_s if old_s > 0 else float("inf")
+                rows.append({
+                    "sweep": parameter, "value": value, "stage": stage, "old_s": old_s, "new_s": new_s,
+                    "ratio": ratio, "regression": ratio > threshold,
+                })
+    return rows
@@ -0,0 +1,113 @@
+"""Parametric synthetic rooms, to measure how the editor scales with room size.
+
+The rooms follow room_parser.schema and lint clean: every FloodFillLine
+starts on a point of an earlier line and walks in steps shorter than its
+HRange, so the cave is connected, and the entrances, pillars and PE
+features are placed at line points. The same parameters and seed always
+give the same room.
+"""
+import numpy as np
+
+# Parameters of synthetic_room() when not given:
+DEFAULT_ROOM = {
+    "lines": 10,  # FloodFillLines
+    "points": 10,  # Points of each FloodFillLine
+    "entrances": 4,
+    "pillars": 2,
+    "pillar_points": 3,  # Points of each FloodFillPillar
+    "selectors": 1,  # RandomSelectors, each naming SELECTOR_SIZE entrances or lines
+    "pe": False,  # Adds a PE_MiningHead and a PE_PodDropDown, with the PE tags
+}
+HRANGE = (300, 1500)
+STEP = 0.7  # Distance between consecutive points, in HRange of the point
+SELECTOR_SIZE = 3
+ENTRANCE_TYPES = ("Entrance", "Exit", "Secondary")
+TAGS = ["Rooms.Linear.CustomEgg"]
+PE_TAGS = ["Rooms.Linear.CustomEgg", "Rooms.Linear.CustomMining"]
+
+
+def _xyz(point: np.ndarray) -> dict:
+    return {"X": int(round(point[0])), "Y": int(round(point[1])), "Z": int(round(point[2]))}
+
+
+def _range(value: float) -> dict:
+    return {"Min": int(value), "Max": int(value)}
+
+
+def _line(rng: np.random.Generator, start: np.ndarray, points: int) -> list:
+    """Points of a FloodFillLine walking from start, mostly level."""
+    hrange = rng.integers(*HRANGE, size=points)
+    vrange = (hrange * rng.uniform(0.6, 1.2, size=points)).astype(int)
+    heading = rng.uniform(0, 2 * np.pi)
+    location = np.array(start, dtype=float)
+    line = []
+    for i in range(points):
+        point = {"Location": _xyz(location), "HRange": int(hrange[i]), "VRange": int(vrange[i])}
+        # Some points use the optional keys, as hand made rooms do:
+        if i % 4 == 1:
+            point["CeilingHeight"] = int(vrange[i] * 1.5)
+        if i % 5 == 2:
+            point["FloorAngle"] = int(rng.integers(0, 45))
+        line.append(point)
+        heading += rng.normal(0, 0.5)
+        step = STEP * min(hrange[i], hrange[min(i + 1, points - 1)])
+        location = location + step * np.array([np.cos(heading), np.sin(heading), rng.normal(0, 0.2)])
+    return line
+
+
+def synthetic_room(seed: int = 0, **parameters) -> dict:
+    """Room JSON with the DEFAULT_ROOM parameters, overridden by the given
+    ones."""
+    parameters = {**DEFAULT_ROOM, **parameters}
+    unknown = set(parameters) - set(DEFAULT_ROOM)
+    if unknown:
+        raise TypeError(f"Unknown room parameters: {sorted(unknown)}")
+    rng = np.random.default_rng(seed)
+
+    lines = {}
+    centers = np.zeros((0, 3))
+    for i in range(max(parameters["lines"], 1)):
+        start = centers[rng.integers(len(centers))] if len(centers) else np.zeros(3)
+        line = _line(rng, start, max(parameters["points"], 1))
+        lines[f"Floodfill_{i}"] = {"Points": line}
+        centers = np.concatenate([centers, [[p["Location"][k] for k in "XYZ"] for p in line]])
+
+    def line_point() -> np.ndarray:
+        return centers[rng.integers(len(centers))]
+
+    entrances = {
+        f"Entrance_{i}": {
+            "Location": _xyz(line_point()),
+            "Type": ENTRANCE_TYPES[i % len(ENTRANCE_TYPES)],
+            "Direction": {"Pitch": 0, "Yaw": int(rng.integers(-180, 180)), "Roll": 0},
+        }
+        for i in range(parameters["entrances"])
+    }
+    room = {
+        "Name": f"RMA_Synthetic_{parameters['lines']}x{parameters['points']}",
+        "Bounds": int(np.abs(centers).max() + HRANGE[1]),
+        "Tags": list(PE_TAGS if parameters["pe"] else TAGS),
+        "FloodFillLines": lines,
+        "Entrances": entrances,
+    }
+
+    if parameters["selectors"]:
+        names = list(entrances) or list(lines)
+        room["RandomSelectors"] = {
+            f"RandomSelector_{i}": [str(name) for name in rng.choice(names, size=min(SELECTOR_SIZE, len(names)), replace=False)]
+            for i in range(parameters["selectors"])
+        }
+    if parameters["pillars"]:
+        pillars = {}
+        for i in range(parameters["pillars"]):
+            base = line_point()
+            points = []
+            for _ in range(max(parameters["pillar_points"], 2)):  # The schema wants 2 points at least
+                location = base + rng.uniform(-200, 200, size=3)
+                points.append({"Location": _xyz(location), "Range": _range(rng.integers(100, 300)), "FillAmount": _range(200)})
+            pillars[f"Pillar_{i}"] = {"Points": points}
+        room["FloodFillPillars"] = pillars
+    if parameters["pe"]:
+        room["PE_MiningHead"] = {"MiningHead0": {"Location": _xyz(line_point())}}
+        room["PE_PodDropDown"] = {"Pod_0": {"Location": _xyz(line_point())}}
+    return room
@@ -0,0 +1,58 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from json_builder import BUILDER_VERSION
+
+MANIFEST_PATH = Path("assets") / "build_manifest.json"
+
+
+def room_hash(room_json: dict, template_fingerprint: str, writer: str = "uassetapi") -> str:
+    """Hash of everything a uasset depends on: the room itself (key order and
+    whitespace do not matter), the template set, the builder version and the
+    writer that serialized it."""
+    normalized = json.dumps(room_json, sort_keys=True, separators=(",", ":"))
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{BUILDER_VERSION}\n{template_fingerprint}\n{writer}\n".encode())
+    h.update(normalized.encode())
+    return h.hexdigest()
+
+
+class BuildManifest:
+    """Maps each room file to the hash it was last built with and the uasset
+    it produced."""
+
+    def __init__(self, path: Path = MANIFEST_PATH):
+        self.path = Path(path)
+        self.entries: dict[str, dict] = {}
+
+    @staticmethod
+    def key(file: Path) -> str:
+        return str(Path(file).resolve())
+
+    @classmethod
+    def load(cls, path: Path = MANIFEST_PATH) -> "BuildManifest":
+        manifest = cls(path)
+        if manifest.path.exists():
+            try:
+                with open(manifest.path, "r") as f:
+                    manifest.entries = json.load(f)["rooms"]
+            except (json.JSONDecodeError, KeyError) as e:
+                logging.warning(f"Ignoring unreadable build manifest {manifest.path}: {e}")
+        return manifest
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"builder_version": BUILDER_VERSION, "rooms": self.entries}, f, indent=4)
+
+    def get(self, file: Path) -> dict | None:
+        return self.entries.get(self.key(file))
+
+    def record(self, file: Path, hash_: str, output: Path):
+        self.entries[self.key(file)] = {"hash": hash_, "output": str(output)}
+
+
+def is_up_to_date(entry: dict | None, hash_: str) -> bool:
+    return entry is not None and entry["hash"] == hash_ and Path(entry["output"]).exists()
@@ -0,0 +1,55 @@
+import threading
+
+from template_cache import get_template
+
+
+class ExportStamp:
+    """Precompiled export template. The template layout is walked once to
+    record the writable slots (a name and the path of keys/indices that leads
+    to it). Stamping a new export only copies the containers on the way to
+    those slots and shares every other subtree with the read-only template,
+    so there is no deepcopy of the whole UAssetAPI property tree.
+    """
+
+    def __init__(self, template, slots: dict[str, tuple]):
+        self.template = template
+        self.slots = slots
+        self._tree = {}
+        for slot, path in slots.items():
+            node = template
+            branch = self._tree
+            for key in path[:-1]:
+                node = node[key]
+                branch = branch.setdefault(key, {})
+            # Fail on the first stamp compile, not on the first room that uses it:
+            node[path[-1]]
+            branch[path[-1]] = slot
+
+    def __call__(self, **values) -> dict:
+        return _fill(self.template, self._tree, values)
+
+
+def _fill(node, tree: dict, values: dict):
+    new = dict(node) if isinstance(node, dict) else list(node)
+    for key, sub in tree.items():
+        if isinstance(sub, str):
+            new[key] = values[sub]
+        else:
+            new[key] = _fill(node[key], sub, values)
+    return new
+
+
+_STAMPS: dict[str, ExportStamp] = {}
+_STAMPS_LOCK = threading.Lock()
+
+
+def get_stamp(name: str, slots: dict[str, tuple]) -> ExportStamp:
+    """Returns the stamp for a template in assets/default_assets, compiling it
+    again only when the template registry reloaded the file."""
+    template = get_template(name)
+    with _STAMPS_LOCK:
+        stamp = _STAMPS.get(name)
+        if stamp is None or stamp.template is not template:
+            stamp = ExportStamp(template, slots)
+            _STAMPS[name] = stamp
+        return stamp
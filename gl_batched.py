@@ -0,0 +1,321 @@
+"""GL item drawing the lines or points of many features with one draw call.
+
+Every feature owns a range of one vertex buffer. Editing a feature rewrites
+its range in place with glBufferSubData; only a feature that outgrows its
+range moves to the end of the buffer, with room to grow. The vertices of a
+range that are not used by its feature are invisible: their alpha is 0 and
+the fragment shader discards them. When they are most of the buffer, the
+ranges are packed again and the buffer is uploaded whole.
+"""
+import numpy as np
+from OpenGL import GL
+from OpenGL.GL import shaders
+from PySide6.QtGui import QOpenGLContext
+from PySide6.QtOpenGL import QOpenGLBuffer
+from pyqtgraph.opengl.GLGraphicsItem import GLGraphicsItem
+
+# Vertex attribute locations:
+POSITION, COLOR = 0, 1
+MIN_PACKED_VERTICES = 4096  # A buffer this small is never packed
+MAX_RANGE_WRITES = 64  # Past this many edited ranges in a frame, their whole span is written at once
+
+
+def range_size(count: int) -> int:
+    """Vertices reserved for a feature that outgrew its range: the next power
+    of two, so it can grow a little more without moving again."""
+    return 1 << max(count - 1, 0).bit_length()
+
+
+def _compatibility_profile(context: QOpenGLContext) -> bool:
+    """Whether the context has the fixed-function state, like GL_POINT_SPRITE."""
+    fmt = context.format()
+    if fmt.profile() == fmt.OpenGLContextProfile.CoreProfile:
+        return False
+    return fmt.profile() == fmt.OpenGLContextProfile.CompatibilityProfile or fmt.version() <= (2, 1)
+
+
+class BatchedItem(GLGraphicsItem):
+    """Draws the vertices of every feature, in "lines" mode (two vertices
+    per segment) or as round points of size pixels. Each feature has one
+    color."""
+
+    _shaderProgram = None
+
+    def __init__(self, parentItem=None, **kwds):
+        """All keyword arguments are passed to setData()"""
+        super().__init__()
+        self.setGLOptions(kwds.pop('glOptions', 'additive'))
+        self.mode = "lines"
+        self.width = 1.0
+        self.size = 10.0
+        self.positions = np.zeros((0, 3), dtype=np.float32)
+        self.colors = np.zeros((0, 4), dtype=np.float32)
+        self.ranges = {}  # key -> (start, reserved, count) of the feature in the buffer
+        self.end = 0  # Vertices drawn: every range is before it
+        self.used = 0  # Vertices of the features, the rest up to end is invisible
+        self.written = []  # (start, stop) vertex ranges changed since the last upload
+        self.reallocate = True  # The buffer is uploaded whole at the next paint
+
+        self.m_vbo_position = QOpenGLBuffer(QOpenGLBuffer.Type.VertexBuffer)
+        self.m_vbo_color = QOpenGLBuffer(QOpenGLBuffer.Type.VertexBuffer)
+
+        self.setParentItem(parentItem)
+        self.setData(**kwds)
+
+    def setData(self, **kwds):
+        """
+        mode        "lines" or "points".
+        width       float specifying line width.
+        size        float specifying the point diameter in pixels.
+        """
+        args = ['mode', 'width', 'size']
+        for k in kwds.keys():
+            if k not in args:
+                raise Exception('Invalid keyword argument: %s (allowed arguments are %s)' % (k, str(args)))
+        if kwds.get('mode', self.mode) not in ("lines", "points"):
+            raise ValueError(f"Unknown mode {kwds['mode']}")
+        for k, v in kwds.items():
+            setattr(self, k, v)
+        self.update()
+
+    def set_feature(self, key, vertices, color):
+        """Draws the (V, 3) vertices of the feature key in color, in place of
+        its previous ones."""
+        vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+        count = len(vertices)
+        if count == 0:
+            self.remove_feature(key)
+            return
+        start, reserved, previous = self.ranges.get(key, (0, 0, 0))
+        if count > reserved:
+            # A new feature gets what it needs, most never change their size:
+            reserved = range_size(count) if key in self.ranges else count
+            self.remove_feature(key)
+            start, previous = self._reserve(reserved), 0
+        self.positions[start:start + count] = vertices
+        self.colors[start:start + count] = color
+        # The vertices the feature does not use any more are hidden:
+        self.colors[start + count:start + previous, 3] = 0.0
+        self.ranges[key] = (start, reserved, count)
+        self.used += count - previous
+        self._written(start, start + max(count, previous))
+
+    def remove_feature(self, key):
+        if key not in self.ranges:
+            return
+        start, _, count = self.ranges.pop(key)
+        self.colors[start:start + count, 3] = 0.0
+        self.used -= count
+        self._written(start, start + count)
+        if self.end > MIN_PACKED_VERTICES and self.used < self.end // 4:
+            self._pack()
+
+    def feature_count(self) -> int:
+        return len(self.ranges)
+
+    def _reserve(self, size: int) -> int:
+        """Start of a new range of size vertices at the end of the buffer."""
+        start = self.end
+        self.end += size
+        if self.end > len(self.positions):
+            capacity = max(2 * len(self.positions), self.end, 64)
+            self.positions = np.concatenate([self.positions, np.zeros((capacity - len(self.positions), 3), dtype=np.float32)])
+            self.colors = np.concatenate([self.colors, np.zeros((capacity - len(self.colors), 4), dtype=np.float32)])
+            self.reallocate = True
+        return start
+
+    def _pack(self):
+        """Moves the ranges next to each other, in their order in the buffer."""
+        positions = np.zeros_like(self.positions)
+        colors = np.zeros_like(self.colors)
+        end = 0
+        for key, (start, _, count) in sorted(self.ranges.items(), key=lambda item: item[1][0]):
+            positions[end:end + count] = self.positions[start:start + count]
+            colors[end:end + count] = self.colors[start:start + count]
+            self.ranges[key] = (end, count, count)
+            end += count
+        self.positions, self.colors, self.end = positions, colors, end
+        self.reallocate = True
+
+    def _written(self, start: int, stop: int):
+        if stop > start and not self.reallocate:
+            self.written.append((start, stop))
+        self.update()
+
+    def _merged_writes(self) -> list:
+        written = sorted(self.written)
+        if len(written) > MAX_RANGE_WRITES:
+            return [(written[0][0], max(stop for _, stop in written))]
+        merged = [list(written[0])]
+        for start, stop in written[1:]:
+            if start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([start, stop])
+        return merged
+
+    @staticmethod
+    def upload_vbo(vbo, arr):
+        if not vbo.isCreated():
+            vbo.create()
+        vbo.bind()
+        if vbo.size() != arr.nbytes:
+            vbo.allocate(arr, arr.nbytes)
+        else:
+            vbo.write(0, arr, arr.nbytes)
+        vbo.release()
+
+    def _upload(self):
+        if self.reallocate:
+            self.upload_vbo(self.m_vbo_position, self.positions)
+            self.upload_vbo(self.m_vbo_color, self.colors)
+        elif self.written:
+            for vbo, arr in ((self.m_vbo_position, self.positions), (self.m_vbo_color, self.colors)):
+                vbo.bind()
+                for start, stop in self._merged_writes():
+                    part = np.ascontiguousarray(arr[start:stop])
+                    vbo.write(start * arr.itemsize * arr.shape[1], part, part.nbytes)
+                vbo.release()
+        self.reallocate = False
+        self.written = []
+
+    @staticmethod
+    def getShaderProgram():
+        klass = BatchedItem
+
+        if klass._shaderProgram is not None:
+            return klass._shaderProgram
+
+        ctx = QOpenGLContext.currentContext()
+        fmt = ctx.format()
+
+        if ctx.isOpenGLES():
+            if fmt.version() >= (3, 0):
+                glsl_version = "#version 300 es\n"
+                sources = SHADER_CORE
+            else:
+                glsl_version = "#version 100\n"
+                sources = SHADER_LEGACY
+        else:
+            if fmt.version() >= (3, 1):
+                glsl_version = "#version 140\n"
+                sources = SHADER_CORE
+            else:
+                glsl_version = "#version 120\n"
+                sources = SHADER_LEGACY
+
+        compiled = [shaders.compileShader([glsl_version, v], k) for k, v in sources.items()]
+        program = shaders.compileProgram(*compiled)
+
+        GL.glBindAttribLocation(program, POSITION, "a_position")
+        GL.glBindAttribLocation(program, COLOR, "a_color")
+        GL.glLinkProgram(program)
+
+        klass._shaderProgram = program
+        return program
+
+    def paint(self):
+        if self.end == 0:
+            return
+        self.setupGLState()
+
+        mat_mvp = np.array(self.mvpMatrix().data(), dtype=np.float32)
+        context = QOpenGLContext.currentContext()
+        self._upload()
+        program = self.getShaderProgram()
+
+        points = self.mode == "points"
+        sfmt = context.format()
+        if points:
+            if not context.isOpenGLES():
+                if _compatibility_profile(context):
+                    GL.glEnable(GL.GL_POINT_SPRITE)
+                GL.glEnable(GL.GL_PROGRAM_POINT_SIZE)
+        else:
+            core_forward_compatible = (
+                sfmt.profile() == sfmt.OpenGLContextProfile.CoreProfile
+                and not sfmt.testOption(sfmt.FormatOption.DeprecatedFunctions)
+            )
+            if not core_forward_compatible:
+                # Core Forward Compatible profiles will return error for
+                # any width that is not 1.0
+                GL.glLineWidth(self.width)
+
+        for loc, vbo, size in ((POSITION, self.m_vbo_position, 3), (COLOR, self.m_vbo_color, 4)):
+            vbo.bind()
+            GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, 0, None)
+            vbo.release()
+            GL.glEnableVertexAttribArray(loc)
+
+        with program:
+            GL.glUniformMatrix4fv(GL.glGetUniformLocation(program, "u_mvp"), 1, False, mat_mvp)
+            GL.glUniform1f(GL.glGetUniformLocation(program, "u_size"), float(self.size))
+            GL.glUniform1f(GL.glGetUniformLocation(program, "u_round"), 1.0 if points else 0.0)
+            GL.glDrawArrays(GL.GL_POINTS if points else GL.GL_LINES, 0, self.end)
+
+        for loc in (POSITION, COLOR):
+            GL.glDisableVertexAttribArray(loc)
+        if not points:
+            GL.glLineWidth(1.0)
+
+
+SHADER_LEGACY = {
+    GL.GL_VERTEX_SHADER: """
+        uniform mat4 u_mvp;
+        uniform float u_size;
+        attribute vec3 a_position;
+        attribute vec4 a_color;
+        varying vec4 v_color;
+        void main() {
+            gl_Position = u_mvp * vec4(a_position, 1.0);
+            gl_PointSize = u_size;
+            v_color = a_color;
+        }
+    """,
+    GL.GL_FRAGMENT_SHADER: """
+        #ifdef GL_ES
+        precision mediump float;
+        #endif
+        uniform float u_round;
+        varying vec4 v_color;
+        void main() {
+            if (v_color.a <= 0.0) discard;
+            if (u_round > 0.5) {
+                vec2 xy = (gl_PointCoord - 0.5) * 2.0;
+                if (dot(xy, xy) > 1.0) discard;
+            }
+            gl_FragColor = v_color;
+        }
+    """,
+}
+
+SHADER_CORE = {
+    GL.GL_VERTEX_SHADER: """
+        uniform mat4 u_mvp;
+        uniform float u_size;
+        in vec3 a_position;
+        in vec4 a_color;
+        out vec4 v_color;
+        void main() {
+            gl_Position = u_mvp * vec4(a_position, 1.0);
+            gl_PointSize = u_size;
+            v_color = a_color;
+        }
+    """,
+    GL.GL_FRAGMENT_SHADER: """
+        #ifdef GL_ES
+        precision mediump float;
+        #endif
+        uniform float u_round;
+        in vec4 v_color;
+        out vec4 fragColor;
+        void main() {
+            if (v_color.a <= 0.0) discard;
+            if (u_round > 0.5) {
+                vec2 xy = (gl_PointCoord - 0.5) * 2.0;
+                if (dot(xy, xy) > 1.0) discard;
+            }
+            fragColor = v_color;
+        }
+    """,
+}
@@ -0,0 +1,289 @@
+"""GL item drawing many copies of one wireframe with instanced rendering.
+
+The wireframe template is uploaded once, and every instance only adds a
+center and a scale. The item can hold several templates, the levels of
+detail of the same wireframe, and each instance is drawn with the template
+of its level. When the context has no instancing (OpenGL < 3.3 or OpenGL
+ES < 3.0), the item expands the instances on the CPU and draws them as
+plain lines, like GLLinePlotItem.
+"""
+import ctypes
+
+import numpy as np
+from OpenGL import GL
+from OpenGL.GL import shaders
+from PySide6.QtGui import QOpenGLContext
+from PySide6.QtOpenGL import QOpenGLBuffer
+from pyqtgraph.opengl.GLGraphicsItem import GLGraphicsItem
+
+# Vertex attribute locations:
+POSITION, CENTER, SCALE = 0, 1, 2
+
+
+def instancing_supported(context: QOpenGLContext) -> bool:
+    version = context.format().version()
+    if context.isOpenGLES():
+        return version >= (3, 0)
+    return version >= (3, 3) and bool(GL.glVertexAttribDivisor) and bool(GL.glDrawArraysInstanced)
+
+
+class InstancedWireframeItem(GLGraphicsItem):
+    """Draws the line segments of a template ("lines" mode vertices) once per
+    row of center and scale: vertex * scale + center."""
+
+    _shaderProgram = None
+
+    def __init__(self, parentItem=None, **kwds):
+        """All keyword arguments are passed to setData()"""
+        super().__init__()
+        self.setGLOptions(kwds.pop('glOptions', 'additive'))
+        self.templates = []
+        self.center = np.empty((0, 3), dtype=np.float32)
+        self.scale = np.empty((0, 3), dtype=np.float32)
+        self.level = np.zeros(0, dtype=int)
+        self.color = (1.0, 1.0, 1.0, 1.0)
+        self.width = 1.0
+        self.instanced = None  # Decided at the first paint, once there is a context
+
+        self.m_vbo_template = QOpenGLBuffer(QOpenGLBuffer.Type.VertexBuffer)
+        self.m_vbo_center = QOpenGLBuffer(QOpenGLBuffer.Type.VertexBuffer)
+        self.m_vbo_scale = QOpenGLBuffer(QOpenGLBuffer.Type.VertexBuffer)
+        self.m_vbo_expanded = QOpenGLBuffer(QOpenGLBuffer.Type.VertexBuffer)
+        self.dirty = set()
+
+        self.setParentItem(parentItem)
+        self.setData(**kwds)
+
+    def setData(self, **kwds):
+        """
+        template    (V, 3) vertices of the wireframe segments, two per segment.
+        templates   list of templates, one per level of detail.
+        center      (N, 3) translation of each instance.
+        scale       (N, 3) scale of each instance, applied before the translation.
+        level       (N,) template used by each instance, 0 if not given.
+        color       tuple of floats (0.0-1.0), for the whole item.
+        width       float specifying line width.
+        """
+        args = ['template', 'templates', 'center', 'scale', 'level', 'color', 'width']
+        for k in kwds.keys():
+            if k not in args:
+                raise Exception('Invalid keyword argument: %s (allowed arguments are %s)' % (k, str(args)))
+        if 'template' in kwds:
+            kwds['templates'] = [kwds.pop('template')]
+        if 'templates' in kwds:
+            templates = [np.ascontiguousarray(t, dtype=np.float32).reshape(-1, 3) for t in kwds.pop('templates')]
+            # The templates are usually shared by every item, only upload them when they change:
+            if len(templates) != len(self.templates) or any(a is not b for a, b in zip(templates, self.templates)):
+                self.templates = templates
+                self.dirty.add('templates')
+        for k in ('center', 'scale'):
+            if k in kwds:
+                setattr(self, k, np.ascontiguousarray(kwds.pop(k), dtype=np.float32).reshape(-1, 3))
+                self.dirty.add('instances')
+        if 'level' not in kwds and 'instances' in self.dirty and len(self.level) != len(self.center):
+            kwds['level'] = np.zeros(len(self.center), dtype=int)
+        if 'level' in kwds:
+            self.set_levels(kwds.pop('level'))
+        for k, v in kwds.items():
+            setattr(self, k, v)
+        if len(self.center) != len(self.scale) or len(self.level) != len(self.center):
+            raise ValueError("center, scale and level need one row per instance")
+        self.update()
+
+    def set_levels(self, level):
+        """Changes the level of detail of the instances without scheduling a
+        repaint, so it can be called while the view is painting."""
+        level = np.asarray(level, dtype=int)
+        if len(level) and level.max() >= len(self.templates):
+            raise ValueError("level out of the range of templates")
+        if not np.array_equal(level, self.level):
+            self.level = level
+            self.dirty.add('instances')
+
+    def vertex_count(self) -> int:
+        """Vertices drawn per frame."""
+        counts = np.array([len(t) for t in self.templates], dtype=int)
+        return int(counts[self.level].sum()) if len(counts) else 0
+
+    def expanded(self) -> np.ndarray:
+        """The vertices of every instance, as drawn without instancing."""
+        parts = []
+        for i, template in enumerate(self.templates):
+            mine = self.level == i
+            parts.append((template[None] * self.scale[mine, None] + self.center[mine, None]).reshape(-1, 3))
+        return np.concatenate(parts) if parts else np.empty((0, 3), dtype=np.float32)
+
+    @staticmethod
+    def upload_vbo(vbo, arr):
+        if not vbo.isCreated():
+            vbo.create()
+        vbo.bind()
+        if vbo.size() != arr.nbytes:
+            vbo.allocate(arr, arr.nbytes)
+        else:
+            vbo.write(0, arr, arr.nbytes)
+        vbo.release()
+
+    @staticmethod
+    def getShaderProgram():
+        klass = InstancedWireframeItem
+
+        if klass._shaderProgram is not None:
+            return klass._shaderProgram
+
+        ctx = QOpenGLContext.currentContext()
+        fmt = ctx.format()
+
+        if ctx.isOpenGLES():
+            if fmt.version() >= (3, 0):
+                glsl_version = "#version 300 es\n"
+                sources = SHADER_CORE
+            else:
+                glsl_version = ""
+                sources = SHADER_LEGACY
+        else:
+            if fmt.version() >= (3, 1):
+                glsl_version = "#version 140\n"
+                sources = SHADER_CORE
+            else:
+                glsl_version = ""
+                sources = SHADER_LEGACY
+
+        compiled = [shaders.compileShader([glsl_version, v], k) for k, v in sources.items()]
+        program = shaders.compileProgram(*compiled)
+
+        GL.glBindAttribLocation(program, POSITION, "a_position")
+        GL.glBindAttribLocation(program, CENTER, "a_center")
+        GL.glBindAttribLocation(program, SCALE, "a_scale")
+        GL.glLinkProgram(program)
+
+        klass._shaderProgram = program
+        return program
+
+    def _upload(self):
+        if not self.instanced:
+            self.upload_vbo(self.m_vbo_expanded, self.expanded())
+            return
+        if 'templates' in self.dirty:
+            self.upload_vbo(self.m_vbo_template, np.concatenate(self.templates))
+        if 'instances' in self.dirty:
+            # The instances of each level are drawn together, so they are uploaded sorted by level:
+            order = np.argsort(self.level, kind="stable")
+            self.upload_vbo(self.m_vbo_center, np.ascontiguousarray(self.center[order]))
+            self.upload_vbo(self.m_vbo_scale, np.ascontiguousarray(self.scale[order]))
+
+    def paint(self):
+        if not self.templates or len(self.center) == 0:
+            return
+        self.setupGLState()
+
+        mat_mvp = np.array(self.mvpMatrix().data(), dtype=np.float32)
+        context = QOpenGLContext.currentContext()
+        if self.instanced is None:
+            self.instanced = instancing_supported(context)
+
+        if self.dirty:
+            self._upload()
+            self.dirty = set()
+
+        program = self.getShaderProgram()
+
+        sfmt = context.format()
+        core_forward_compatible = (
+            sfmt.profile() == sfmt.OpenGLContextProfile.CoreProfile
+            and not sfmt.testOption(sfmt.FormatOption.DeprecatedFunctions)
+        )
+        if not core_forward_compatible:
+            # Core Forward Compatible profiles will return error for
+            # any width that is not 1.0
+            GL.glLineWidth(self.width)
+
+        with program:
+            GL.glUniformMatrix4fv(GL.glGetUniformLocation(program, "u_mvp"), 1, False, mat_mvp)
+            GL.glUniform4f(GL.glGetUniformLocation(program, "u_color"), *self.color)
+
+            if self.instanced:
+                self._paint_instanced()
+            else:
+                self.m_vbo_expanded.bind()
+                GL.glVertexAttribPointer(POSITION, 3, GL.GL_FLOAT, False, 0, None)
+                self.m_vbo_expanded.release()
+                GL.glVertexAttrib3f(CENTER, 0.0, 0.0, 0.0)
+                GL.glVertexAttrib3f(SCALE, 1.0, 1.0, 1.0)
+                GL.glEnableVertexAttribArray(POSITION)
+                GL.glDrawArrays(GL.GL_LINES, 0, self.vertex_count())
+                GL.glDisableVertexAttribArray(POSITION)
+
+        GL.glLineWidth(1.0)
+
+    def _paint_instanced(self):
+        self.m_vbo_template.bind()
+        GL.glVertexAttribPointer(POSITION, 3, GL.GL_FLOAT, False, 0, None)
+        self.m_vbo_template.release()
+        for loc in (CENTER, SCALE):
+            GL.glVertexAttribDivisor(loc, 1)
+        for loc in (POSITION, CENTER, SCALE):
+            GL.glEnableVertexAttribArray(loc)
+
+        first_vertex = 0
+        first_instance = 0
+        for template, count in zip(self.templates, np.bincount(self.level, minlength=len(self.templates))):
+            if count:
+                # Point the instance attributes at the first instance of this level:
+                offset = ctypes.c_void_p(first_instance * 3 * 4)
+                for loc, vbo in ((CENTER, self.m_vbo_center), (SCALE, self.m_vbo_scale)):
+                    vbo.bind()
+                    GL.glVertexAttribPointer(loc, 3, GL.GL_FLOAT, False, 0, offset)
+                    vbo.release()
+                GL.glDrawArraysInstanced(GL.GL_LINES, first_vertex, len(template), int(count))
+            first_vertex += len(template)
+            first_instance += int(count)
+
+        for loc in (POSITION, CENTER, SCALE):
+            # Other items expect per-vertex attributes:
+            GL.glVertexAttribDivisor(loc, 0)
+            GL.glDisableVertexAttribArray(loc)
+
+
+SHADER_LEGACY = {
+    GL.GL_VERTEX_SHADER: """
+        uniform mat4 u_mvp;
+        attribute vec3 a_position;
+        attribute vec3 a_center;
+        attribute vec3 a_scale;
+        void main() {
+            gl_Position = u_mvp * vec4(a_position * a_scale + a_center, 1.0);
+        }
+    """,
+    GL.GL_FRAGMENT_SHADER: """
+        #ifdef GL_ES
+        precision mediump float;
+        #endif
+        uniform vec4 u_color;
+        void main() {
+            gl_FragColor = u_color;
+        }
+    """,
+}
+
+SHADER_CORE = {
+    GL.GL_VERTEX_SHADER: """
+        uniform mat4 u_mvp;
+        in vec3 a_position;
+        in vec3 a_center;
+        in vec3 a_scale;
+        void main() {
+            gl_Position = u_mvp * vec4(a_position * a_scale + a_center, 1.0);
+        }
+    """,
+    GL.GL_FRAGMENT_SHADER: """
+        #ifdef GL_ES
+        precision mediump float;
+        #endif
+        uniform vec4 u_color;
+        out vec4 fragColor;
+        void main() {
+            fragColor = u_color;
+        }
+    """,
+}
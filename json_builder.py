@@ -1,10 +1,17 @@
 from dataclasses import dataclass, field
 import copy
-import json
 import logging
 
+from export_stamps import ExportStamp, get_stamp
+from template_cache import get_template
+from tracing import span
+from uasset_writer import save_uasset
 from uassetgen import JSON_to_uasset
 
+# Bump when a change in this module changes the generated uassets, so the
+# incremental batch build does not keep outputs from an older builder:
+BUILDER_VERSION = 1
+
 SERIALIZATION_DEPENDENCIES = {
     "FloodFillLine": {
         "Normal": [-2, -7],
@@ -34,6 +41,110 @@ SERIALIZATION_DEPENDENCIES = {
        }
 }
 
+# Writable slots of the templates in assets/default_assets. Each slot maps to
+# the path of keys and indices that leads to it inside the template, see
+# export_stamps.ExportStamp:
+EXPORT_SLOTS = {
+    "object_name": ("ObjectName",),
+    "outer_index": ("OuterIndex",),
+    "class_index": ("ClassIndex",),
+    "template_index": ("TemplateIndex",),
+    "serialization_before_create": ("SerializationBeforeCreateDependencies",),
+    "create_before_create": ("CreateBeforeCreateDependencies",),
+}
+
+TEMPLATE_SLOTS = {
+    "default_floodfillline": {
+        **EXPORT_SLOTS,
+        "points": ("Data", 0, "Value"),
+    },
+    "default_roomlinepoint": {
+        "x": ("Value", 0, "Value", 0, "Value", "X"),
+        "y": ("Value", 0, "Value", 0, "Value", "Y"),
+        "z": ("Value", 0, "Value", 0, "Value", "Z"),
+        "hrange": ("Value", 1, "Value"),
+        "vrange": ("Value", 2, "Value"),
+        "ceiling_noise_range": ("Value", 3, "Value"),
+        "wall_noise_range": ("Value", 4, "Value"),
+        "floor_noise_range": ("Value", 5, "Value"),
+        "ceiling_height": ("Value", 6, "Value"),
+        "height_scale": ("Value", 7, "Value"),
+        "floor_depth": ("Value", 8, "Value"),
+        "floor_angle": ("Value", 9, "Value"),
+    },
+    "default_entrance": {
+        **EXPORT_SLOTS,
+        "x": ("Data", 0, "Value", 0, "Value", "X"),
+        "y": ("Data", 0, "Value", 0, "Value", "Y"),
+        "z": ("Data", 0, "Value", 0, "Value", "Z"),
+        "pitch": ("Data", 1, "Value", 0, "Value", "Pitch"),
+        "yaw": ("Data", 1, "Value", 0, "Value", "Yaw"),
+        "roll": ("Data", 1, "Value", 0, "Value", "Roll"),
+        "entrance_type": ("Data", 2, "Value"),
+    },
+    "default_pillar_point": {
+        "x": ("Value", 0, "Value", 0, "Value", "X"),
+        "y": ("Value", 0, "Value", 0, "Value", "Y"),
+        "z": ("Value", 0, "Value", 0, "Value", "Z"),
+        "range_min": ("Value", 1, "Value", 0, "Value"),
+        "range_max": ("Value", 1, "Value", 1, "Value"),
+        "noise_range_min": ("Value", 2, "Value", 0, "Value"),
+        "noise_range_max": ("Value", 2, "Value", 1, "Value"),
+        "skew_factor_min": ("Value", 3, "Value", 0, "Value"),
+        "skew_factor_max": ("Value", 3, "Value", 1, "Value"),
+        "fill_amount_min": ("Value", 4, "Value", 0, "Value"),
+        "fill_amount_max": ("Value", 4, "Value", 1, "Value"),
+    },
+    "default_pillar": {
+        **EXPORT_SLOTS,
+        "points": ("Data", 0, "Value"),
+        "range_scale_min": ("Data", 1, "Value", 0, "Value"),
+        "range_scale_max": ("Data", 1, "Value", 1, "Value"),
+        "noise_range_scale_min": ("Data", 2, "Value", 0, "Value"),
+        "noise_range_scale_max": ("Data", 2, "Value", 1, "Value"),
+    },
+    "default_pe_minehead": {
+        **EXPORT_SLOTS,
+        "x": ("Data", 0, "Value", 0, "Value", "X"),
+        "y": ("Data", 0, "Value", 0, "Value", "Y"),
+        "z": ("Data", 0, "Value", 0, "Value", "Z"),
+    },
+    "default_pe_droppoddown": {
+        **EXPORT_SLOTS,
+        "x": ("Data", 0, "Value", 0, "Value", "X"),
+        "y": ("Data", 0, "Value", 0, "Value", "Y"),
+        "z": ("Data", 0, "Value", 0, "Value", "Z"),
+    },
+    # The RandomSelector keeps the ObjectName of the template:
+    "default_randomselector": {
+        "outer_index": ("OuterIndex",),
+        "class_index": ("ClassIndex",),
+        "template_index": ("TemplateIndex",),
+        "serialization_before_create": ("SerializationBeforeCreateDependencies",),
+        "create_before_create": ("CreateBeforeCreateDependencies",),
+        "create_before_serialization": ("CreateBeforeSerializationDependencies",),
+        "references": ("Data", 2, "Value"),
+    },
+    "default_randomselector_reference": {
+        "value": ("Value",),
+    },
+    # The Room is the outermost export, it has no OuterIndex to fill in:
+    "default_room": {
+        "object_name": ("ObjectName",),
+        "class_index": ("ClassIndex",),
+        "template_index": ("TemplateIndex",),
+        "serialization_before_create": ("SerializationBeforeCreateDependencies",),
+        "create_before_serialization": ("CreateBeforeSerializationDependencies",),
+        "references": ("Data", 0, "Value"),
+        "bounds": ("Data", 1, "Value"),
+        "tags": ("Data", 2, "Value", 0, "Value"),
+    },
+    "default_room_reference": {
+        "name": ("Name",),
+        "value": ("Value",),
+    },
+}
+
 @dataclass
 class Location:
     x: float 
@@ -169,76 +280,70 @@ class Entrance:
         return cls(**adjusted_dict)
 
 
-def generate_floodfill(df, dr, fflines, num, outer_index, room_is_pe):
-    points = []
-    new_ffill = copy.deepcopy(df)
-    for point in fflines:
-        new_point = copy.deepcopy(dr)
-        new_point["Value"][0]["Value"][0]["Value"]["X"] = point.location[0]
-        new_point["Value"][0]["Value"][0]["Value"]["Y"] = point.location[1]
-        new_point["Value"][0]["Value"][0]["Value"]["Z"] = point.location[2]
-        new_point["Value"][1]["Value"] = point.hrange
-        new_point["Value"][2]["Value"] = point.vrange
-        new_point["Value"][3]["Value"] = point.ceiling_noise_range
-        new_point["Value"][4]["Value"] = point.wall_noise_range
-        new_point["Value"][5]["Value"] = point.floor_noise_range
-        new_point["Value"][6]["Value"] = point.ceiling_height
-        new_point["Value"][7]["Value"] = point.height_scale
-        new_point["Value"][8]["Value"] = point.floor_depth
-        new_point["Value"][9]["Value"] = point.floor_angle
-        points.append(new_point)
-    new_ffill["Data"][0]["Value"] = points
-    new_ffill["ObjectName"] = f"FloodFillLine_{num}"
-    new_ffill["OuterIndex"] = outer_index
-    new_ffill["CreateBeforeCreateDependencies"] = [outer_index]
+def generate_floodfill(ffill_stamp, point_stamp, fflines, num, outer_index, room_is_pe):
+    points = [
+        point_stamp(
+            x=point.location[0],
+            y=point.location[1],
+            z=point.location[2],
+            hrange=point.hrange,
+            vrange=point.vrange,
+            ceiling_noise_range=point.ceiling_noise_range,
+            wall_noise_range=point.wall_noise_range,
+            floor_noise_range=point.floor_noise_range,
+            ceiling_height=point.ceiling_height,
+            height_scale=point.height_scale,
+            floor_depth=point.floor_depth,
+            floor_angle=point.floor_angle,
+        )
+        for point in fflines
+    ]
     if room_is_pe:
         serialization_idx = SERIALIZATION_DEPENDENCIES["FloodFillLine"]["PE"]
     else:
         serialization_idx = SERIALIZATION_DEPENDENCIES["FloodFillLine"]["Normal"]
-    new_ffill["ClassIndex"] = serialization_idx[0]
-    new_ffill["TemplateIndex"] = serialization_idx[1]
-    new_ffill["SerializationBeforeCreateDependencies"] = serialization_idx
-    return new_ffill
-
-
-def generate_pe_minehead(dm, minehead, num, outer_index):
-    new_minehead = copy.deepcopy(dm)
-    new_minehead["Data"][0]["Value"][0]["Value"]["X"] = minehead.x
-    new_minehead["Data"][0]["Value"][0]["Value"]["Y"] = minehead.y
-    new_minehead["Data"][0]["Value"][0]["Value"]["Z"] = minehead.z
-    new_minehead["ObjectName"] = f"DropPodCalldownLocationFeature_{num}"
-    new_minehead["OuterIndex"] = outer_index
-    new_minehead["CreateBeforeCreateDependencies"] = [outer_index]
+    return ffill_stamp(
+        points=points,
+        object_name=f"FloodFillLine_{num}",
+        outer_index=outer_index,
+        create_before_create=[outer_index],
+        class_index=serialization_idx[0],
+        template_index=serialization_idx[1],
+        serialization_before_create=serialization_idx,
+    )
+
+
+def generate_pe_minehead(minehead_stamp, minehead, num, outer_index):
     serialization_idx = SERIALIZATION_DEPENDENCIES["PE_MiningHead"]["PE"]
-    new_minehead["ClassIndex"] = serialization_idx[0]
-    new_minehead["TemplateIndex"] = serialization_idx[1]
-    new_minehead["SerializationBeforeCreateDependencies"] = serialization_idx
-    return new_minehead
-
-
-def generate_pe_droppoddown(dd, pod, num, outer_index):
-    new_minehead = copy.deepcopy(dd)
-    new_minehead["Data"][0]["Value"][0]["Value"]["X"] = pod.x
-    new_minehead["Data"][0]["Value"][0]["Value"]["Y"] = pod.y
-    new_minehead["Data"][0]["Value"][0]["Value"]["Z"] = pod.z
-    new_minehead["ObjectName"] = f"DropPodCalldownLocationFeature_{num+1}"
-    new_minehead["OuterIndex"] = outer_index
-    new_minehead["CreateBeforeCreateDependencies"] = [outer_index]
+    return minehead_stamp(
+        x=minehead.x,
+        y=minehead.y,
+        z=minehead.z,
+        object_name=f"DropPodCalldownLocationFeature_{num}",
+        outer_index=outer_index,
+        create_before_create=[outer_index],
+        class_index=serialization_idx[0],
+        template_index=serialization_idx[1],
+        serialization_before_create=serialization_idx,
+    )
+
+
+def generate_pe_droppoddown(pod_stamp, pod, num, outer_index):
     serialization_idx = SERIALIZATION_DEPENDENCIES["PE_PodDropDown"]["PE"]
-    new_minehead["ClassIndex"] = serialization_idx[0]
-    new_minehead["TemplateIndex"] = serialization_idx[1]
-    new_minehead["SerializationBeforeCreateDependencies"] = serialization_idx
-    return new_minehead
-
-
-def generate_entrance(de, entrance, num, outer_index, room_is_pe):
-    new_entrance = copy.deepcopy(de)
-    new_entrance["Data"][0]["Value"][0]["Value"]["X"] = entrance.location[0]
-    new_entrance["Data"][0]["Value"][0]["Value"]["Y"] = entrance.location[1]
-    new_entrance["Data"][0]["Value"][0]["Value"]["Z"] = entrance.location[2]
-    new_entrance["Data"][1]["Value"][0]["Value"]["Pitch"] = entrance.rotator[1]
-    new_entrance["Data"][1]["Value"][0]["Value"]["Yaw"] = entrance.rotator[2]
-    new_entrance["Data"][1]["Value"][0]["Value"]["Roll"] = entrance.rotator[0]
+    return pod_stamp(
+        x=pod.x,
+        y=pod.y,
+        z=pod.z,
+        object_name=f"DropPodCalldownLocationFeature_{num+1}",
+        outer_index=outer_index,
+        create_before_create=[outer_index],
+        class_index=serialization_idx[0],
+        template_index=serialization_idx[1],
+        serialization_before_create=serialization_idx,
+    )
+
+
+def generate_entrance(entrance_stamp, entrance, num, outer_index, room_is_pe):
     match entrance.entrance_type:
         case "Exit":
             entrance_type = "ECaveEntranceType::Exit"
@@ -251,55 +356,59 @@ def generate_entrance(de, entrance, num, outer_index, room_is_pe):
                 f"Unknown entrance type: {entrance.entrance_type}, defaulting to Exit"
             )
             entrance_type = "ECaveEntranceType::Exit"
-    new_entrance["Data"][2]["Value"] = entrance_type
-    new_entrance["ObjectName"] = f"EntranceFeature_{num}"
-    new_entrance["OuterIndex"] = outer_index
-    new_entrance["CreateBeforeCreateDependencies"] = [outer_index]
     if room_is_pe:
         serialization_idx = SERIALIZATION_DEPENDENCIES["Entrances"]["PE"]
     else:
         serialization_idx = SERIALIZATION_DEPENDENCIES["Entrances"]["Normal"]
-    new_entrance["ClassIndex"] = serialization_idx[0]
-    new_entrance["TemplateIndex"] = serialization_idx[1]
-    new_entrance["SerializationBeforeCreateDependencies"] = serialization_idx
-    return new_entrance
-
-def generate_pillar_point(dpp: dict, pillar_point: PillarPoint) -> dict:
-    new_pillar_point = copy.deepcopy(dpp)
-    new_pillar_point["Value"][0]["Value"][0]["Value"]["X"] = pillar_point.location.x
-    new_pillar_point["Value"][0]["Value"][0]["Value"]["Y"] = pillar_point.location.y
-    new_pillar_point["Value"][0]["Value"][0]["Value"]["Z"] = pillar_point.location.z
-    new_pillar_point["Value"][1]["Value"][0]["Value"] = pillar_point.points_range.min
-    new_pillar_point["Value"][1]["Value"][1]["Value"] = pillar_point.points_range.max
-    new_pillar_point["Value"][2]["Value"][0]["Value"] = pillar_point.noise_range.min
-    new_pillar_point["Value"][2]["Value"][1]["Value"] = pillar_point.noise_range.max
-    new_pillar_point["Value"][3]["Value"][0]["Value"] = pillar_point.skew_factor.min
-    new_pillar_point["Value"][3]["Value"][1]["Value"] = pillar_point.skew_factor.max
-    new_pillar_point["Value"][4]["Value"][0]["Value"] = pillar_point.fill_amount.min
-    new_pillar_point["Value"][4]["Value"][1]["Value"] = pillar_point.fill_amount.max
-
-    return new_pillar_point
-
-def generate_floodfillpillar(dp, dpp, pillar, num, outer_index, room_is_pe):
-    new_pillar = copy.deepcopy(dp)
-    new_pillar["Data"][0]["Value"] = [generate_pillar_point(dpp, p) for p in pillar.points]
-    # RangeScale:
-    new_pillar["Data"][1]["Value"][0]["Value"] = pillar.range_scale.min
-    new_pillar["Data"][1]["Value"][1]["Value"] = pillar.range_scale.max
-    # NoiseRangeScale:
-    new_pillar["Data"][2]["Value"][0]["Value"] = pillar.noise_range_scale.min
-    new_pillar["Data"][2]["Value"][1]["Value"] = pillar.noise_range_scale.max
-    new_pillar["ObjectName"] = f"FloodFillPillar_{num}"
-    new_pillar["OuterIndex"] = outer_index
-    new_pillar["CreateBeforeCreateDependencies"] = [outer_index]
+    return entrance_stamp(
+        x=entrance.location[0],
+        y=entrance.location[1],
+        z=entrance.location[2],
+        pitch=entrance.rotator[1],
+        yaw=entrance.rotator[2],
+        roll=entrance.rotator[0],
+        entrance_type=entrance_type,
+        object_name=f"EntranceFeature_{num}",
+        outer_index=outer_index,
+        create_before_create=[outer_index],
+        class_index=serialization_idx[0],
+        template_index=serialization_idx[1],
+        serialization_before_create=serialization_idx,
+    )
+
+def generate_pillar_point(point_stamp: ExportStamp, pillar_point: PillarPoint) -> dict:
+    return point_stamp(
+        x=pillar_point.location.x,
+        y=pillar_point.location.y,
+        z=pillar_point.location.z,
+        range_min=pillar_point.points_range.min,
+        range_max=pillar_point.points_range.max,
+        noise_range_min=pillar_point.noise_range.min,
+        noise_range_max=pillar_point.noise_range.max,
+        skew_factor_min=pillar_point.skew_factor.min,
+        skew_factor_max=pillar_point.skew_factor.max,
+        fill_amount_min=pillar_point.fill_amount.min,
+        fill_amount_max=pillar_point.fill_amount.max,
+    )
+
+def generate_floodfillpillar(pillar_stamp, point_stamp, pillar, num, outer_index, room_is_pe):
     if room_is_pe:
         serialization_idx = SERIALIZATION_DEPENDENCIES["FloodFillPillar"]["PE"]
     else:
         serialization_idx = SERIALIZATION_DEPENDENCIES["FloodFillPillar"]["Normal"]
-    new_pillar["ClassIndex"] = serialization_idx[0]
-    new_pillar["TemplateIndex"] = serialization_idx[1]
-    new_pillar["SerializationBeforeCreateDependencies"] = serialization_idx
-    return new_pillar
+    return pillar_stamp(
+        points=[generate_pillar_point(point_stamp, p) for p in pillar.points],
+        range_scale_min=pillar.range_scale.min,
+        range_scale_max=pillar.range_scale.max,
+        noise_range_scale_min=pillar.noise_range_scale.min,
+        noise_range_scale_max=pillar.noise_range_scale.max,
+        object_name=f"FloodFillPillar_{num}",
+        outer_index=outer_index,
+        create_before_create=[outer_index],
+        class_index=serialization_idx[0],
+        template_index=serialization_idx[1],
+        serialization_before_create=serialization_idx,
+    )
 
 def parse_room_json(room_json: dict) -> tuple:
     floodfilllines = []
@@ -322,8 +431,7 @@ def parse_room_json(room_json: dict) -> tuple:
     return floodfilllines, entrances, pillars, pe_mininghead, pe_poddropdown
 
 
-def generate_random_selector(drs: dict, drsr: dict, selector_refs: list, asset_list: list, outer_index: int, room_is_pe: bool) -> tuple[dict, list]:
-    new_rs = copy.deepcopy(drs)
+def generate_random_selector(selector_stamp: ExportStamp, reference_stamp: ExportStamp, selector_refs: list, asset_list: list, outer_index: int, room_is_pe: bool) -> tuple[dict, list]:
     new_references = []
     new_references_idx = []
     for selector in selector_refs:
@@ -332,63 +440,66 @@ def generate_random_selector(drs: dict, drsr: dict, selector_refs: list, asset_l
         except ValueError:
             logging.warning(f"RandomSelector reference {selector} not found in list: {asset_list}. Skipping.")
             continue
-        new_reference = copy.deepcopy(drsr)
-        new_reference["Value"] = index_ref
         new_references_idx.append(index_ref)
-        new_references.append(new_reference)
-    new_rs["Data"][2]["Value"] = new_references
-    new_rs["CreateBeforeSerializationDependencies"] = new_references_idx
-    new_rs["CreateBeforeCreateDependencies"] = [outer_index]
-    new_rs["OuterIndex"] = outer_index
+        new_references.append(reference_stamp(value=index_ref))
     if room_is_pe:
         serialization_idx = SERIALIZATION_DEPENDENCIES["RandomSelector"]["PE"]
     else:
         serialization_idx = SERIALIZATION_DEPENDENCIES["RandomSelector"]["Normal"]
-    new_rs["ClassIndex"] = serialization_idx[0]
-    new_rs["TemplateIndex"] = serialization_idx[1]
-    new_rs["SerializationBeforeCreateDependencies"] = serialization_idx
+    new_rs = selector_stamp(
+        references=new_references,
+        create_before_serialization=new_references_idx,
+        create_before_create=[outer_index],
+        outer_index=outer_index,
+        class_index=serialization_idx[0],
+        template_index=serialization_idx[1],
+        serialization_before_create=serialization_idx,
+    )
     return new_rs, new_references_idx
                 
            
 
-def generate_room(dr, drr, tags, bounds, outer_index, name, selector_idx_list, room_is_pe):
-    new_room = copy.deepcopy(dr)
-    new_room["Data"][1]["Value"] = float(bounds)
-    new_room["Data"][2]["Value"][0]["Value"] = tags
-    new_room["ObjectName"] = name
-    references = []
-    for ii in range(outer_index - 1):
-        if ii + 1 not in selector_idx_list:
-            new_reference = copy.deepcopy(drr)
-            new_reference["Name"] = str(ii)
-            new_reference["Value"] = ii + 1
-            references.append(new_reference)
-    new_room["Data"][0]["Value"] = references
+def generate_room(room_stamp, reference_stamp, tags, bounds, outer_index, name, selector_idx_list, room_is_pe):
+    references = [
+        reference_stamp(name=str(ii), value=ii + 1)
+        for ii in range(outer_index - 1)
+        if ii + 1 not in selector_idx_list
+    ]
     if room_is_pe:
-        new_room["CreateBeforeSerializationDependencies"] = [
+        create_before_serialization = [
             x for x in range(1, outer_index) if x not in selector_idx_list
         ] + [-24]
     else:
-        new_room["CreateBeforeSerializationDependencies"] = [
+        create_before_serialization = [
             x for x in range(1, outer_index) if x not in selector_idx_list
         ] + [-13] 
     if room_is_pe:
         serialization_idx = SERIALIZATION_DEPENDENCIES["Room"]["PE"]
     else:
         serialization_idx = SERIALIZATION_DEPENDENCIES["Room"]["Normal"]
-    new_room["ClassIndex"] = serialization_idx[0]
-    new_room["TemplateIndex"] = serialization_idx[1]
-    new_room["SerializationBeforeCreateDependencies"] = serialization_idx
-    return new_room
+    return room_stamp(
+        references=references,
+        bounds=float(bounds),
+        tags=tags,
+        object_name=name,
+        create_before_serialization=create_before_serialization,
+        class_index=serialization_idx[0],
+        template_index=serialization_idx[1],
+        serialization_before_create=serialization_idx,
+    )
+
+def _stamp(name: str) -> ExportStamp:
+    return get_stamp(name, TEMPLATE_SLOTS[name])
 
 def list_nested_keys(main_dict: dict, keys: list) -> list:
     key_views = [list(main_dict.get(key, {}).keys()) for key in keys]
     return [item for sublist in key_views for item in sublist]
 
 
-def build_json_and_uasset(room_json: dict):
-
-    FLOODFILLLINES, ENTRANCES, PILLARS, PE_MININGHEAD, PE_PODDROPDOWN = parse_room_json(room_json)
+def build_asset_json(room_json: dict) -> dict:
+    """Builds the UAssetAPI JSON of the room, ready for JSON_to_uasset."""
+    with span("parse_room_json"):
+        FLOODFILLLINES, ENTRANCES, PILLARS, PE_MININGHEAD, PE_PODDROPDOWN = parse_room_json(room_json)
     ROOM_NAME = room_json["Name"]
     TAGS = room_json["Tags"]
     BOUNDS = room_json["Bounds"]
@@ -399,93 +510,88 @@ def build_json_and_uasset(room_json: dict):
 
     OUTER_ROOM_INDEX = len(asset_list) + 1
 
-    with open("assets/default_assets/default_floodfillline.json", "r") as f:
-        default_floodfillline = json.load(f)
-    with open("assets/default_assets/default_roomlinepoint.json", "r") as f:
-        default_roomlinepoint = json.load(f)
-    with open("assets/default_assets/default_entrance.json", "r") as f:
-        default_entrance = json.load(f)
-    with open("assets/default_assets/default_room.json", "r") as f:
-        default_room = json.load(f)
-    with open("assets/default_assets/default_room_reference.json", "r") as f:
-        default_room_reference = json.load(f)
-    if room_is_pe:
-        with open("assets/default_assets/default_asset_pe.json", "r") as f:
-            default_asset = json.load(f)
-    else:
-        with open("assets/default_assets/default_asset.json", "r") as f:
-            default_asset = json.load(f)
-    with open("assets/default_assets/default_randomselector.json", "r") as f:
-        default_random_selector = json.load(f)
-    with open("assets/default_assets/default_randomselector_reference.json", "r") as f:
-        default_random_selector_reference = json.load(f)
-    with open("assets/default_assets/default_pillar_point.json", "r") as f:
-        default_pillar_point = json.load(f)
-    with open("assets/default_assets/default_pillar.json", "r") as f:
-        default_pillar = json.load(f)
-    with open("assets/default_assets/default_pe_minehead.json", "r") as f:
-        default_pe_minehead = json.load(f)
-    with open("assets/default_assets/default_pe_droppoddown.json", "r") as f:
-        default_pe_droppoddown = json.load(f)
-
-
-    floodfill_list = [
-        generate_floodfill(
-            default_floodfillline,
-            default_roomlinepoint,
-            ffill,
-            ii,
-            OUTER_ROOM_INDEX,
-            room_is_pe
-        )
-        for ii, ffill in enumerate(FLOODFILLLINES)
-    ]
-    entrance_list = [
-        generate_entrance(default_entrance, e, ii, OUTER_ROOM_INDEX, room_is_pe)
-        for ii, e in enumerate(ENTRANCES)
-    ]
-    
-    if "FloodFillPillars" in room_json:
-        pillar_list = [
-            generate_floodfillpillar(default_pillar, default_pillar_point, p, ii, OUTER_ROOM_INDEX, room_is_pe)
-            for ii, p in enumerate(PILLARS)
+    with span("templates"):
+        default_floodfillline = _stamp("default_floodfillline")
+        default_roomlinepoint = _stamp("default_roomlinepoint")
+        default_entrance = _stamp("default_entrance")
+        default_room = _stamp("default_room")
+        default_room_reference = _stamp("default_room_reference")
+        default_random_selector = _stamp("default_randomselector")
+        default_random_selector_reference = _stamp("default_randomselector_reference")
+        default_pillar_point = _stamp("default_pillar_point")
+        default_pillar = _stamp("default_pillar")
+        default_pe_minehead = _stamp("default_pe_minehead")
+        default_pe_droppoddown = _stamp("default_pe_droppoddown")
+    # The header template is the only one we modify in place, so we need our own copy:
+    with span("deepcopy"):
+        if room_is_pe:
+            default_asset = copy.deepcopy(get_template("default_asset_pe"))
+        else:
+            default_asset = copy.deepcopy(get_template("default_asset"))
+
+    with span("FloodFillLines", lines=len(FLOODFILLLINES)):
+        floodfill_list = [
+            generate_floodfill(
+                default_floodfillline,
+                default_roomlinepoint,
+                ffill,
+                ii,
+                OUTER_ROOM_INDEX,
+                room_is_pe
+            )
+            for ii, ffill in enumerate(FLOODFILLLINES)
         ]
-    else:
-        pillar_list = []
-
-    selector_list = []
-    selector_idx_list = []
-    if "RandomSelectors" in room_json:
-        for selector in room_json["RandomSelectors"]:
-            new_sel_json, sel_idx = generate_random_selector(default_random_selector, default_random_selector_reference, room_json["RandomSelectors"][selector], asset_list, OUTER_ROOM_INDEX, room_is_pe)
-            selector_list.append(new_sel_json)
-            selector_idx_list.extend(sel_idx)
-
-    if "PE_MiningHead" in room_json:
-        minehead_list = [
-                generate_pe_minehead(default_pe_minehead, minehead, num, OUTER_ROOM_INDEX) for num, minehead in enumerate(PE_MININGHEAD)
+    with span("Entrances", entrances=len(ENTRANCES)):
+        entrance_list = [
+            generate_entrance(default_entrance, e, ii, OUTER_ROOM_INDEX, room_is_pe)
+            for ii, e in enumerate(ENTRANCES)
         ]
-    else:
-        minehead_list = []
 
-    if "PE_PodDropDown" in room_json:
-        droppoddown_list = [
-                generate_pe_droppoddown(default_pe_droppoddown, pod, num, OUTER_ROOM_INDEX) for num, pod in enumerate(PE_PODDROPDOWN)
-        ]
-    else:
-        droppoddown_list = []
-
-
-    room = generate_room(
-        default_room,
-        default_room_reference,
-        TAGS,
-        BOUNDS,
-        OUTER_ROOM_INDEX,
-        ROOM_NAME,
-        selector_idx_list,
-        room_is_pe
-    )
+    with span("FloodFillPillars", pillars=len(PILLARS or [])):
+        if "FloodFillPillars" in room_json:
+            pillar_list = [
+                generate_floodfillpillar(default_pillar, default_pillar_point, p, ii, OUTER_ROOM_INDEX, room_is_pe)
+                for ii, p in enumerate(PILLARS)
+            ]
+        else:
+            pillar_list = []
+
+    with span("RandomSelectors", selectors=len(room_json.get("RandomSelectors", {}))):
+        selector_list = []
+        selector_idx_list = []
+        if "RandomSelectors" in room_json:
+            for selector in room_json["RandomSelectors"]:
+                new_sel_json, sel_idx = generate_random_selector(default_random_selector, default_random_selector_reference, room_json["RandomSelectors"][selector], asset_list, OUTER_ROOM_INDEX, room_is_pe)
+                selector_list.append(new_sel_json)
+                selector_idx_list.extend(sel_idx)
+
+    with span("PE features"):
+        if "PE_MiningHead" in room_json:
+            minehead_list = [
+                    generate_pe_minehead(default_pe_minehead, minehead, num, OUTER_ROOM_INDEX) for num, minehead in enumerate(PE_MININGHEAD)
+            ]
+        else:
+            minehead_list = []
+
+        if "PE_PodDropDown" in room_json:
+            droppoddown_list = [
+                    generate_pe_droppoddown(default_pe_droppoddown, pod, num, OUTER_ROOM_INDEX) for num, pod in enumerate(PE_PODDROPDOWN)
+            ]
+        else:
+            droppoddown_list = []
+
+
+    with span("Room"):
+        room = generate_room(
+            default_room,
+            default_room_reference,
+            TAGS,
+            BOUNDS,
+            OUTER_ROOM_INDEX,
+            ROOM_NAME,
+            selector_idx_list,
+            room_is_pe
+        )
 
     for ffill in floodfill_list:
         default_asset["Exports"].append(ffill)
@@ -513,5 +619,14 @@ def build_json_and_uasset(room_json: dict):
     #with open(f"assets/{ROOM_NAME}.json", "w") as f:
     #    json.dump(default_asset, f, indent=4)
 
-    # We generate the asset:
-    JSON_to_uasset(default_asset, ROOM_NAME)
+    return default_asset
+
+
+def build_json_and_uasset(room_json: dict, native: bool = False):
+    # We generate the asset, with UAssetAPI unless the native writer is requested:
+    with span("build_json_and_uasset", room=room_json.get("Name")):
+        with span("build_asset_json"):
+            asset = build_asset_json(room_json)
+        if native:
+            return save_uasset(asset, room_json["Name"])
+        return JSON_to_uasset(asset, room_json["Name"])
@@ -0,0 +1,342 @@
+"""Incremental parsing of the JSON in the editor.
+
+JsonDocument keeps the text, the parsed JSON and an index of the text range
+of every value, by JSON path like FloodFillLines/Floodfill_2/Points/1/HRange.
+The index is built lazily, one container at a time, and only along the paths
+that are edited or looked up.
+
+After an edit, only the smallest object or array around the edited text is
+parsed again. A number or a string can grow or shrink with the edit, so they
+are parsed again with the container holding them. When the new text of that
+container is not a single JSON value any more, its parent is tried, up to a
+full json.loads of the document. So the result, and the error of an invalid
+document, are the ones json.loads gives.
+
+Edits are recorded from the GUI thread and applied by sync(), usually in a
+worker thread. Their positions are Python string indices, while Qt counts
+UTF-16 code units: Utf16Offsets converts them.
+"""
+import json
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from json.decoder import WHITESPACE, JSONDecodeError, scanstring
+from json.scanner import make_scanner
+
+_scan_once = make_scanner(json.JSONDecoder())
+_OUTSIDE_BMP = re.compile("[\U00010000-\U0010FFFF]")
+
+
+class _Node:
+    """Text range of a value: offset from the start of its parent value, and
+    length. children is None until the value is indexed."""
+
+    __slots__ = ("offset", "length", "children", "keys")
+
+    def __init__(self, offset: int, length: int):
+        self.offset = offset
+        self.length = length
+        self.children = None  # list of _Node, in text order
+        self.keys = None  # list of the keys (objects) or indices (arrays)
+
+
+def _skip(text: str, i: int) -> int:
+    return WHITESPACE.match(text, i).end()
+
+
+def _index_children(text: str, start: int, node: _Node):
+    """Fills the children of the object or array starting at text[start]."""
+    children = []
+    keys = []
+    is_object = text[start] == "{"
+    i = _skip(text, start + 1)
+    if text[i] not in "}]":
+        while True:
+            if is_object:
+                key, i = scanstring(text, i + 1)
+                i = _skip(text, _skip(text, i) + 1)  # Past the colon
+            else:
+                key = len(keys)
+            _, end = _scan_once(text, i)
+            children.append(_Node(i - start, end - i))
+            keys.append(key)
+            i = _skip(text, end)
+            if text[i] != ",":
+                break
+            i = _skip(text, i + 1)
+    node.children = children
+    node.keys = keys
+
+
+def _replaced(value, path: list, new_value):
+    """Copy of value with new_value at path. Only the containers on the path
+    are copied, so the values that did not change keep their identity."""
+    if not path:
+        return new_value
+    copy = dict(value) if isinstance(value, dict) else list(value)
+    copy[path[0]] = _replaced(value[path[0]], path[1:], new_value)
+    return copy
+
+
+def split_path(path) -> tuple:
+    """("FloodFillLines", "Floodfill_2", "Points", 1) from
+    "FloodFillLines/Floodfill_2/Points/1". Tuples are returned as they are."""
+    if isinstance(path, tuple):
+        return path
+    return tuple(int(part) if part.isdigit() else part for part in path.split("/") if part)
+
+
+def _wide_positions(text: str) -> list[int]:
+    """UTF-16 positions of the characters of text outside the BMP, which take
+    two code units (a surrogate pair)."""
+    if text.isascii():
+        return []
+    return [match.start() + i for i, match in enumerate(_OUTSIDE_BMP.finditer(text))]
+
+
+class Utf16Offsets:
+    """Converts the UTF-16 positions of Qt to indices of the Python string of
+    the same text, and back. Only the characters outside the BMP (emoji, some
+    CJK) differ, so their positions are kept edit by edit, and the
+    conversions are free while the text has none."""
+
+    def __init__(self, text: str = ""):
+        self.reset(text)
+
+    def reset(self, text: str):
+        self._wide = _wide_positions(text)
+
+    def edit(self, position: int, removed: int, added: str) -> tuple[int, int]:
+        """Records that removed code units at position were replaced by added,
+        and returns position and removed as Python index and length, for
+        JsonDocument.record_edit."""
+        lo = bisect_left(self._wide, position)
+        hi = bisect_left(self._wide, position + removed)
+        added_wide = _wide_positions(added)
+        shift = len(added) + len(added_wide) - removed
+        self._wide[lo:] = [position + p for p in added_wide] + [p + shift for p in self._wide[hi:]]
+        return position - lo, removed - (hi - lo)
+
+    def to_index(self, position: int) -> int:
+        return position - bisect_left(self._wide, position)
+
+    def to_utf16(self, index: int) -> int:
+        # The Python index of the i-th wide character is self._wide[i] - i:
+        return index + bisect_left(range(len(self._wide)), index, key=lambda i: self._wide[i] - i)
+
+
+class JsonDocument:
+    """The editor text and its parsed JSON, kept in sync edit by edit."""
+
+    def __init__(self, text: str = ""):
+        self._edits = []
+        self._edits_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.full_parses = 0
+        self.partial_parses = 0
+        self._reset(text)
+
+    # ---------- GUI thread ----------
+    def record_edit(self, position: int, removed: int, added: str):
+        """Records that removed characters at position were replaced by added,
+        in the coordinates of the text after the previous edits."""
+        with self._edits_lock:
+            self._edits.append((position, removed, added))
+
+    def record_reset(self, text: str):
+        """Records that the whole text was replaced."""
+        with self._edits_lock:
+            self._edits = [(None, None, text)]
+
+    # ---------- Worker thread ----------
+    def sync(self):
+        """Applies the recorded edits and returns the parsed JSON. Raises
+        json.JSONDecodeError, like json.loads, when the text is not valid."""
+        with self._edits_lock:
+            edits, self._edits = self._edits, []
+        with self._lock:
+            if edits:
+                self._apply(edits)
+            if self.error is not None:
+                raise self.error
+            return self.data
+
+    def text(self) -> str:
+        with self._lock:
+            return self._text
+
+    def span(self, path) -> tuple[int, int] | None:
+        """(start, end) of the value at path in the text, or None if there is
+        no such value or the text is not valid."""
+        with self._lock:
+            if self.error is not None or self.root is None:
+                return None
+            start, node = self.root.offset, self.root
+            for key in split_path(path):
+                if self._text[start] not in "{[":
+                    return None
+                if node.children is None:
+                    _index_children(self._text, start, node)
+                if self._text[start] == "{" and isinstance(key, int):
+                    key = str(key)
+                if key not in node.keys:
+                    return None
+                # The last duplicate of a key is the one json.loads keeps:
+                node = node.children[len(node.keys) - 1 - node.keys[::-1].index(key)]
+                start += node.offset
+            return start, start + node.length
+
+    def path_at(self, position: int) -> tuple:
+        """Path of the innermost value around position in the text."""
+        with self._lock:
+            path = []
+            if self.error is not None or self.root is None:
+                return ()
+            start, node = self.root.offset, self.root
+            while self._text[start] in "{[":
+                if node.children is None:
+                    _index_children(self._text, start, node)
+                i = bisect_right(node.children, position - start, key=lambda child: child.offset) - 1
+                if i < 0 or position - start >= node.children[i].offset + node.children[i].length:
+                    break
+                path.append(node.keys[i])
+                node = node.children[i]
+                start += node.offset
+            return tuple(path)
+
+    def _reset(self, text: str):
+        self._text = text
+        self.root = None
+        self.data = None
+        self.error = None
+        self._full_parse()
+
+    def _full_parse(self):
+        self.full_parses += 1
+        try:
+            self.data = json.loads(self._text)
+        except JSONDecodeError as e:
+            self.data = None
+            self.root = None
+            self.error = e
+            return
+        self.error = None
+        start = _skip(self._text, 0)
+        end = len(self._text.rstrip(" \t\n\r"))
+        self.root = _Node(start, end - start)
+
+    def _apply(self, edits: list):
+        if edits[0][0] is None:
+            self._reset(edits[0][2])
+            edits = edits[1:]
+            if not edits:
+                return
+
+        # The union of the edits, as [old_lo, old_hi) in the old text and
+        # [new_lo, new_hi) in the new text:
+        text = self._text
+        old_lo = old_hi = new_lo = new_hi = None
+        for position, removed, added in edits:
+            text = text[:position] + added + text[position + removed:]
+            end = position + removed
+            if old_lo is None:
+                old_lo, old_hi = position, end
+                new_lo, new_hi = position, position + len(added)
+                continue
+            shift = new_hi - old_hi
+            if position < new_lo:
+                old_lo = new_lo = position
+            if end > new_hi:
+                old_hi = end - shift
+                new_hi = end
+            new_hi += len(added) - removed
+        delta = len(text) - len(self._text)
+        old_text, self._text = self._text, text
+
+        if self.root is None:
+            self._full_parse()
+            return
+
+        # The containers around the edit, from the root:
+        path = []
+        nodes = [(self.root, self.root.offset, None)]
+        node, start = self.root, self.root.offset
+        while True:
+            if old_text[start] not in "{[" or not (start < old_lo and old_hi < start + node.length):
+                # An edit over a scalar or over the brackets: the parent is parsed again
+                nodes.pop()
+                path = path[:-1]
+                break
+            if node.children is None:
+                _index_children(old_text, start, node)
+            i = bisect_right(node.children, old_lo - start, key=lambda child: child.offset) - 1
+            if i < 0 or len(set(node.keys)) != len(node.keys):
+                break
+            child = node.children[i]
+            if old_hi > start + child.offset + child.length:
+                break
+            path.append(node.keys[i])
+            nodes.append((child, start + child.offset, i))
+            node, start = child, start + child.offset
+
+        # Parse the innermost container again, or the ones above if it broke:
+        while nodes:
+            node, start, _ = nodes[-1]
+            try:
+                value, end = _scan_once(self._text, start)
+            except (JSONDecodeError, StopIteration):
+                value, end = None, None
+            if end == start + node.length + delta:
+                break
+            nodes.pop()
+            path = path[:-1]
+        if not nodes:
+            self._full_parse()
+            return
+
+        self.partial_parses += 1
+        node.length += delta
+        node.children = None
+        node.keys = None
+        # The ancestors grow with the edit, and the values after it move:
+        for (parent, _, _), (_, _, i) in zip(nodes[:-1], nodes[1:]):
+            parent.length += delta
+            for sibling in parent.children[i + 1:]:
+                sibling.offset += delta
+        self.data = _replaced(self.data, path, value)
+
+
+def benchmark(text: str, repeats: int = 20) -> dict:
+    """Mean time to get the JSON after changing one digit of the last
+    FloodFillLine point, with json.loads of the whole text (the previous
+    implementation) and with JsonDocument."""
+    document = JsonDocument(text)
+    data = document.sync()
+    line = list(data["FloodFillLines"])[-1]
+    point = len(data["FloodFillLines"][line]["Points"]) - 1
+    start, end = document.span(("FloodFillLines", line, "Points", point, "HRange"))
+
+    results = {}
+    started = time.perf_counter()
+    for _ in range(repeats):
+        json.loads(text)
+    results["json_loads_s"] = (time.perf_counter() - started) / repeats
+
+    started = time.perf_counter()
+    for i in range(repeats):
+        document.record_edit(start, end - start, str(i % 10).rjust(end - start, "1"))
+        document.sync()
+    results["json_document_s"] = (time.perf_counter() - started) / repeats
+    results["identical"] = document.sync() == json.loads(document.text())
+    results["partial_parses"] = document.partial_parses
+    return results
+
+
+if __name__ == "__main__":
+    # Editing benchmark: python json_document.py <room.json> [repeats]
+    import sys
+
+    with open(sys.argv[1], "r") as f:
+        room_text = json.dumps(json.load(f), indent=4)
+    print(benchmark(room_text, int(sys.argv[2]) if len(sys.argv) > 2 else 20))
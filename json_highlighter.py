@@ -0,0 +1,120 @@
+"""Syntax highlighting of the JSON in the editor.
+
+Each block (line) is read once by a single tokenizer regex, so every
+character gets at most one format: a number inside a string is part of the
+string. JSON strings cannot span lines, so a string left open ends with its
+line, and the blocks below keep their state while a quote is being typed.
+Only a line ending in a backslash continues its string on the next block,
+through the block state.
+"""
+import re
+import time
+
+from PySide6.QtGui import QColor, QSyntaxHighlighter, QTextCharFormat
+
+# Block states:
+NORMAL = -1  # What Qt gives blocks that were never highlighted
+IN_STRING = 1
+
+_STRING_BODY = r'[^"\\]*(?:\\.[^"\\]*)*'
+# A key is a closed string before a colon. A string still open at the end of
+# the line ends there, unless its last character is a backslash: then it
+# goes on to the next block (continued):
+TOKENS = re.compile(
+    rf'(?P<key>"{_STRING_BODY}")(?=\s*:)'
+    rf'|(?P<string>"{_STRING_BODY}(?P<close>"|(?P<continued>\\)?$))'
+    r'|(?P<number>-?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)'
+    r'|(?P<keyword>\b(?:true|false|null)\b)'
+    r'|(?P<brace>[\[\]{}])'
+)
+STRING_REST = re.compile(rf'{_STRING_BODY}(?P<close>"|(?P<continued>\\)?$)')
+
+DARK_COLORS = {
+    "key": "#9cdcfe",  # Light blue
+    "string": "#ce9178",  # Orange
+    "number": "#b5cea8",  # Light green
+    "keyword": "#569cd6",  # Blue
+    "brace": "#ffd700",  # Gold
+}
+LIGHT_COLORS = {
+    "key": "#0451a5",
+    "string": "#a31515",
+    "number": "#098658",
+    "keyword": "#0000ff",
+    "brace": "#000000",
+}
+
+
+def _utf16_offsets(text: str) -> list[int]:
+    """Qt positions count UTF-16 code units: offsets[i] is the position of
+    text[i]."""
+    offsets = [0]
+    for char in text:
+        offsets.append(offsets[-1] + (2 if ord(char) > 0xFFFF else 1))
+    return offsets
+
+
+class JsonHighlighter(QSyntaxHighlighter):
+    """Syntax highlighter for JSON."""
+
+    def __init__(self, parent=None, dark_mode=True):
+        super().__init__(parent)
+        self.formats = {}
+        for token, color in (DARK_COLORS if dark_mode else LIGHT_COLORS).items():
+            fmt = QTextCharFormat()
+            fmt.setForeground(QColor(color))
+            self.formats[token] = fmt
+
+    def highlightBlock(self, text):
+        formats = self.formats
+        # Qt positions count UTF-16 code units, Python ones code points:
+        offsets = None if text.isascii() else _utf16_offsets(text)
+        state = NORMAL
+
+        position = 0
+        if self.previousBlockState() == IN_STRING:
+            match = STRING_REST.match(text)
+            position = match.end()
+            if match["continued"]:
+                state = IN_STRING
+            self.setFormat(0, offsets[position] if offsets else position, formats["string"])
+
+        for match in TOKENS.finditer(text, position):
+            token = match.lastgroup
+            start, end = match.span()
+            if token == "string" and match["continued"]:
+                state = IN_STRING
+            if offsets:
+                start, end = offsets[start], offsets[end]
+            self.setFormat(start, end - start, formats[token])
+        self.setCurrentBlockState(state)
+
+
+def benchmark(text: str, repeats: int = 3) -> dict:
+    """Mean time to highlight the whole text, as after setPlainText in the
+    editor. Needs a QGuiApplication."""
+    from PySide6.QtGui import QTextDocument
+
+    document = QTextDocument()
+    document.setPlainText(text)
+    highlighter = JsonHighlighter(document)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        highlighter.rehighlight()
+    return {
+        "lines": document.blockCount(),
+        "highlight_s": (time.perf_counter() - start) / repeats,
+    }
+
+
+if __name__ == "__main__":
+    # Highlighting benchmark: python json_highlighter.py <room.json> [repeats]
+    import json
+    import sys
+
+    from PySide6.QtWidgets import QApplication
+
+    qt_app = QApplication(sys.argv[:1])
+    with open(sys.argv[1], "r") as f:
+        room_text = json.dumps(json.load(f), indent=4)
+    print(benchmark(room_text, int(sys.argv[2]) if len(sys.argv) > 2 else 3))
@@ -1,101 +1,83 @@
+import os
 import sys
 import json
 import argparse
 import logging
-from pathlib import Path
+import time
+from dataclasses import dataclass
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QSplitter, QWidget, QVBoxLayout,
     QHBoxLayout, QPushButton, QCheckBox, QPlainTextEdit
 )
-from PySide6.QtCore import Qt, QTimer, QRect, QSize, QRegularExpression
+from PySide6.QtCore import Qt, QTimer, QRect, QSize, QThreadPool
 from PySide6.QtGui import (
-    QSyntaxHighlighter, QTextCharFormat, QColor, QFont, QPainter
+    QColor, QFont, QPainter, QTextCursor
 )
 
-import pyqtgraph.opengl as gl
-
 from jsonschema import ValidationError
 from room_parser import validate_room
-from room_viewer import room_plotter_3d
+from room_viewer import RoomView, ScenePlan, hidden_layers
+from room_index import RoomIndex
+from background import LatestJobRunner
+from json_document import JsonDocument, Utf16Offsets
+from json_highlighter import JsonHighlighter
 from json_builder import build_json_and_uasset
+from uassetgen import get_session
+from batch import LOG_FORMAT, run_batch
+import memory_profile
+import tracing
+from tracing import span
+
+
+# What QTextDocument.toPlainText() turns the separators of selectedText() into:
+PLAIN_TEXT = str.maketrans({"\u2029": "\n", "\u2028": "\n", "\ufdd0": "\n", "\ufdd1": "\n", "\u00a0": " "})
 
 
 def setup_logging(level=logging.INFO):
     logging.basicConfig(
         level=level,
-        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        format=LOG_FORMAT,
     )
 
 
-class JsonHighlighter(QSyntaxHighlighter):
-    """Syntax highlighter for JSON."""
-
-    def __init__(self, parent=None, dark_mode=True):
-        super().__init__(parent)
-        self.highlighting_rules = []
-
-        if dark_mode:
-            # Dark mode colors
-            key_format = QTextCharFormat()
-            key_format.setForeground(QColor("#9cdcfe"))  # Light blue
-
-            string_format = QTextCharFormat()
-            string_format.setForeground(QColor("#ce9178"))  # Orange
-
-            number_format = QTextCharFormat()
-            number_format.setForeground(QColor("#b5cea8"))  # Light green
-
-            keyword_format = QTextCharFormat()
-            keyword_format.setForeground(QColor("#569cd6"))  # Blue
-
-            brace_format = QTextCharFormat()
-            brace_format.setForeground(QColor("#ffd700"))  # Gold
+@dataclass
+class RoomUpdate:
+    """Result of parsing, validating and building the geometry of the editor
+    text, made in a worker thread."""
+    room_json: dict | None = None
+    plan: ScenePlan | None = None
+    error: str | None = None
+    seconds: float = 0.0  # Spent in the worker
+
+
+class UpdateDelay:
+    """Debounce delay of the editor updates. It follows the measured cost of
+    an update (parse, validate and geometry in the worker, plus the GL upload)
+    times factor, between min_ms and max_ms. Small rooms update almost as
+    the user types, and large ones wait until the typing pauses."""
+
+    def __init__(self, min_ms: int = 30, max_ms: int = 1500, factor: float = 2.0, smoothing: float = 0.3, initial_ms: int = 300):
+        if min_ms > max_ms:
+            raise ValueError(f"The minimum delay ({min_ms} ms) is over the maximum one ({max_ms} ms)")
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.factor = factor
+        self.smoothing = smoothing
+        self.initial_ms = initial_ms
+        self.cost_ms = None
+
+    def record(self, seconds: float):
+        """Adds the cost of an update to the moving average."""
+        ms = seconds * 1000
+        if self.cost_ms is None:
+            self.cost_ms = ms
         else:
-            # Light mode colors
-            key_format = QTextCharFormat()
-            key_format.setForeground(QColor("#0451a5"))
-
-            string_format = QTextCharFormat()
-            string_format.setForeground(QColor("#a31515"))
-
-            number_format = QTextCharFormat()
-            number_format.setForeground(QColor("#098658"))
-
-            keyword_format = QTextCharFormat()
-            keyword_format.setForeground(QColor("#0000ff"))
-
-            brace_format = QTextCharFormat()
-            brace_format.setForeground(QColor("#000000"))
+            self.cost_ms += self.smoothing * (ms - self.cost_ms)
 
-        # Rules: (pattern, format)
-        # Keys (before colon)
-        self.highlighting_rules.append(
-            (QRegularExpression(r'"[^"]*"\s*(?=:)'), key_format)
-        )
-        # Strings (values)
-        self.highlighting_rules.append(
-            (QRegularExpression(r':\s*"[^"]*"'), string_format)
-        )
-        # Numbers
-        self.highlighting_rules.append(
-            (QRegularExpression(r'\b-?\d+\.?\d*([eE][+-]?\d+)?\b'), number_format)
-        )
-        # Keywords: true, false, null
-        self.highlighting_rules.append(
-            (QRegularExpression(r'\b(true|false|null)\b'), keyword_format)
-        )
-        # Braces and brackets
-        self.highlighting_rules.append(
-            (QRegularExpression(r'[\[\]{}]'), brace_format)
-        )
-
-    def highlightBlock(self, text):
-        for pattern, fmt in self.highlighting_rules:
-            match_iter = pattern.globalMatch(text)
-            while match_iter.hasNext():
-                match = match_iter.next()
-                self.setFormat(match.capturedStart(), match.capturedLength(), fmt)
+    def ms(self) -> int:
+        wanted = self.initial_ms if self.cost_ms is None else self.cost_ms * self.factor
+        return int(min(self.max_ms, max(self.min_ms, wanted)))
 
 
 class LineNumberArea(QWidget):
@@ -182,19 +164,43 @@ class CodeEditor(QPlainTextEdit):
 
 
 class App(QMainWindow):
-    def __init__(self, light_mode, text="{}"):
+    def __init__(self, light_mode, text="{}", min_delay_ms=30, max_delay_ms=1500):
         super().__init__()
 
         self.setWindowTitle("DRG Custom Room Editor")
         self.resize(950, 600)
         self.light_mode = light_mode
         self.room_json = None
+        self.json_valid = False
+        # Points of the room, to find the JSON of what is clicked in the view:
+        self.room_index = RoomIndex()
 
-        # Debounce timer for text updates
+        # Debounce timer for text updates, with a delay adapted to the room:
+        self.update_delay = UpdateDelay(min_delay_ms, max_delay_ms)
         self.update_timer = QTimer()
         self.update_timer.setSingleShot(True)
         self.update_timer.timeout.connect(self.try_update_from_json)
 
+        # Parse, validate and geometry run in a worker, see try_update_from_json:
+        self.updater = LatestJobRunner(parent=self)
+        self.updater.finished.connect(self.apply_update)
+        self.updater.failed.connect(self.on_update_error)
+
+        # Saving runs in a worker too, with the Save UAsset button disabled
+        # meanwhile. UAssetAPI gets its own thread, so a save or the warm-up
+        # below never holds back the room updates:
+        self.uasset_pool = QThreadPool(self)
+        self.uasset_pool.setMaxThreadCount(1)
+        self.saver = LatestJobRunner(self.uasset_pool, parent=self)
+        self.saver.finished.connect(self.on_saved)
+        self.saver.failed.connect(self.on_save_error)
+
+        # Loads CoreCLR and UAssetAPI while the user edits, so the first save
+        # is as fast as the next ones. A save waits for it if it is not over:
+        self.warm_up_runner = LatestJobRunner(self.uasset_pool, parent=self)
+        self.warm_up_runner.failed.connect(self.on_warm_up_error)
+        self.warm_up_runner.submit(get_session().warm_up)
+
         # Apply theme
         if not self.light_mode:
             self.setStyleSheet("""
@@ -242,19 +248,24 @@ class App(QMainWindow):
 
         self.check_entrances = QCheckBox("Show Entrances")
         self.check_entrances.setChecked(True)
-        self.check_entrances.stateChanged.connect(self.try_update_from_json)
+        self.check_entrances.stateChanged.connect(self.on_layer_toggled)
         controls_layout.addWidget(self.check_entrances)
 
         self.check_ffill = QCheckBox("Show FloodFillLines")
         self.check_ffill.setChecked(True)
-        self.check_ffill.stateChanged.connect(self.try_update_from_json)
+        self.check_ffill.stateChanged.connect(self.on_layer_toggled)
         controls_layout.addWidget(self.check_ffill)
 
         self.check_pillars = QCheckBox("Show FloodFillPillars")
         self.check_pillars.setChecked(True)
-        self.check_pillars.stateChanged.connect(self.try_update_from_json)
+        self.check_pillars.stateChanged.connect(self.on_layer_toggled)
         controls_layout.addWidget(self.check_pillars)
 
+        self.check_volume = QCheckBox("Solid Preview")
+        self.check_volume.setChecked(False)
+        self.check_volume.stateChanged.connect(self.on_volume_toggled)
+        controls_layout.addWidget(self.check_volume)
+
         controls_layout.addStretch()
         left_layout.addWidget(controls)
 
@@ -265,6 +276,11 @@ class App(QMainWindow):
         self.editor = CodeEditor(dark_mode=not self.light_mode)
         self.editor.setPlainText(text)
         self.editor.textChanged.connect(self.on_text_change)
+        # Parsed edit by edit, see on_contents_change:
+        self.document_model = JsonDocument(self.editor.toPlainText())
+        self.utf16_offsets = Utf16Offsets(self.editor.toPlainText())
+        self.text_length = self.editor.document().characterCount() - 1
+        self.editor.document().contentsChange.connect(self.on_contents_change)
         self.highlighter = JsonHighlighter(self.editor.document(), dark_mode=not self.light_mode)
         nested_splitter.addWidget(self.editor)
 
@@ -281,11 +297,12 @@ class App(QMainWindow):
         main_splitter.addWidget(left_widget)
 
         # ================= Right side (3D View) =================
-        self.gl_view = gl.GLViewWidget()
+        self.gl_view = RoomView()
         self.gl_view.setBackgroundColor('black')
 
         # Set initial camera position
         self.gl_view.setCameraPosition(distance=3000, elevation=30, azimuth=45)
+        self.gl_view.clicked.connect(self.on_view_clicked)
 
         main_splitter.addWidget(self.gl_view)
         main_splitter.setSizes([300, 650])
@@ -298,37 +315,132 @@ class App(QMainWindow):
     def reset_view(self):
         self.gl_view.setCameraPosition(distance=3000, elevation=30, azimuth=45)
 
+    def on_view_clicked(self, x, y):
+        """Selects in the editor the JSON of the feature under the click."""
+        origin, direction = self.gl_view.ray(x, y)
+        path = self.room_index.pick(origin, direction, self.gl_view.pixel_angle(), self.gl_view.room_scene.hidden)
+        if path is not None:
+            self.select_json(path)
+
+    def select_json(self, path: tuple):
+        name = "/".join(str(key) for key in path)
+        # The edits the worker has not applied yet are applied here, so the
+        # span is the one of the text in the editor:
+        try:
+            self.document_model.sync()
+        except json.JSONDecodeError:
+            pass
+        span = self.document_model.span(path)
+        if span is None:
+            self.set_status(f"{name} is not in the JSON anymore, or the JSON is not valid")
+            return
+        # Qt positions count UTF-16 code units:
+        start, end = (self.utf16_offsets.to_utf16(i) for i in span)
+        cursor = QTextCursor(self.editor.document())
+        cursor.setPosition(end)
+        cursor.setPosition(start, QTextCursor.MoveMode.KeepAnchor)
+        self.editor.setTextCursor(cursor)
+        self.editor.centerCursor()
+        self.set_status(f"Selected {name}")
+
     # ---------- Text handling ----------
     def on_text_change(self):
-        self.update_timer.start(300)  # 300ms debounce
+        self.update_timer.start(self.update_delay.ms())
+
+    def on_contents_change(self, position, removed, added):
+        """Hands the edit to the document model, which only parses again the
+        part of the JSON around it."""
+        document = self.editor.document()
+        length = document.characterCount() - 1
+        self.text_length += added - removed
+        if self.text_length != length:
+            # setPlainText() reports one more character than it adds:
+            self.text_length = length
+            text = self.editor.toPlainText()
+            self.utf16_offsets.reset(text)
+            self.document_model.record_reset(text)
+            return
+        cursor = QTextCursor(document)
+        cursor.setPosition(position)
+        cursor.setPosition(position + added, QTextCursor.MoveMode.KeepAnchor)
+        text = cursor.selectedText().translate(PLAIN_TEXT)
+        # The document model counts Python characters, Qt UTF-16 code units:
+        index, removed = self.utf16_offsets.edit(position, removed, text)
+        self.document_model.record_edit(index, removed, text)
 
     def try_update_from_json(self):
-        raw = self.editor.toPlainText()
+        """Sends the edits to the worker. Keystrokes that arrive while it is
+        busy are merged into one job."""
+        self.updater.submit(self.prepare_update)
 
+    def layer_switches(self) -> dict:
+        return {
+            "show_ffill": self.check_ffill.isChecked(),
+            "show_entrances": self.check_entrances.isChecked(),
+            "show_pillars": self.check_pillars.isChecked(),
+            "show_volume": self.check_volume.isChecked(),
+        }
+
+    def on_layer_toggled(self):
+        """The scene keeps the items of every layer, so a checkbox only
+        shows or hides them: the text is not parsed again."""
+        self.gl_view.room_scene.set_hidden_layers(hidden_layers(self.layer_switches()))
+        if self.room_json is not None:
+            self.plot_context = {"room": self.room_json, **self.layer_switches()}
+
+    def on_volume_toggled(self):
+        """The solid preview is meshed by the worker, with the next update."""
+        self.gl_view.room_scene.set_solid(self.check_volume.isChecked())
+        if self.room_json is not None:
+            self.plot_context = {"room": self.room_json, **self.layer_switches()}
+        if self.check_volume.isChecked():
+            self.try_update_from_json()
+
+    def prepare_update(self) -> RoomUpdate:
+        """Runs in a worker thread: no widget can be used here."""
+        start = time.perf_counter()
+        with span("try_update_from_json"):
+            update = self.build_update()
+        update.seconds = time.perf_counter() - start
+        return update
+
+    def build_update(self) -> RoomUpdate:
         # Check for valid JSON:
         try:
-            data = json.loads(raw)
+            with span("document sync"):
+                data = self.document_model.sync()
         except json.JSONDecodeError as e:
-            self.set_invalid_state(f"JSON error: {e.msg} (line {e.lineno})")
-            return
+            return RoomUpdate(error=f"JSON error: {e.msg} (line {e.lineno})")
 
         # Check for valid JSON room schema:
         try:
-            validate_room(data)
+            with span("validate_room"):
+                validate_room(data)
         except ValidationError as e:
-            self.set_invalid_state(f"JSON room schema error: {e.message}")
+            return RoomUpdate(error=f"JSON room schema error: {e.message}")
+
+        with span("scene plan"):
+            return RoomUpdate(data, self.gl_view.room_scene.plan(data))
+
+    def apply_update(self, update: RoomUpdate):
+        if update.error is not None:
+            self.update_delay.record(update.seconds)
+            self.set_invalid_state(update.error)
             return
 
-        self.room_json = data
+        start = time.perf_counter()
+        self.room_json = update.room_json
+        self.plot_context = {"room": self.room_json, **self.layer_switches()}
+        with span("room_index update"):
+            self.room_index.update(self.room_json)
+        # Only the GL upload happens in the GUI thread:
+        self.gl_view.room_scene.apply(update.plan)
+        self.update_delay.record(update.seconds + time.perf_counter() - start)
         self.set_valid_state()
 
-        self.plot_context = {
-            "room": self.room_json,
-            "show_ffill": self.check_ffill.isChecked(),
-            "show_entrances": self.check_entrances.isChecked(),
-            "show_pillars": self.check_pillars.isChecked(),
-        }
-        room_plotter_3d(self.gl_view, self.plot_context)
+    def on_update_error(self, error: Exception):
+        logging.error(f"Error when updating the room view: {error}")
+        self.set_status(f"Error when updating the room view: {error}")
 
     # ---------- Status + feedback ----------
     def set_status(self, message):
@@ -341,6 +453,7 @@ class App(QMainWindow):
             self.editor.setStyleSheet(
                 "background-color: #cf6679; color: #ffffff; border: 1px solid #444444;"
             )
+        self.json_valid = False
         self.disable_save_button()
         self.set_status(message)
 
@@ -351,23 +464,72 @@ class App(QMainWindow):
             self.editor.setStyleSheet(
                 "background-color: #1e1e1e; color: #ffffff; border: 1px solid #444444;"
             )
+        self.json_valid = True
         self.enable_save_button()
-        self.set_status("JSON valid")
+        self.set_status(f"JSON valid (update delay: {self.update_delay.ms()} ms)")
 
     def enable_save_button(self):
-        self.save_button.setEnabled(True)
+        # A valid edit during a save must not allow a second one:
+        self.save_button.setEnabled(not self.saver.busy())
 
     def disable_save_button(self):
         self.save_button.setEnabled(False)
 
     def try_saving_uasset(self):
-        build_json_and_uasset(self.room_json)
+        if self.room_json is None or self.saver.busy():
+            return
+        self.disable_save_button()
+        self.set_status(f"Saving {self.room_json['Name']}.uasset...")
+        self.saver.submit(self.save_uasset, self.room_json)
+
+    @staticmethod
+    def save_uasset(room_json: dict):
+        """Runs in a worker thread. Returns the path of the uasset and the
+        seconds it took."""
+        start = time.perf_counter()
+        path = build_json_and_uasset(room_json)
+        return path, time.perf_counter() - start
+
+    def on_saved(self, result):
+        path, seconds = result
+        self.set_status(f"Saved UAsset in {path} ({seconds:.2f}s)")
+        self.after_save()
+
+    def on_save_error(self, error: Exception):
+        logging.error(f"Error when saving the UAsset: {error}")
+        self.set_status(f"Error when saving the UAsset: {error}")
+        self.after_save()
+
+    def after_save(self):
+        # The text may have become invalid during the save:
+        if self.json_valid:
+            self.enable_save_button()
+
+    def on_warm_up_error(self, error: Exception):
+        # Not fatal: the save will try to load the runtime again and report the error
+        logging.warning(f"Could not preload UAssetAPI: {error}")
 
     def closeEvent(self, _event):
         import os
+        # os._exit skips the atexit handlers, so the trace is written here:
+        tracing.save()
         os._exit(0)
 
 
+def job_count(value: str) -> int:
+    jobs = int(value)
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, got {jobs}")
+    return jobs
+
+
+def delay_ms(value: str) -> int:
+    delay = int(value)
+    if delay < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, got {delay}")
+    return delay
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="DRG Custom Room Editor")
@@ -387,6 +549,48 @@ if __name__ == "__main__":
         help="Batch mode. Disables the GUI. Accepts one or more directory paths with room JSONs inside."
     )
 
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=job_count,
+        default=1,
+        help="Number of worker processes used in batch mode. 0 uses one per CPU core."
+    )
+
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Batch mode only: skip rooms that did not change since their last build."
+    )
+
+    parser.add_argument(
+        "--lint",
+        action="store_true",
+        help="Batch mode only: also lint the geometry and RandomSelectors of every room, in the workers that build them."
+    )
+
+    parser.add_argument(
+        "--lint-only",
+        action="store_true",
+        help="Batch mode only: lint every room without building it."
+    )
+
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help=f"Writes timing spans of the builds and updates to PATH in Chrome trace-event format, "
+             f"for chrome://tracing or ui.perfetto.dev. The {tracing.ENV_VAR} environment variable does the same."
+    )
+
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help=f"Measures the Python memory (tracemalloc) and the RSS of every build stage, and reports the peak memory "
+             f"of every room in batch mode. Also in the trace with --trace. Slows the builds down. "
+             f"The {memory_profile.ENV_VAR} environment variable does the same."
+    )
+
     parser.add_argument(
         "-l",
         "--light",
@@ -394,22 +598,34 @@ if __name__ == "__main__":
         help="Starts the GUI in light mode."
     )
 
+    parser.add_argument(
+        "--min-delay",
+        type=delay_ms,
+        default=30,
+        help="GUI only: shortest wait in ms after an edit before the room view updates."
+    )
+
+    parser.add_argument(
+        "--max-delay",
+        type=delay_ms,
+        default=1500,
+        help="GUI only: longest wait in ms after an edit before the room view updates. The wait grows with the time an update takes."
+    )
+
     args = parser.parse_args()
+    if args.min_delay > args.max_delay:
+        parser.error(f"--min-delay ({args.min_delay} ms) is over --max-delay ({args.max_delay} ms)")
     setup_logging()
+    if args.trace or args.memory:
+        # --memory alone keeps the trace file named by the environment, if any:
+        tracing.enable(args.trace or os.environ.get(tracing.ENV_VAR) or None, memory=args.memory)
 
     if args.batch:
         logging.info("Running batch mode.")
-        for directory in args.batch:
-            json_files = Path(directory).glob("*.json")
-            for file in json_files:
-                with open(file, 'r') as room_file:
-                    try:
-                        room_json = json.load(room_file)
-                        # File name to save the uasset:
-                        build_json_and_uasset(room_json)
-                    except Exception as e:
-                        logging.error(f"Error when processing {file}: {e}")
-                        continue
+        run_batch(
+            args.batch, args.jobs, args.incremental,
+            lint=args.lint or args.lint_only, build=not args.lint_only
+        )
     else:
         qt_app = QApplication(sys.argv)
 
@@ -418,13 +634,13 @@ if __name__ == "__main__":
                 with open(args.filename, 'r') as f:
                     logging.info(f"Editor GUI started with file {args.filename}")
                     json_from_file = json.load(f)
-                    app = App(args.light, text=json.dumps(json_from_file, indent=4))
+                    app = App(args.light, text=json.dumps(json_from_file, indent=4), min_delay_ms=args.min_delay, max_delay_ms=args.max_delay)
             except Exception as e:
                 logging.error(e)
                 sys.exit(1)
         else:
             logging.info("Editor GUI started with a blank file.")
-            app = App(args.light)
+            app = App(args.light, min_delay_ms=args.min_delay, max_delay_ms=args.max_delay)
 
         app.show()
         sys.exit(qt_app.exec())
@@ -0,0 +1,216 @@
+"""Peak memory of the build stages, to size the batch worker pools.
+
+When on (main.py --memory, or the DRG_MEMORY environment variable), every
+tracing span also measures memory, see tracing.enable(). Two measures are
+kept, since neither sees everything:
+- the Python memory traced by tracemalloc: how much the stage kept
+  allocated at its end, and how far above its start it went at its peak.
+  The spans of the feature sections of json_builder (FloodFillLines,
+  Entrances, FloodFillPillars, RandomSelectors, PE features, Room) keep the
+  exports they built, so what they keep is the memory of each export type.
+- the resident set size (RSS) of the process at the end of the stage, and
+  how much it grew. It also counts what tracemalloc does not see: the .NET
+  object graph of UAssetAPI, numpy buffers and the heap fragmentation.
+
+tracemalloc has one peak for the process, so the peaks of the spans are
+exact with one thread building, as in the batch workers. Tracing the
+allocations makes the builds a few times slower: the times of a trace with
+memory are not the ones of a normal build.
+"""
+import os
+import sys
+import threading
+import tracemalloc
+
+ENV_VAR = "DRG_MEMORY"
+
+_local = threading.local()  # Peaks of the open measures of the thread, innermost last
+
+
+def start(frames: int = 1):
+    """Starts tracing the Python allocations, keeping frames frames of
+    traceback for snapshots."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def enabled() -> bool:
+    return tracemalloc.is_tracing()
+
+
+def rss_bytes() -> int:
+    """Resident set size of the process."""
+    if sys.platform == "linux":
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    if sys.platform == "win32":
+        return _windows_memory_counters().WorkingSetSize
+    return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    """Largest resident set size the process had so far."""
+    if sys.platform == "win32":
+        return _windows_memory_counters().PeakWorkingSetSize
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts in KiB, macOS in bytes:
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _windows_memory_counters():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        raise ctypes.WinError()
+    return counters
+
+
+def begin() -> tuple:
+    """Starts measuring, returns the token to give end()."""
+    current, peak = tracemalloc.get_traced_memory()
+    peaks = getattr(_local, "peaks", None)
+    if peaks is None:
+        peaks = _local.peaks = []
+    # The peak is about to be reset for this measure, so the one of the
+    # enclosing measure so far is kept aside:
+    if peaks:
+        peaks[-1] = max(peaks[-1], peak)
+    tracemalloc.reset_peak()
+    peaks.append(current)
+    return current, rss_bytes()
+
+
+def end(token: tuple) -> dict:
+    """Memory of the measure started by begin(), in bytes: traced_bytes is
+    what it kept allocated, peak_bytes how far above its start the traced
+    memory went, rss_bytes the RSS at its end and rss_delta_bytes how much
+    the RSS grew."""
+    start_traced, start_rss = token
+    current, peak = tracemalloc.get_traced_memory()
+    peaks = _local.peaks
+    peak = max(peaks.pop(), peak)
+    if peaks:
+        peaks[-1] = max(peaks[-1], peak)
+    rss = rss_bytes()
+    return {
+        "traced_bytes": current - start_traced,
+        "peak_bytes": peak - start_traced,
+        "rss_bytes": rss,
+        "rss_delta_bytes": rss - start_rss,
+    }
+
+
+class _Measure:
+    __slots__ = ("memory", "token")
+
+    def __init__(self):
+        self.memory = {}
+        self.token = None
+
+    def __enter__(self) -> dict:
+        if enabled():
+            self.token = begin()
+        return self.memory
+
+    def __exit__(self, *exc_info):
+        if self.token is not None:
+            self.memory.update(end(self.token))
+        return False
+
+
+def measure() -> _Measure:
+    """Context manager measuring its block like a span, see end(). The dict
+    it gives is filled at the exit, and stays empty when memory profiling
+    is off."""
+    return _Measure()
+
+
+def summary(events: list) -> list[dict]:
+    """Largest memory of every span name among the trace events measured,
+    with the mean traced memory kept, by largest peak."""
+    stages = {}
+    for event in events:
+        memory = event.get("args", {})
+        if event["ph"] != "X" or "peak_bytes" not in memory:
+            continue
+        stage = stages.setdefault(
+            event["name"], {"stage": event["name"], "count": 0, "kept_bytes": 0, "peak_bytes": 0, "rss_delta_bytes": 0}
+        )
+        stage["count"] += 1
+        stage["kept_bytes"] += memory["traced_bytes"]
+        stage["peak_bytes"] = max(stage["peak_bytes"], memory["peak_bytes"])
+        stage["rss_delta_bytes"] = max(stage["rss_delta_bytes"], memory["rss_delta_bytes"])
+    for stage in stages.values():
+        stage["kept_bytes"] //= stage["count"]
+    return sorted(stages.values(), key=lambda stage: stage["peak_bytes"], reverse=True)
+
+
+def _mib(size: int) -> str:
+    return f"{size / 2**20:.2f}"
+
+
+def summary_table(events: list) -> str:
+    rows = summary(events)
+    width = max([len("stage"), *(len(row["stage"]) for row in rows)])
+    lines = [f"{'stage':<{width}} {'count':>7} {'mean kept MiB':>14} {'max peak MiB':>13} {'max RSS+ MiB':>13}"]
+    for row in rows:
+        lines.append(
+            f"{row['stage']:<{width}} {row['count']:>7} {_mib(row['kept_bytes']):>14} "
+            f"{_mib(row['peak_bytes']):>13} {_mib(row['rss_delta_bytes']):>13}"
+        )
+    return "\n".join(lines)
+
+
+def top_allocations(snapshot, previous=None, limit: int = 10) -> list[str]:
+    """The lines of code holding the most traced memory in the snapshot, or
+    that grew the most since the previous one."""
+    if previous is None:
+        statistics = snapshot.statistics("lineno")
+    else:
+        statistics = snapshot.compare_to(previous, "lineno")
+    return [str(statistic) for statistic in statistics[:limit]]
+
+
+if __name__ == "__main__":
+    # Memory of the stages of one room: python memory_profile.py <room.json> [<top lines>]
+    import json
+
+    import tracing
+    from json_builder import build_asset_json
+    from uasset_writer import write_uasset_bytes
+
+    with open(sys.argv[1], "r") as f:
+        room = json.load(f)
+    tracing.enable(memory=True)
+    before = tracemalloc.take_snapshot()
+    with tracing.span("build_asset_json"):
+        asset = build_asset_json(room)
+    # The asset JSON is alive here, so the snapshot shows what it is made of:
+    built = tracemalloc.take_snapshot()
+    with tracing.span("write_uasset_bytes"):
+        write_uasset_bytes(asset)
+    events = tracing.drain()
+    print(summary_table(events))
+    print(f"\nPeak RSS: {_mib(peak_rss_bytes())} MiB. Lines holding the asset JSON:")
+    for line in top_allocations(built, before, int(sys.argv[2]) if len(sys.argv) > 2 else 10):
+        print(f"    {line}")
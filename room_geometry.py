@@ -0,0 +1,337 @@
+"""Vectorized geometry of the features drawn by room_viewer.
+
+The features of a layer are read once into columns (one row per point) and
+all their line segments are computed with batched NumPy operations. The
+*_vertices functions return one contiguous float32 buffer of segment end
+points, the "lines" mode of GLLinePlotItem, and the offsets where each
+feature starts in it, so feature i is buffer[offsets[i]:offsets[i + 1]].
+"""
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+# Tessellation of the FloodFillLine half-ellipsoids:
+N_LAT = 6  # Latitude circles from the top down to the base circle
+N_LAT_POINTS = 30
+N_LON = 12
+N_LON_POINTS = 15
+# Latitude circles with a smaller radius are not drawn:
+MIN_CIRCLE_RADIUS = 1e-6
+
+DEFAULT_ENTRANCE_VECTOR = np.array((500, 0, 0))
+ARROW_SIZE = 50
+
+
+@lru_cache(maxsize=None)
+def unit_half_ellipsoid(n_lat: int = N_LAT, n_lat_points: int = N_LAT_POINTS, n_lon: int = N_LON, n_lon_points: int = N_LON_POINTS) -> tuple[np.ndarray, np.ndarray]:
+    """Wireframe of the half-ellipsoid with radius 1 and height 1 centered at
+    the origin, as (S, 2, 3) segments. Also returns the unit radius of the
+    latitude circle each segment belongs to (0 for longitude segments), to
+    drop the circles that are too small once scaled."""
+    segments = []
+    circle_radius = []
+
+    # Latitude circles (horizontal)
+    theta = np.linspace(0, 2 * np.pi, n_lat_points)
+    for i in range(1, n_lat + 1):  # The circle at the top pole has radius 0
+        phi = (np.pi / 2) * i / n_lat
+        ring = np.stack([np.sin(phi) * np.cos(theta), np.sin(phi) * np.sin(theta), np.full_like(theta, np.cos(phi))], axis=1)
+        segments.append(np.stack([ring[:-1], ring[1:]], axis=1))
+        circle_radius.append(np.full(n_lat_points - 1, np.sin(phi)))
+
+    # Longitude lines (vertical)
+    phi = np.linspace(0, np.pi / 2, n_lon_points)
+    for i in range(n_lon):
+        theta_i = 2 * np.pi * i / n_lon
+        meridian = np.stack([np.sin(phi) * np.cos(theta_i), np.sin(phi) * np.sin(theta_i), np.cos(phi)], axis=1)
+        segments.append(np.stack([meridian[:-1], meridian[1:]], axis=1))
+        circle_radius.append(np.zeros(n_lon_points - 1))
+
+    return np.concatenate(segments).astype(np.float32), np.concatenate(circle_radius)
+
+
+def _xyz(feature: dict) -> tuple:
+    return feature["Location"]["X"], feature["Location"]["Y"], feature["Location"]["Z"]
+
+
+def locations(features: list) -> np.ndarray:
+    """(N, 3) array with the Location of every feature."""
+    return np.array([_xyz(f) for f in features], dtype=float).reshape(-1, 3)
+
+
+@dataclass
+class FFillColumns:
+    """Every point of a list of FloodFillLines, one row per point."""
+    center: np.ndarray  # (N, 3) center of the base circle
+    height: np.ndarray  # (N,)
+    radius: np.ndarray  # (N,) HRange
+    line: np.ndarray  # (N,) index of the line of each point
+    n_lines: int
+
+    def __len__(self):
+        return len(self.line)
+
+
+def ffill_columns(lines: list) -> FFillColumns:
+    points = [point for line in lines for point in line["Points"]]
+    line = np.repeat(np.arange(len(lines)), [len(line["Points"]) for line in lines])
+    center = locations(points)
+    vrange = np.array([p["VRange"] for p in points], dtype=float)
+    ceiling = np.array([p.get("CeilingHeight", np.nan) for p in points], dtype=float)
+    floor_depth = np.array([p.get("FloorDepth", np.nan) for p in points], dtype=float)
+    radius = np.array([p["HRange"] for p in points], dtype=float)
+
+    # The height of the room is the minimum between CeilingHeight (if exists)
+    # or VRange (always exists, forced by the schema):
+    height = np.fmin(vrange, ceiling)
+    # The Z coordinate can me moved up or down by the FloorDepth, if it exists.
+    # If it does, we also need to change the height of the room accordingly.
+    floor_z = center[:, 2] + floor_depth
+    moved = ~np.isnan(floor_depth) & (floor_z <= height)
+    center[:, 2] = np.where(moved, floor_z, center[:, 2])
+    height = np.where(moved, height - floor_z, height)
+
+    return FFillColumns(center, height, radius, line, len(lines))
+
+
+def instance_transforms(columns: FFillColumns) -> np.ndarray:
+    """(N, 4, 3) float32 affine transforms taking the unit half-ellipsoid to
+    each point: a diagonal scale by (HRange, HRange, height), then the
+    translation to the center in the last row."""
+    transforms = np.zeros((len(columns), 4, 3), dtype=np.float32)
+    transforms[:, 0, 0] = columns.radius
+    transforms[:, 1, 1] = columns.radius
+    transforms[:, 2, 2] = columns.height
+    transforms[:, 3] = columns.center
+    return transforms
+
+
+def ellipsoid_instances(columns: FFillColumns) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Center and scale of the unit half-ellipsoid for every point, as
+    float32 (N, 3) arrays for instanced drawing, and the offsets where the
+    points of each line start in them."""
+    scale = np.stack([columns.radius, columns.radius, columns.height], axis=1).astype(np.float32)
+    offsets = np.zeros(columns.n_lines + 1, dtype=int)
+    np.cumsum(np.bincount(columns.line, minlength=columns.n_lines), out=offsets[1:])
+    return columns.center.astype(np.float32), scale, offsets
+
+
+def instance_bounds(template: np.ndarray, center: np.ndarray, scale: np.ndarray) -> tuple | None:
+    """(mins, maxs) of the vertices of every instance, without expanding them."""
+    if len(center) == 0:
+        return None
+    low, high = scale * template.min(axis=0), scale * template.max(axis=0)
+    return (center + np.minimum(low, high)).min(axis=0), (center + np.maximum(low, high)).max(axis=0)
+
+
+def homogeneous(vertices: np.ndarray) -> np.ndarray:
+    return np.hstack([vertices, np.ones((len(vertices), 1), dtype=vertices.dtype)])
+
+
+def ellipsoid_segments(columns: FFillColumns, template: tuple[np.ndarray, np.ndarray] | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Wireframes of every point: the unit template scaled and translated by
+    one batched matrix product. Returns (M, 2, 3) segments sorted by line
+    and the line of each one."""
+    segments, circle_radius = template or unit_half_ellipsoid()
+    wireframes = (homogeneous(segments.reshape(-1, 3)) @ instance_transforms(columns)).reshape(len(columns), len(segments), 2, 3)
+    keep = (circle_radius == 0) | (columns.radius[:, None] * circle_radius >= MIN_CIRCLE_RADIUS)
+    line = np.broadcast_to(columns.line[:, None], keep.shape)
+    if keep.all():
+        return wireframes.reshape(-1, 2, 3), line.ravel()
+    return wireframes[keep], line[keep]
+
+
+def tangent_segments(columns: FFillColumns) -> tuple[np.ndarray, np.ndarray]:
+    """Tangent lines between every pair of consecutive points of the same
+    line: the one connecting the peaks and, when the base circles allow it,
+    the two connecting the base circles. Returns (M, 2, 3) segments sorted by
+    line and the line of each one."""
+    pair = np.flatnonzero(columns.line[:-1] == columns.line[1:])
+    c1, c2 = columns.center[pair], columns.center[pair + 1]
+    h1, h2 = columns.height[pair], columns.height[pair + 1]
+    r1, r2 = columns.radius[pair], columns.radius[pair + 1]
+
+    top1, top2 = c1.copy(), c2.copy()
+    top1[:, 2] += h1
+    top2[:, 2] += h2
+    tops = np.stack([top1, top2], axis=1)
+
+    dvec = c2 - c1
+    dxy = np.hypot(dvec[:, 0], dvec[:, 1])
+    base = np.flatnonzero((dxy != 0) & ~(dxy < np.abs(r1 - r2)))
+    angle = np.arctan2(dvec[base, 1], dvec[base, 0])
+    alpha = np.arccos((r1[base] - r2[base]) / dxy[base])
+    bases = []
+    for sign in (1, -1):
+        theta = angle + sign * alpha
+        dir2d = np.stack([np.cos(theta), np.sin(theta), np.zeros_like(theta)], axis=1)
+        p1 = c1[base] + r1[base, None] * dir2d
+        p2 = c2[base] + r2[base, None] * dir2d
+        bases.append(np.stack([p1, p2], axis=1))
+
+    line = columns.line[pair]
+    line = np.concatenate([line, line[base], line[base]])
+    order = np.argsort(line, kind="stable")
+    return np.concatenate([tops, *bases])[order], line[order]
+
+
+def group_by_feature(parts: list, n_features: int) -> tuple[np.ndarray, np.ndarray]:
+    """Concatenates (segments, feature of each segment) parts into one
+    float32 vertex buffer where the segments of each feature are contiguous,
+    and returns the vertex offsets of each feature in it. The segments of
+    every part must already be sorted by feature."""
+    if n_features == 0:
+        return np.empty((0, 3), dtype=np.float32), np.zeros(1, dtype=int)
+    counts = np.array([np.bincount(feature, minlength=n_features) for _, feature in parts]).reshape(-1, n_features)
+    offsets = np.zeros(n_features + 1, dtype=int)
+    np.cumsum(counts.sum(axis=0), out=offsets[1:])
+    out = np.empty((offsets[-1], 2, 3), dtype=np.float32)
+    # Where the segments of each feature start, in the output and in each part:
+    out_start = offsets[:-1] + np.cumsum(counts, axis=0) - counts
+    part_start = np.cumsum(counts, axis=1) - counts
+    for (segments, feature), count, dst, src in zip(parts, counts, out_start, part_start):
+        present = np.flatnonzero(count)
+        if len(feature) > 64 * len(present):
+            # Few long runs, like the ellipsoids of a FloodFillLine: copy them by slices
+            for i in present:
+                out[dst[i]:dst[i] + count[i]] = segments[src[i]:src[i] + count[i]]
+        else:
+            out[np.arange(len(feature)) + (dst - src)[feature]] = segments
+    return out.reshape(-1, 3), offsets * 2
+
+
+def ffill_vertices(columns: FFillColumns) -> tuple[np.ndarray, np.ndarray]:
+    """Ellipsoid wireframes and tangent lines of every FloodFillLine."""
+    ellipsoids, ellipsoid_line = ellipsoid_segments(columns)
+    tangents, tangent_line = tangent_segments(columns)
+    return group_by_feature([(ellipsoids, ellipsoid_line), (tangents, tangent_line)], columns.n_lines)
+
+
+def tangent_vertices(columns: FFillColumns) -> tuple[np.ndarray, np.ndarray]:
+    """Only the tangent lines of every FloodFillLine, for when the ellipsoids
+    are drawn instanced."""
+    return group_by_feature([tangent_segments(columns)], columns.n_lines)
+
+
+def pillar_vertices(pillars: list) -> tuple[np.ndarray, np.ndarray]:
+    """Segments between the consecutive points of every pillar."""
+    points = [point for pillar in pillars for point in pillar["Points"]]
+    pillar = np.repeat(np.arange(len(pillars)), [len(p["Points"]) for p in pillars])
+    location = locations(points)
+    pair = np.flatnonzero(pillar[:-1] == pillar[1:])
+    segments = np.stack([location[pair], location[pair + 1]], axis=1)
+    return group_by_feature([(segments, pillar[pair])], len(pillars))
+
+
+def rotate_vector(v, roll, pitch, yaw):
+    """This method is used to apply the rotator defined in the Entrances to a default vector v."""
+    r = R.from_euler("zyx", [yaw, pitch, roll], degrees=True)  # yaw, pitch, roll
+    return r.apply(v)
+
+
+def create_arrow_lines(start, direction, arrow_size=ARROW_SIZE):
+    """Create lines for an arrow. One entrance at a time, entrance_arrows
+    does the same for all of them."""
+    start = np.array(start)
+    direction = np.array(direction)
+    end = start + direction
+
+    lines = [[start.tolist(), end.tolist()]]
+
+    # Arrow head
+    if np.linalg.norm(direction) > 1e-6:
+        d = direction / np.linalg.norm(direction)
+        # Find perpendicular vectors
+        if abs(d[2]) < 0.9:
+            perp1 = np.cross(d, [0, 0, 1])
+        else:
+            perp1 = np.cross(d, [1, 0, 0])
+        perp1 = perp1 / np.linalg.norm(perp1)
+        perp2 = np.cross(d, perp1)
+
+        head_base = end - d * arrow_size
+        for perp in [perp1, -perp1, perp2, -perp2]:
+            head_point = head_base + perp * arrow_size * 0.3
+            lines.append([end.tolist(), head_point.tolist()])
+
+    return lines
+
+
+def rotators(entrances: list) -> np.ndarray:
+    """(N, 3) array with the (Roll, Pitch, Yaw) Direction of every entrance."""
+    return np.array(
+        [(e["Direction"]["Roll"], e["Direction"]["Pitch"], e["Direction"]["Yaw"]) for e in entrances], dtype=float
+    ).reshape(-1, 3)
+
+
+def entrance_directions(rotator: np.ndarray, v: np.ndarray = DEFAULT_ENTRANCE_VECTOR) -> np.ndarray:
+    """rotate_vector for an (N, 3) array of (roll, pitch, yaw), with a single Rotation."""
+    if len(rotator) == 0:
+        return np.empty((0, 3))
+    return R.from_euler("zyx", rotator[:, ::-1], degrees=True).apply(v)
+
+
+def entrance_arrows(start: np.ndarray, direction: np.ndarray, arrow_size: float = ARROW_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    """create_arrow_lines for every entrance at once: the shaft and, when the
+    direction is not null, the four segments of the head."""
+    end = start + direction
+    norm = np.linalg.norm(direction, axis=1)
+    head = np.flatnonzero(norm > 1e-6)
+    d = direction[head] / norm[head, None]
+    # Find perpendicular vectors
+    axis = np.where((np.abs(d[:, 2]) < 0.9)[:, None], [0, 0, 1], [1, 0, 0])
+    perp1 = np.cross(d, axis)
+    perp1 /= np.linalg.norm(perp1, axis=1, keepdims=True)
+    perp2 = np.cross(d, perp1)
+
+    head_base = end[head] - d * arrow_size
+    shafts = np.stack([start, end], axis=1)
+    heads = [
+        np.stack([end[head], head_base + perp * arrow_size * 0.3], axis=1)
+        for perp in (perp1, -perp1, perp2, -perp2)
+    ]
+    entrance = np.arange(len(start))
+    parts = [(shafts, entrance)]
+    # Each part is sorted by entrance, as group_by_feature needs:
+    parts += [(segments, entrance[head]) for segments in heads]
+    return group_by_feature(parts, len(start))
+
+
+def benchmark_entrances(entrances: list, repeats: int = 5) -> dict:
+    """Mean time to build the arrows of every entrance one by one with
+    rotate_vector and create_arrow_lines (the previous implementation), and
+    in one batch. Fails if both give different segments."""
+    def one_by_one():
+        return [
+            create_arrow_lines(list(_xyz(e)), rotate_vector(DEFAULT_ENTRANCE_VECTOR, *rotator))
+            for e, rotator in zip(entrances, rotators(entrances))
+        ]
+
+    def batched():
+        return entrance_arrows(locations(entrances), entrance_directions(rotators(entrances)))
+
+    results = {"entrances": len(entrances)}
+    for label, fn in (("one_by_one_s", one_by_one), ("batched_s", batched)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            output = fn()
+        results[label] = (time.perf_counter() - start) / repeats
+        if label == "one_by_one_s":
+            expected = output
+    vertices, offsets = output
+    for i, lines in enumerate(expected):
+        assert np.allclose(vertices[offsets[i]:offsets[i + 1]], np.array(lines).reshape(-1, 3), atol=1e-2)
+    return results
+
+
+if __name__ == "__main__":
+    # Entrance arrows benchmark: python room_geometry.py <room.json> [repeats]
+    import json
+    import sys
+
+    with open(sys.argv[1], "r") as f:
+        room = json.load(f)
+    print(benchmark_entrances(list(room["Entrances"].values()), int(sys.argv[2]) if len(sys.argv) > 2 else 5))
@@ -0,0 +1,178 @@
+"""Spatial index of the points of a room, to find the JSON block of what is
+clicked in the 3D view.
+
+Every FloodFillLine point, entrance, FloodFillPillar point and PE feature is
+a point of a cKDTree, with the JSON path of the value that defines it. The
+points are kept per feature and diffed like the RoomScene features, so an
+edit only reads again the features it changed. The tree is rebuilt from the
+kept points at the next pick, in O(n log n).
+
+A click is a ray from the camera. The points that are within a few pixels of
+the ray are found with ball queries at geometrically spaced depths, each one
+O(log n), and the closest one to the ray on screen is picked.
+"""
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from room_geometry import locations
+from room_viewer import room_features
+
+# JSON section of each room_features layer:
+SECTIONS = {
+    "ffill": "FloodFillLines",
+    "entrances": "Entrances",
+    "pillars": "FloodFillPillars",
+    "pe_mining_head": "PE_MiningHead",
+    "pe_pod_drop_down": "PE_PodDropDown",
+}
+LAYERS = tuple(SECTIONS)
+PICK_TOLERANCE_PX = 8.0  # Points this close to the click are picked first
+MAX_PICK_TOLERANCE_PX = 256.0  # The tolerance doubles up to this, until a point is found
+OVERLAP_PX = 1.0  # Of the points this close to the closest one on screen, the nearest is picked
+
+
+def feature_points(layer: str, name: str, source) -> tuple[np.ndarray, list]:
+    """(P, 3) points of a room_features feature, and the JSON path of each."""
+    section = SECTIONS[layer]
+    match layer:
+        case "ffill":
+            points = source["Points"]
+        case "pillars":
+            points = source[1]["Points"]  # (color, pillar)
+        case _:
+            return locations([source]), [(section, name)]
+    return locations(points), [(section, name, "Points", i) for i in range(len(points))]
+
+
+class RoomIndex:
+    """The points of the last room given to update(), in a cKDTree."""
+
+    def __init__(self):
+        self.features = {}  # (layer, name) -> (source, points, paths)
+        self.tree = None
+        self.paths = []
+        self.layer = np.zeros(0, dtype=np.int8)  # Index in LAYERS of each point
+        self.dirty = False
+        self.builds = 0
+
+    def update(self, room_json: dict):
+        """Reads the features that changed since the last room. The JSON
+        documents keep the values that did not change, so most features are
+        the same object as before."""
+        wanted = room_features(room_json)
+        features = {}
+        for key, source in wanted.items():
+            feature = self.features.get(key)
+            if feature is None or (feature[0] is not source and feature[0] != source):
+                feature = (source, *feature_points(*key, source))
+                self.dirty = True
+            features[key] = feature
+        if len(features) != len(self.features):
+            self.dirty = True
+        self.features = features
+
+    def _tree(self) -> cKDTree | None:
+        if self.dirty:
+            self.dirty = False
+            self.builds += 1
+            self.paths = [path for _, _, paths in self.features.values() for path in paths]
+            if not self.paths:
+                self.tree = None
+                return None
+            points = np.concatenate([points for _, points, _ in self.features.values()])
+            self.layer = np.repeat(
+                np.array([LAYERS.index(layer) for layer, _ in self.features], dtype=np.int8),
+                [len(points) for _, points, _ in self.features.values()],
+            )
+            self.tree = cKDTree(points)
+        return self.tree
+
+    def pick(
+        self, origin: np.ndarray, direction: np.ndarray, pixel_angle: float, hidden=(),
+        tolerance_px: float = PICK_TOLERANCE_PX
+    ) -> tuple | None:
+        """JSON path of the point closest on screen to the ray from origin
+        along direction, outside the hidden layers, or None. Points that
+        overlap on screen go to the nearest one. pixel_angle is the angle of
+        a pixel seen from the camera, in radians."""
+        tree = self._tree()
+        if tree is None:
+            return None
+        origin = np.asarray(origin, dtype=float)
+        direction = np.asarray(direction, dtype=float)
+        direction = direction / np.linalg.norm(direction)
+        shown = ~np.isin(self.layer, [LAYERS.index(layer) for layer in hidden])
+
+        # Depths of the corners of the bounding box of the points:
+        corners = np.array(np.meshgrid(*zip(tree.mins, tree.maxes), indexing="ij")).reshape(3, -1).T
+        depth = (corners - origin) @ direction
+        far = depth.max()
+        if far <= 0:
+            return None
+        near = max(depth.min(), far * 1e-4)
+
+        while tolerance_px <= MAX_PICK_TOLERANCE_PX:
+            angle = tolerance_px * pixel_angle
+            # Each ball covers the cone of the tolerance from t(1 - angle) to
+            # t(1 + angle), so the depths grow by a factor 1 + 2 angle:
+            steps = int(np.ceil(np.log(far / near) / np.log1p(2 * angle))) + 1
+            t = near * (1 + 2 * angle) ** np.arange(steps)
+            found = tree.query_ball_point(origin + t[:, None] * direction, 1.5 * angle * t, return_sorted=False)
+            candidates = np.unique(np.concatenate([np.asarray(c, dtype=np.intp) for c in found]))
+            candidates = candidates[shown[candidates]]
+
+            offset = tree.data[candidates] - origin
+            along = offset @ direction
+            across = np.linalg.norm(offset - along[:, None] * direction, axis=1)
+            in_front = along > 0
+            candidates, along, ratio = candidates[in_front], along[in_front], across[in_front] / along[in_front]
+            if (ratio <= angle).any():
+                overlap = ratio <= ratio.min() + OVERLAP_PX * pixel_angle
+                return self.paths[candidates[overlap][np.argmin(along[overlap])]]
+            tolerance_px *= 2
+        return None
+
+
+def benchmark(room_json: dict, picks: int = 100) -> dict:
+    """Time to index a room, to update the index after moving the last point
+    of the last FloodFillLine, and to pick points from rays through random
+    points of the room."""
+    index = RoomIndex()
+    results = {}
+    start = time.perf_counter()
+    index.update(room_json)
+    index._tree()
+    results["build_s"] = time.perf_counter() - start
+    results["points"] = len(index.paths)
+
+    name, line = list(room_json["FloodFillLines"].items())[-1]
+    point = dict(line["Points"][-1])
+    point["Location"] = dict(point["Location"], X=point["Location"]["X"] + 100)
+    edited = dict(room_json, FloodFillLines=dict(room_json["FloodFillLines"]))
+    edited["FloodFillLines"][name] = dict(line, Points=[*line["Points"][:-1], point])
+    start = time.perf_counter()
+    index.update(edited)
+    index._tree()
+    results["edit_s"] = time.perf_counter() - start
+
+    rng = np.random.default_rng(0)
+    targets = index.tree.data[rng.integers(len(index.paths), size=picks)]
+    origin = targets.mean(axis=0) + [0.0, 0.0, 20000.0]
+    pixel_angle = 2 * np.tan(np.radians(60) / 2) / 1000  # 60° over 1000 pixels
+    start = time.perf_counter()
+    hits = sum(index.pick(origin, target - origin, pixel_angle) is not None for target in targets)
+    results["pick_s"] = (time.perf_counter() - start) / picks
+    results["picked"] = hits / picks
+    return results
+
+
+if __name__ == "__main__":
+    # Picking benchmark: python room_index.py <room.json>
+    import json
+    import sys
+
+    with open(sys.argv[1], "r") as f:
+        room = json.load(f)
+    print(benchmark(room))
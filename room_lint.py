@@ -0,0 +1,243 @@
+"""Geometric lint of rooms, for what validate_room cannot see.
+
+A room can follow the schema and still be broken in game: an entrance out
+of the carved space, a pillar that only fills rock, a part of the cave that
+no other part reaches, a RandomSelector naming a feature that is not there.
+lint_room() finds them on the parse_room_json dataclasses. The carved space
+is the one of the solid preview (see room_volume), so it matches what the
+viewer shows.
+
+Every check between points and the carved space is a broadphase over a
+cKDTree of the points: each carve primitive only queries the points that
+can be within the tolerance of it, and only those (point, primitive) pairs
+are evaluated, in batches. The parts of the cave are joined line by line
+with a union-find, over the pairs of lines whose boxes overlap.
+"""
+import time
+from collections import Counter
+from dataclasses import dataclass
+from itertools import chain
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from json_builder import list_nested_keys, parse_room_json
+from room_volume import carve_distance, carve_primitives, carve_terms, consecutive_pairs
+
+# Sections whose features a RandomSelector can name, in the order of the
+# asset list of build_asset_json:
+FEATURE_SECTIONS = ("FloodFillLines", "Entrances", "FloodFillPillars", "PE_MiningHead", "PE_PodDropDown")
+OUTSIDE_TOLERANCE = 250.0  # Entrances and PE features this far out of the carved space still pass
+PILLAR_SAMPLES = 4  # Points checked along each segment of a pillar, ends included
+_BATCH = 1 << 18  # (point, primitive) pairs evaluated together, to bound the arrays
+_PAIR_CHUNK = 4096  # Pairs of lines filtered together before testing them one by one
+
+
+@dataclass
+class LintIssue:
+    check: str  # "entrance-outside", "pe-outside", "pillar-in-rock", "line-disconnected", "selector-missing" or "selector-ambiguous"
+    path: tuple  # JSON path of the feature, as in room_index
+    message: str
+
+    def __str__(self):
+        return f"{'/'.join(map(str, self.path))}: {self.message} [{self.check}]"
+
+
+def _reach(rows: np.ndarray, tolerance: float) -> np.ndarray:
+    """Distance from the middle of each carve_primitives row past which a
+    point is more than tolerance away from its half-ellipsoid: all of it is
+    within its largest extent of the axis."""
+    length = np.linalg.norm(rows[:, 3:6] - rows[:, 0:3], axis=1)
+    return length / 2 + rows[:, 6:10].max(axis=1) + tolerance
+
+
+def _carved_pairs(points: np.ndarray, tolerance: float, rows: np.ndarray, terms: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Point index, row index and carve_distance of every (point, carve row)
+    pair that the broadphase cannot tell is more than tolerance apart."""
+    if not len(points) or not len(rows):
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32)
+    tree = cKDTree(points)
+    middle = (rows[:, 0:3] + rows[:, 3:6]) / 2
+    found = tree.query_ball_point(middle, _reach(rows, tolerance), return_sorted=False)
+    counts = np.fromiter(map(len, found), dtype=np.intp, count=len(found))
+    row = np.repeat(np.arange(len(rows)), counts)
+    point = np.fromiter(chain.from_iterable(found), dtype=np.intp, count=counts.sum())
+    samples = points.astype(np.float32)
+    distance = np.empty(len(point), dtype=np.float32)
+    for start in range(0, len(point), _BATCH):
+        part = slice(start, start + _BATCH)
+        distance[part] = carve_distance(samples[point[part]], terms[row[part]])
+    return point, row, distance
+
+
+def carved_distance(points: np.ndarray, tolerance: float, rows: np.ndarray, terms: np.ndarray) -> np.ndarray:
+    """Approximate distance from each point to the carved space, negative
+    inside. It is only meaningful up to tolerance: points farther from every
+    primitive get a larger value, or inf."""
+    point, _, distance = _carved_pairs(points, tolerance, rows, terms)
+    nearest = np.full(len(points), np.inf, dtype=np.float32)
+    np.minimum.at(nearest, point, distance)
+    return nearest
+
+
+def _outside(section: str, names: list, points: np.ndarray, rows: np.ndarray, terms: np.ndarray, check: str, what: str) -> list[LintIssue]:
+    distance = carved_distance(points, OUTSIDE_TOLERANCE, rows, terms)
+    return [
+        LintIssue(check, (section, names[i]), f"{what} is more than {OUTSIDE_TOLERANCE:g} out of the carved space")
+        for i in np.flatnonzero(distance > OUTSIDE_TOLERANCE)
+    ]
+
+
+def _pillars_in_rock(names: list, pillars: list, rows: np.ndarray, terms: np.ndarray) -> list[LintIssue]:
+    """Pillars whose capsules do not reach the carved space anywhere, so
+    they only fill rock with rock."""
+    points = [point for pillar in pillars for point in pillar.points]
+    if not points:
+        return []
+    pillar = np.repeat(np.arange(len(pillars)), [len(p.points) for p in pillars])
+    location = np.array([[p.location.x, p.location.y, p.location.z] for p in points], dtype=float)
+    scale = np.array([p.range_scale.max for p in pillars], dtype=float)
+    radius = np.array([p.points_range.max for p in points], dtype=float) * scale[pillar]
+    a, b = consecutive_pairs(pillar)
+    s = np.linspace(0, 1, PILLAR_SAMPLES)
+    samples = (location[a, None] + s[None, :, None] * (location[b] - location[a])[:, None]).reshape(-1, 3)
+    sample_radius = (radius[a, None] + s[None] * (radius[b] - radius[a])[:, None]).ravel()
+    distance = carved_distance(samples, sample_radius.max(), rows, terms)
+    touching = np.bincount(np.repeat(pillar[a], PILLAR_SAMPLES)[distance <= sample_radius], minlength=len(pillars))
+    return [
+        LintIssue("pillar-in-rock", ("FloodFillPillars", names[i]), "pillar is in solid rock, it does not reach the carved space")
+        for i in np.flatnonzero(touching == 0)
+    ]
+
+
+def _roots(parent: np.ndarray) -> np.ndarray:
+    """Root of every node of a union-find forest, by pointer jumping."""
+    while True:
+        jumped = parent[parent]
+        if (jumped == parent).all():
+            return parent
+        parent = jumped
+
+
+def _root(parent: np.ndarray, node: int) -> int:
+    while parent[node] != node:
+        node = parent[node]
+    return node
+
+
+def _touches(rows: np.ndarray, terms: np.ndarray) -> bool:
+    """Whether the primitives of the carve_primitives rows can touch the
+    primitives of the carve_terms. Every point of a primitive is within its
+    largest extent of the axis, and every point of the axis within a quarter
+    of its length of its ends or middle, so the ones found apart are."""
+    a, b = rows[:, 0:3], rows[:, 3:6]
+    samples = np.concatenate([a, (a + b) / 2, b])
+    reach = np.tile(rows[:, 6:10].max(axis=1) + np.linalg.norm(b - a, axis=1) / 4, 3)
+    return bool((carve_distance(samples[:, None], terms[None]) <= reach[:, None]).any())
+
+
+def _disconnected_lines(names: list, row_line: np.ndarray, rows: np.ndarray, terms: np.ndarray) -> list[LintIssue]:
+    """FloodFillLines out of the largest connected part of the carved space.
+    The pairs of lines whose boxes overlap come from a cKDTree of the boxes,
+    and only the pairs that are not connected yet through other lines are
+    tested, so a dense room needs about one test per line."""
+    if len(names) < 2 or not len(rows):
+        return []
+    order = np.argsort(row_line, kind="stable")
+    rows, terms = rows[order], terms[order]
+    starts = np.searchsorted(row_line[order], np.arange(len(names) + 1))
+    carving = np.flatnonzero(starts[1:] > starts[:-1])  # Lines without points carve nothing
+
+    middle = (rows[:, 0:3] + rows[:, 3:6]) / 2
+    reach = _reach(rows, 0)[:, None]
+    lows = np.minimum.reduceat(middle - reach, starts[carving])
+    highs = np.maximum.reduceat(middle + reach, starts[carving])
+    centers, halves = (lows + highs) / 2, (highs - lows) / 2
+    pairs = cKDTree(centers).query_pairs(2 * np.linalg.norm(halves, axis=1).max(), output_type="ndarray")
+    i, j = pairs.T
+    overlap = (np.abs(centers[i] - centers[j]) <= halves[i] + halves[j]).all(axis=1)
+    i, j = i[overlap], j[overlap]
+    # Close lines are the likeliest to touch, and connect the most pairs early:
+    closest = np.argsort(np.linalg.norm(centers[i] - centers[j], axis=1), kind="stable")
+
+    parent = np.arange(len(carving))
+    for start in range(0, len(closest), _PAIR_CHUNK):
+        # Flattens the forest, and drops the pairs it already connects:
+        parent = _roots(parent)
+        pair = closest[start:start + _PAIR_CHUNK]
+        pair = pair[parent[i[pair]] != parent[j[pair]]]
+        for first, second in zip(i[pair], j[pair]):
+            root_first, root_second = _root(parent, first), _root(parent, second)
+            if root_first == root_second:
+                continue
+            line_first, line_second = carving[first], carving[second]
+            if _touches(rows[starts[line_first]:starts[line_first + 1]], terms[starts[line_second]:starts[line_second + 1]]):
+                parent[root_first] = root_second
+
+    root = _roots(parent)
+    main = np.bincount(root).argmax()
+    return [
+        LintIssue("line-disconnected", ("FloodFillLines", names[line]), "line is not connected to the rest of the carved space")
+        for line in carving[root != main]
+    ]
+
+
+def _selectors(room_json: dict) -> list[LintIssue]:
+    """RandomSelector references the builder cannot resolve, or resolves to
+    the first of several features with the name."""
+    features = Counter(list_nested_keys(room_json, list(FEATURE_SECTIONS)))
+    issues = []
+    for selector, references in room_json.get("RandomSelectors", {}).items():
+        for reference in references:
+            if features[reference] == 0:
+                issues.append(LintIssue("selector-missing", ("RandomSelectors", selector), f"{reference} is not a feature of the room"))
+            elif features[reference] > 1:
+                issues.append(LintIssue(
+                    "selector-ambiguous", ("RandomSelectors", selector),
+                    f"{reference} names {features[reference]} features, only the first one is used"
+                ))
+    return issues
+
+
+def lint_room(room_json: dict) -> list[LintIssue]:
+    """Every issue found in the room. Raises like parse_room_json on a room
+    it cannot parse."""
+    lines, entrances, pillars, pe_mininghead, pe_poddropdown = parse_room_json(room_json)
+    ffill = room_json["FloodFillLines"]
+    rows = carve_primitives(list(ffill.values()))
+    terms = carve_terms(rows)
+    point_line = np.repeat(np.arange(len(lines)), [len(line) for line in lines])
+    row_line = point_line[consecutive_pairs(point_line)[0]]  # The rows of carve_primitives, in the same order
+
+    issues = _outside(
+        "Entrances", list(room_json["Entrances"]), np.array([e.location for e in entrances], dtype=float).reshape(-1, 3),
+        rows, terms, "entrance-outside", "entrance"
+    )
+    for section, features in (("PE_MiningHead", pe_mininghead), ("PE_PodDropDown", pe_poddropdown)):
+        if features:
+            points = np.array([[f.x, f.y, f.z] for f in features], dtype=float)
+            issues += _outside(section, list(room_json[section]), points, rows, terms, "pe-outside", section)
+    if pillars:
+        issues += _pillars_in_rock(list(room_json["FloodFillPillars"]), pillars, rows, terms)
+    issues += _disconnected_lines(list(ffill), row_line, rows, terms)
+    issues += _selectors(room_json)
+    return issues
+
+
+if __name__ == "__main__":
+    # Lint rooms: python room_lint.py <room.json> [<room.json> ...]
+    import json
+    import sys
+
+    for file in sys.argv[1:]:
+        with open(file, "r") as f:
+            room = json.load(f)
+        start = time.perf_counter()
+        try:
+            found = lint_room(room)
+        except Exception as e:
+            print(f"{file}: cannot be parsed: {e!r}")
+            continue
+        print(f"{file}: {len(found)} issues in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for issue in found:
+            print(f"    {issue}")
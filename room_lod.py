@@ -0,0 +1,94 @@
+"""Level of detail of the FloodFillLine ellipsoids in the 3D view.
+
+Each ellipsoid gets the finest tessellation its projected size on screen
+needs. When the room goes over the vertex budget, the smallest ellipsoids on
+screen are the first to get coarser. The budget follows the measured frame
+time, to keep the view fluid while orbiting the camera.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from room_geometry import N_LAT, N_LAT_POINTS, N_LON, N_LON_POINTS, unit_half_ellipsoid
+
+# Tessellations from the finest to the coarsest, as (n_lat, n_lat_points, n_lon, n_lon_points):
+LEVELS = (
+    (N_LAT, N_LAT_POINTS, N_LON, N_LON_POINTS),
+    (3, 20, 8, 7),
+    (2, 12, 4, 4),
+    (1, 12, 0, 0),  # Only the base circle
+)
+# Smallest projected radius, in pixels, of an ellipsoid drawn at each level
+# but the coarsest one:
+MIN_PIXELS = np.array((60.0, 20.0, 6.0))
+SETTLED_FRAMES = 30  # Frames in a row without a budget change after which the budget is settled
+
+
+@lru_cache(maxsize=1)
+def level_templates() -> tuple[np.ndarray, ...]:
+    """The "lines" mode vertices of the unit half-ellipsoid at every level.
+    Always the same arrays, so the GL items only upload them once."""
+    return tuple(unit_half_ellipsoid(*level)[0].reshape(-1, 3) for level in LEVELS)
+
+
+class LevelOfDetail:
+    """Picks the level of every ellipsoid. vertex_budget adapts between
+    min_budget and max_budget to keep frames under frame_time_target
+    seconds."""
+
+    def __init__(self, vertex_budget: int = 1_500_000, frame_time_target: float = 1 / 60, min_budget: int = 50_000, max_budget: int = 8_000_000):
+        self.vertex_budget = vertex_budget
+        self.frame_time_target = frame_time_target
+        self.unchanged_frames = 0  # Frames recorded since the last budget change
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self.vertices_per_level = np.array([len(t) for t in level_templates()])
+
+    def levels(self, center: np.ndarray, scale: np.ndarray, camera: np.ndarray, focal_px: float) -> np.ndarray:
+        """Level of each ellipsoid, from its center and scale (see
+        room_geometry.ellipsoid_instances), the camera position and the
+        focal length of the view in pixels."""
+        if len(center) == 0:
+            return np.zeros(0, dtype=int)
+        distance = np.maximum(np.linalg.norm(center - camera, axis=1), 1e-3)
+        pixels = np.abs(scale).max(axis=1) / distance * focal_px
+
+        # Raising the pixel thresholds by a factor moves the smallest
+        # ellipsoids down first. Find the smallest factor that fits the budget:
+        level = self._levels(pixels, 1.0)
+        if self._cost(level) <= self.vertex_budget:
+            return level
+        low, high = 1.0, 2.0
+        while self._cost(self._levels(pixels, high)) > self.vertex_budget and high < 1e6:
+            low, high = high, high * 2
+        for _ in range(8):  # The factor is then within 1% of the best one
+            middle = (low * high) ** 0.5
+            if self._cost(self._levels(pixels, middle)) > self.vertex_budget:
+                low = middle
+            else:
+                high = middle
+        return self._levels(pixels, high)
+
+    @staticmethod
+    def _levels(pixels: np.ndarray, factor: float) -> np.ndarray:
+        return (pixels[:, None] < MIN_PIXELS * factor).sum(axis=1)
+
+    def _cost(self, level: np.ndarray) -> int:
+        return int(self.vertices_per_level[level].sum())
+
+    def record_frame(self, seconds: float) -> bool:
+        """Adapts the budget to the last frame time. Returns True when the
+        budget changed and the levels need to be picked again."""
+        budget = self.vertex_budget
+        if seconds > self.frame_time_target * 1.2:
+            budget = max(self.min_budget, int(budget * 0.7))
+        elif seconds < self.frame_time_target * 0.5:
+            budget = min(self.max_budget, int(budget * 1.25))
+        changed = budget != self.vertex_budget
+        self.vertex_budget = budget
+        self.unchanged_frames = 0 if changed else self.unchanged_frames + 1
+        return changed
+
+    def settled(self) -> bool:
+        """Whether the budget stopped adapting to the frame times."""
+        return self.unchanged_frames >= SETTLED_FRAMES
@@ -1,4 +1,4 @@
-from jsonschema import validate
+import room_validator
 
 schema = {
   "type": "object",
@@ -226,4 +226,5 @@ schema = {
 
 
 def validate_room(json_room: dict):
-    validate(json_room, schema=schema)
+    # The validator is compiled once, see room_validator:
+    room_validator.validate_room(json_room)
@@ -0,0 +1,155 @@
+"""Room validation with a cached jsonschema validator and a fast path.
+
+fast_is_valid() is a hand-written check of room_parser.schema. It only
+answers True when the room certainly passes the schema, and anything it is
+not sure about falls through to the compiled jsonschema validator. So the
+error messages are still the ones jsonschema gives.
+"""
+import time
+from functools import lru_cache
+
+from jsonschema import exceptions, validate, validators
+
+_NUMBER = (int, float)
+ENTRANCE_TYPES = ("Entrance", "Secondary", "Exit")
+# Lowercase keys the schema constrains on a FloodFillLine point. Points using
+# them are left to jsonschema:
+_POINT_SCHEMA_KEYS = ("location", "hrange", "vrange")
+_PILLAR_RANGES = ("Range", "NoiseRange", "SkewFactor", "FillAmount")
+
+
+@lru_cache(maxsize=1)
+def compiled_validator():
+    from room_parser import schema
+
+    cls = validators.validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, _NUMBER) and not isinstance(value, bool)
+
+
+def _is_xyz(value) -> bool:
+    return (
+        isinstance(value, dict)
+        and _is_number(value.get("X"))
+        and _is_number(value.get("Y"))
+        and _is_number(value.get("Z"))
+    )
+
+
+def _is_min_max(value) -> bool:
+    return isinstance(value, dict) and _is_number(value.get("Min")) and _is_number(value.get("Max"))
+
+
+def _ffill_point_ok(point) -> bool:
+    if not isinstance(point, dict):
+        return False
+    if "Location" not in point or "HRange" not in point or "VRange" not in point:
+        return False
+    return not any(key in point for key in _POINT_SCHEMA_KEYS)
+
+
+def _entrance_ok(entrance) -> bool:
+    if not isinstance(entrance, dict) or not _is_xyz(entrance.get("Location")):
+        return False
+    if entrance.get("Type") not in ENTRANCE_TYPES:
+        return False
+    direction = entrance.get("Direction")
+    return (
+        isinstance(direction, dict)
+        and _is_number(direction.get("Roll"))
+        and _is_number(direction.get("Yaw"))
+        and _is_number(direction.get("Pitch"))
+    )
+
+
+def _pillar_ok(pillar) -> bool:
+    if not isinstance(pillar, dict) or not isinstance(pillar.get("Points"), list):
+        return False
+    for key in ("RangeScale", "NoiseRangeScale"):
+        if key in pillar and not _is_min_max(pillar[key]):
+            return False
+    for point in pillar["Points"]:
+        if not isinstance(point, dict):
+            return False
+        if "Location" in point and not _is_xyz(point["Location"]):
+            return False
+        for key in _PILLAR_RANGES:
+            if key in point and not _is_min_max(point[key]):
+                return False
+    return True
+
+
+def fast_is_valid(room) -> bool:
+    """True only if the room is valid for room_parser.schema."""
+    if not isinstance(room, dict):
+        return False
+    if not isinstance(room.get("Name"), str) or not _is_number(room.get("Bounds")):
+        return False
+    tags = room.get("Tags")
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        return False
+
+    lines = room.get("FloodFillLines")
+    if not isinstance(lines, dict):
+        return False
+    for line in lines.values():
+        if not isinstance(line, dict) or not isinstance(line.get("Points"), list):
+            return False
+        if "RoomFeatures" in line and not isinstance(line["RoomFeatures"], list):
+            return False
+        if not all(_ffill_point_ok(point) for point in line["Points"]):
+            return False
+
+    entrances = room.get("Entrances")
+    if not isinstance(entrances, dict) or not all(_entrance_ok(e) for e in entrances.values()):
+        return False
+
+    if "RandomSelectors" in room:
+        selectors = room["RandomSelectors"]
+        if not isinstance(selectors, dict) or not all(isinstance(s, list) for s in selectors.values()):
+            return False
+
+    if "FloodFillPillars" in room:
+        pillars = room["FloodFillPillars"]
+        if not isinstance(pillars, dict) or not all(_pillar_ok(p) for p in pillars.values()):
+            return False
+
+    return True
+
+
+def validate_room(json_room: dict):
+    """Raises jsonschema.ValidationError with the same error jsonschema.validate gives."""
+    if fast_is_valid(json_room):
+        return
+    error = exceptions.best_match(compiled_validator().iter_errors(json_room))
+    if error is not None:
+        raise error
+
+
+def benchmark(room_json: dict, repeats: int = 20) -> dict:
+    """Mean validation time of a room with plain jsonschema.validate (the
+    previous implementation) and with validate_room."""
+    from room_parser import schema
+
+    results = {}
+    for label, fn in (("jsonschema_s", lambda: validate(room_json, schema=schema)), ("validate_room_s", lambda: validate_room(room_json))):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn()
+        results[label] = (time.perf_counter() - start) / repeats
+    results["fast_path"] = fast_is_valid(room_json)
+    return results
+
+
+if __name__ == "__main__":
+    # Validation benchmark: python room_validator.py <room.json> [repeats]
+    import json
+    import sys
+
+    with open(sys.argv[1], "r") as f:
+        room = json.load(f)
+    print(benchmark(room, int(sys.argv[2]) if len(sys.argv) > 2 else 20))
@@ -1,10 +1,26 @@
+import ctypes
+import time
+import weakref
+from collections import deque
+from dataclasses import dataclass, field
+from math import radians, tan
+
 import numpy as np
-from more_itertools import sliding_window
-from scipy.spatial.transform import Rotation as R
 import pyqtgraph.opengl as gl
-from PySide6.QtGui import QVector3D
-
-DEFAULT_ENTRANCE_VECTOR = np.array((500, 0, 0))
+from OpenGL import GL
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+from PySide6.QtCore import Qt, Signal
+from PySide6.QtGui import QOpenGLContext, QVector3D
+
+from gl_batched import BatchedItem
+from gl_instanced import InstancedWireframeItem
+from room_lod import LevelOfDetail, level_templates
+from room_volume import CaveVolume, VolumeMesh
+from room_geometry import (
+    ellipsoid_instances, entrance_arrows, entrance_directions, ffill_columns, ffill_vertices, instance_bounds,
+    locations, pillar_vertices, rotators, tangent_vertices
+)
+from tracing import span
 
 COLORS = {
     "gray": (0.5, 0.5, 0.5, 1.0),
@@ -16,286 +32,379 @@ COLORS = {
     "black": (0.0, 0.0, 0.0, 1.0),
     "white": (1.0, 1.0, 1.0, 1.0),
 }
+VOLUME_COLOR = (0.55, 0.5, 0.45, 1.0)
+CLICK_SLOP_PX = 4  # A press and release closer than this is a click, not a drag
+RESAMPLE_FRAMES = 60  # Without timer queries, once the LOD budget settled, one frame in this many is timed
+
+
+# Style of the batched items of each layer, by part, see layer_specs:
+LAYER_PARTS = {
+    "ffill": {"lines": {"width": 1.0}, "ellipsoids": {"color": COLORS["gray"], "width": 1.0}},
+    "entrances": {"lines": {"width": 2.0}, "points": {"size": 10}},
+    "pillars": {"lines": {"width": 1.5}},
+    "pe_mining_head": {"points": {"size": 12}},
+    "pe_pod_drop_down": {"points": {"size": 12}},
+}
 
 
-def rotate_vector(v, roll, pitch, yaw):
-    """This method is used to apply the rotator defined in the Entrances to a default vector v."""
-    r = R.from_euler("zyx", [yaw, pitch, roll], degrees=True)  # yaw, pitch, roll
-    return r.apply(v)
-
-
-def return_ffill_parameters(S: dict):
-    # First we compute the height of the room, which is the minimum between
-    # CeilingHeight (if exists) or VRange (always exists, forced by the schema):
-    height = min(h for h in [S["VRange"], S.get("CeilingHeight")] if h is not None)
-    center = [S["Location"]["X"], S["Location"]["Y"], S["Location"]["Z"]]
-    # The Z coordinate can me moved up or down by the FloorDepth, if it exists.
-    # If it does, we also need to change the height of the room accordingly.
-    if "FloorDepth" in S:
-        floor_depth = S["Location"]["Z"] + S["FloorDepth"]
-        if floor_depth <= height:
-            center[2] = floor_depth
-            height -= floor_depth
-    ra, rb = S["HRange"], S["HRange"]
-
-    return np.array(center), height, ra, rb
-
-
-def create_ellipsoid_lines(S: dict) -> np.ndarray:
-    """Create wireframe lines for an ellipsoid. Returns array of line segments."""
-    center, height, ra, rb = return_ffill_parameters(S)
-
-    lines = []
-
-    # Latitude circles (horizontal)
-    n_lat = 6
-    n_points = 30
-    for i in range(n_lat + 1):
-        phi = (np.pi / 2) * i / n_lat  # 0 to pi/2 (top half)
-        z = center[2] + height * np.cos(phi)
-        r = ra * np.sin(phi)
-        if r < 1e-6:
-            continue
-        theta = np.linspace(0, 2 * np.pi, n_points)
-        x = center[0] + r * np.cos(theta)
-        y = center[1] + r * np.sin(theta)
-        for j in range(len(theta) - 1):
-            lines.append([[x[j], y[j], z], [x[j + 1], y[j + 1], z]])
-
-    # Longitude lines (vertical)
-    n_lon = 12
-    n_points = 15
-    for i in range(n_lon):
-        theta = 2 * np.pi * i / n_lon
-        phi = np.linspace(0, np.pi / 2, n_points)
-        x = center[0] + ra * np.sin(phi) * np.cos(theta)
-        y = center[1] + rb * np.sin(phi) * np.sin(theta)
-        z = center[2] + height * np.cos(phi)
-        for j in range(len(phi) - 1):
-            lines.append([[x[j], y[j], z[j]], [x[j + 1], y[j + 1], z[j + 1]]])
-
-    return np.array(lines) if lines else np.empty((0, 2, 3))
-
-
-def create_tangent_lines(S1: dict, S2: dict) -> list:
-    """This method will calculate the tangent lines between pairs of
-    FLoodFillLines. These are plotted in the main plot to show that the
-    elements of the same Line are connected together.
-    """
-    C1, h1, r1, _ = return_ffill_parameters(S1)
-    C2, h2, r2, _ = return_ffill_parameters(S2)
-    tangents = []
-    # Top tangent line connecting the peaks;
-    tangents.append([[C1[0], C1[1], C1[2] + h1], [C2[0], C2[1], C2[2] + h2]])
-    # Lower two tangent lines connecting the base circles:
-    dvec = C2 - C1
-    dxy = np.linalg.norm(dvec[:2])
-
-    if dxy == 0 or dxy < abs(r1 - r2):
-        return tangents
-
-    angle = np.arctan2(dvec[1], dvec[0])
-    alpha = np.arccos((r1 - r2) / dxy)
-
-    for sign in [1, -1]:
-        theta = angle + sign * alpha
-        dir2d = np.array([np.cos(theta), np.sin(theta), 0])
-
-        P1 = C1 + r1 * dir2d
-        P2 = C2 + r2 * dir2d
-        tangents.append([[P1[0], P1[1], P1[2]], [P2[0], P2[1], P2[2]]])
-
-    return tangents
-
-
-def create_arrow_lines(start, direction, arrow_size=50):
-    """Create lines for an arrow"""
-    start = np.array(start)
-    direction = np.array(direction)
-    end = start + direction
-
-    lines = [[start.tolist(), end.tolist()]]
-
-    # Arrow head
-    if np.linalg.norm(direction) > 1e-6:
-        d = direction / np.linalg.norm(direction)
-        # Find perpendicular vectors
-        if abs(d[2]) < 0.9:
-            perp1 = np.cross(d, [0, 0, 1])
-        else:
-            perp1 = np.cross(d, [1, 0, 0])
-        perp1 = perp1 / np.linalg.norm(perp1)
-        perp2 = np.cross(d, perp1)
-
-        head_base = end - d * arrow_size
-        for perp in [perp1, -perp1, perp2, -perp2]:
-            head_point = head_base + perp * arrow_size * 0.3
-            lines.append([end.tolist(), head_point.tolist()])
-
-    return lines
+@dataclass
+class _Feature:
+    """The JSON one room feature was drawn from, and its bounding box."""
+    source: object
+    bounds: tuple | None = None  # (mins, maxs) of the points used for the bounding box
+
+
+def _points_bounds(points) -> tuple | None:
+    points = np.asarray(points).reshape(-1, 3)
+    if len(points) == 0:
+        return None
+    return points.min(axis=0), points.max(axis=0)
+
+
+def _location(feature: dict) -> list:
+    return [feature["Location"]["X"], feature["Location"]["Y"], feature["Location"]["Z"]]
+
+
+def _line_parts(vertices: np.ndarray, offsets: np.ndarray, colors: list) -> list:
+    """Splits a layer vertex buffer into the "lines" part of each feature,
+    None for the features without segments."""
+    layer = []
+    for start, end, color in zip(offsets[:-1], offsets[1:], colors):
+        layer.append((vertices[start:end], COLORS[color]) if end > start else None)
+    return layer
+
+
+def ffill_layer_specs(lines: list, instanced: bool = True) -> list:
+    """Ellipsoid wireframes of every point of each FloodFillLine, and the
+    tangents between consecutive points. With instanced=True the ellipsoids
+    are only the center and scale of each point, drawn by the instanced item
+    of the layer at their level of detail. Otherwise all the segments are
+    lines."""
+    columns = ffill_columns(lines)
+    template = level_templates()[0]
+    center, scale, point_offsets = ellipsoid_instances(columns)
+    points = [slice(start, end) for start, end in zip(point_offsets[:-1], point_offsets[1:])]
+    # The tangents are inside the ellipsoids bounding box:
+    bounds = [instance_bounds(template, center[p], scale[p]) for p in points]
+    if not instanced:
+        vertices, offsets = ffill_vertices(columns)
+        segments = _line_parts(vertices, offsets, ["gray"] * len(lines))
+        return [({"lines": part} if part else {}, line_bounds) for part, line_bounds in zip(segments, bounds)]
+
+    tangents, tangent_offsets = tangent_vertices(columns)
+    tangent_parts = _line_parts(tangents, tangent_offsets, ["gray"] * len(lines))
+    layer = []
+    for p, line_tangents, line_bounds in zip(points, tangent_parts, bounds):
+        parts = {}
+        if p.stop > p.start:
+            parts["ellipsoids"] = (center[p], scale[p])
+        if line_tangents:
+            parts["lines"] = line_tangents
+        layer.append((parts, line_bounds))
+    return layer
+
+
+def entrance_color(entrance: dict) -> str:
+    match entrance["Type"]:
+        case "Entrance":
+            return "blue"
+        case "Exit":
+            return "red"
+        case "Secondary":
+            return "orange"
+        case _:
+            print(f"Unknown entrance type: {entrance['Type']}")
+            return "black"
+
+
+def entrance_layer_specs(entrances: list) -> list:
+    """A colored point at each entrance location and its direction arrow. The
+    directions of all the entrances are rotated together."""
+    location = locations(entrances)
+    vertices, offsets = entrance_arrows(location, entrance_directions(rotators(entrances)))
+    arrows = _line_parts(vertices, offsets, ["green"] * len(entrances))
+    layer = []
+    for entrance, point, arrow in zip(entrances, location, arrows):
+        parts = {"points": (point[None], COLORS[entrance_color(entrance)])}
+        if arrow:
+            parts["lines"] = arrow
+        layer.append((parts, _points_bounds(point)))
+    return layer
+
+
+def pillar_layer_specs(pillars: list) -> list:
+    """The segments of each pillar. pillars are (color, pillar) pairs, see room_features."""
+    vertices, offsets = pillar_vertices([pillar for _, pillar in pillars])
+    layer = _line_parts(vertices, offsets, [color for color, _ in pillars])
+    # The bounding box uses the pillar points, even for pillars with one point:
+    return [({"lines": part} if part else {}, _points_bounds(locations(pillar["Points"]))) for part, (_, pillar) in zip(layer, pillars)]
+
+
+def pe_specs(feature: dict, color: str) -> tuple[dict, tuple | None]:
+    location = _location(feature)
+    return {"points": (np.array([location]), COLORS[color])}, _points_bounds([location])
+
+
+PILLAR_COLORS = ["blue", "red", "orange", "green", "purple", "white"]
+
+
+# Layers shown by each switch of the plot context:
+LAYER_SWITCHES = {
+    "show_ffill": ("ffill",),
+    "show_entrances": ("entrances", "pe_mining_head", "pe_pod_drop_down"),
+    "show_pillars": ("pillars",),
+}
 
 
-def room_plotter_3d(view: gl.GLViewWidget, plot_ctx: dict):
-    """This method receives the axes and canvas from the main GUI in main.py and
-    a context object with:
-        + The JSON dict defining the room,
-        + Boolean switches telling which features we need to plot,
-    and it plots the room.
-    """
-    room_json = plot_ctx["room"]
-
-    # Clear existing items
-    for item in view.items[:]:
-        view.removeItem(item)
-
-    all_points = []  # Track all points for auto-centering
-
-    # 1. We plot the FloodFillLines, if ctx.show_ffill is true:
-    if plot_ctx["show_ffill"]:
-        all_lines = []
-        for _, line in room_json["FloodFillLines"].items():
-            line_points = line["Points"]
-            for ffill in line_points:
-                # Draw the ellipsoid wireframe:
-                ellipsoid_lines = create_ellipsoid_lines(ffill)
-                if len(ellipsoid_lines) > 0:
-                    all_lines.extend(ellipsoid_lines.tolist())
-                    all_points.extend(ellipsoid_lines.reshape(-1, 3).tolist())
-
-            # For every pair of FloodFillLines, draw the tangent lines
-            for ffill_1, ffill_2 in sliding_window(line_points, 2):
-                for tangent in create_tangent_lines(ffill_1, ffill_2):
-                    all_lines.append(tangent)
-                    all_points.extend(tangent)
-
-        if all_lines:
-            lines_array = np.array(all_lines)
-            line_item = gl.GLLinePlotItem(
-                pos=lines_array.reshape(-1, 3),
-                color=COLORS["gray"],
-                width=1.0,
-                mode="lines",
-            )
-            view.addItem(line_item)
-
-    # 2. We plot the Entrances, if ctx.show_entrances is true:
-    if plot_ctx["show_entrances"]:
-        entrance_points = {"blue": [], "red": [], "orange": [], "black": []}
-        arrow_lines = []
-
-        for _, entrance in room_json["Entrances"].items():
-            x, y, z = (
-                entrance["Location"]["X"],
-                entrance["Location"]["Y"],
-                entrance["Location"]["Z"],
-            )
-            match entrance["Type"]:
-                case "Entrance":
-                    color = "blue"
-                case "Exit":
-                    color = "red"
-                case "Secondary":
-                    color = "orange"
-                case _:
-                    print(f"Unknown entrance type: {entrance.entrance_type}")
-                    color = "black"
-
-            entrance_points[color].append([x, y, z])
-            all_points.append([x, y, z])
-
-            # Direction arrow
-            rotator = (
-                entrance["Direction"]["Roll"],
-                entrance["Direction"]["Pitch"],
-                entrance["Direction"]["Yaw"],
-            )
-            rotated_vector = rotate_vector(DEFAULT_ENTRANCE_VECTOR, *rotator)
-            arrow_lines.extend(create_arrow_lines([x, y, z], rotated_vector))
-
-        # Add scatter points for each color
-        for color, points in entrance_points.items():
-            if points:
-                scatter = gl.GLScatterPlotItem(
-                    pos=np.array(points),
-                    color=COLORS[color],
-                    size=10,
-                    pxMode=True,
-                )
-                view.addItem(scatter)
-
-        # Add direction arrows
-        if arrow_lines:
-            arrow_array = np.array(arrow_lines)
-            arrow_item = gl.GLLinePlotItem(
-                pos=arrow_array.reshape(-1, 3),
-                color=COLORS["green"],
-                width=2.0,
-                mode="lines",
-            )
-            view.addItem(arrow_item)
-
-    # 3. We plot the FloodFillPillars:
-    if plot_ctx["show_pillars"] and "FloodFillPillars" in room_json:
-        pillar_colors = ["blue", "red", "orange", "green", "purple", "white"]
-        for idx, (_, pillar) in enumerate(room_json["FloodFillPillars"].items()):
-            points = [
-                (p["Location"]["X"], p["Location"]["Y"], p["Location"]["Z"])
-                for p in pillar["Points"]
-            ]
-            all_points.extend(points)
-            pillar_lines = []
-            for i in range(len(points) - 1):
-                pillar_lines.append([points[i], points[i + 1]])
-
-            if pillar_lines:
-                pillar_array = np.array(pillar_lines)
-                pillar_item = gl.GLLinePlotItem(
-                    pos=pillar_array.reshape(-1, 3),
-                    color=COLORS[pillar_colors[idx % len(pillar_colors)]],
-                    width=1.5,
-                    mode="lines",
-                )
-                view.addItem(pillar_item)
-
-    # 4. In case of a PE room, we plot the MiningHead and DropPodDown features:
-    if plot_ctx["show_entrances"] and (
-        "PE_MiningHead" in room_json or "PE_PodDropDown" in room_json
-    ):
-        pe_points = {"purple": [], "black": []}
-
-        for _, minehead in room_json.get("PE_MiningHead", {}).items():
-            x, y, z = (
-                minehead["Location"]["X"],
-                minehead["Location"]["Y"],
-                minehead["Location"]["Z"],
-            )
-            pe_points["purple"].append([x, y, z])
-            all_points.append([x, y, z])
-
-        for _, pod_location in room_json.get("PE_PodDropDown", {}).items():
-            x, y, z = (
-                pod_location["Location"]["X"],
-                pod_location["Location"]["Y"],
-                pod_location["Location"]["Z"],
-            )
-            pe_points["black"].append([x, y, z])
-            all_points.append([x, y, z])
-
-        for color, points in pe_points.items():
-            if points:
-                scatter = gl.GLScatterPlotItem(
-                    pos=np.array(points),
-                    color=COLORS[color],
-                    size=12,
-                    pxMode=True,
-                )
-                view.addItem(scatter)
-
-    # 5. Add cubic bounding box grid
-    if all_points:
-        pts = np.array(all_points)
-        mins = pts.min(axis=0)
-        maxs = pts.max(axis=0)
+def hidden_layers(plot_ctx: dict) -> set:
+    return {layer for switch, layers in LAYER_SWITCHES.items() if not plot_ctx[switch] for layer in layers}
+
+
+def room_features(room_json: dict) -> dict:
+    """Every feature of the room, keyed by (layer, name). The value is what
+    the feature geometry depends on."""
+    features = {}
+    for name, line in room_json["FloodFillLines"].items():
+        features[("ffill", name)] = line
+    for name, entrance in room_json["Entrances"].items():
+        features[("entrances", name)] = entrance
+    # The pillar color depends on its position, so it is part of the key value:
+    for idx, (name, pillar) in enumerate(room_json.get("FloodFillPillars", {}).items()):
+        features[("pillars", name)] = (PILLAR_COLORS[idx % len(PILLAR_COLORS)], pillar)
+    for name, minehead in room_json.get("PE_MiningHead", {}).items():
+        features[("pe_mining_head", name)] = minehead
+    for name, pod_location in room_json.get("PE_PodDropDown", {}).items():
+        features[("pe_pod_drop_down", name)] = pod_location
+    return features
+
+
+def layer_specs(layer: str, sources: list, instanced: bool = True) -> list:
+    """(specs, bounds) of every feature of a layer in sources. specs are the
+    parts of the feature in the items of its layer, see LAYER_PARTS: "lines"
+    and "points" are (vertices, color), "ellipsoids" is (center, scale)."""
+    match layer:
+        case "ffill":
+            return ffill_layer_specs(sources, instanced)
+        case "entrances":
+            return entrance_layer_specs(sources)
+        case "pillars":
+            return pillar_layer_specs(sources)
+        case "pe_mining_head":
+            return [pe_specs(feature, "purple") for feature in sources]
+        case "pe_pod_drop_down":
+            return [pe_specs(feature, "black") for feature in sources]
+    raise KeyError(layer)
+
+
+@dataclass
+class ScenePlan:
+    """What RoomScene.apply changes: the keys of the removed features, and the
+    (source, specs, bounds) of every added or changed feature. volume is the
+    new solid preview mesh, if it changed."""
+    removed: list
+    changed: dict = field(default_factory=dict)
+    volume: VolumeMesh | None = None
+
+
+class RoomScene:
+    """Draws the room features in a GLViewWidget with a few GL items per
+    layer, one per part of LAYER_PARTS: the lines and the points of every
+    feature of a layer are ranges of one BatchedItem vertex buffer, and the
+    FloodFillLine ellipsoids the instances of one InstancedWireframeItem.
+    Each update is diffed against the previous room, and only the ranges of
+    the features that were added, changed or removed are written. The plot
+    context switches show or hide whole layers. The axis, the grids and the
+    camera are only rebuilt when the bounding box of the visible features
+    changes. instanced=False draws the FloodFillLine ellipsoids as plain
+    lines. With solid set, the carved space is also drawn as a mesh, see
+    room_volume."""
+
+    def __init__(self, view: gl.GLViewWidget, instanced: bool = True):
+        self.view = view
+        self.instanced = instanced
+        self.features: dict[tuple, _Feature] = {}
+        self.items: dict[str, dict] = {}  # layer -> part -> GL item
+        self.ellipsoids: dict[str, dict] = {}  # layer -> key -> (center, scale) in the instanced item
+        self.hidden = set()  # Layers whose items are not drawn
+        self.solid = False
+        self.volume = CaveVolume()
+        self.volume_item = None
+        self.volume_signature = None  # Of the mesh in volume_item
+        self.frame_items = []
+        self.bounds = None
+        self.lod_dirty = False
+
+    def update(self, plot_ctx: dict):
+        self.set_solid(plot_ctx.get("show_volume", False))
+        self.apply(self.plan(plot_ctx["room"]), hidden_layers(plot_ctx))
+
+    def plan(self, room_json: dict) -> ScenePlan:
+        """Diffs the room against the scene and builds the geometry of the
+        changed features. It does not touch any GL item, so it can run in a
+        worker thread as long as the scene is not changed meanwhile."""
+        with span("scene diff"):
+            wanted = room_features(room_json)
+            plan = ScenePlan([key for key in self.features if key not in wanted])
+
+            changed = {}
+            for key, source in wanted.items():
+                feature = self.features.get(key)
+                if feature is None or feature.source != source:
+                    changed.setdefault(key[0], []).append(key)
+
+        # The geometry of the changed features is built per layer, in one batch:
+        for layer, keys in changed.items():
+            with span(f"layer_specs {layer}", features=len(keys)):
+                for key, (specs, bounds) in zip(keys, layer_specs(layer, [wanted[key] for key in keys], self.instanced)):
+                    plan.changed[key] = (wanted[key], specs, bounds)
+
+        # Only the chunks of the volume around the changes are meshed again:
+        if self.solid:
+            with span("volume mesh"):
+                volume = self.volume.mesh(room_json)
+            if volume.signature != self.volume_signature:
+                plan.volume = volume
+        return plan
+
+    def apply(self, plan: ScenePlan, hidden: set | None = None):
+        """Uploads a plan to the GL items. hidden, if given, is the new set of
+        hidden layers. Must run in the GUI thread."""
+        if hidden is not None:
+            self._set_hidden(hidden)
+        with span("scene apply", changed=len(plan.changed), removed=len(plan.removed)):
+            for key in plan.removed:
+                del self.features[key]
+                self._set_parts(key, {})
+
+            for key, (source, specs, bounds) in plan.changed.items():
+                self.features[key] = _Feature(source, bounds)
+                self._set_parts(key, specs)
+            self._set_ellipsoids({layer for layer, _ in [*plan.removed, *plan.changed]} & self.ellipsoids.keys())
+        if plan.volume is not None:
+            with span("volume upload"):
+                self._set_volume(plan.volume)
+
+        with span("scene frame"):
+            self._update_frame()
+
+    def set_hidden_layers(self, hidden: set):
+        """Hides the items of the hidden layers and shows the others, without
+        building any geometry."""
+        self._set_hidden(hidden)
+        self._update_frame()
+
+    def set_solid(self, solid: bool):
+        """Shows or hides the solid preview. The mesh is only built by the
+        next plan, since it needs the room."""
+        self.solid = solid
+        if self.volume_item is not None:
+            self.volume_item.setVisible(solid)
+
+    def _set_volume(self, volume: VolumeMesh):
+        meshdata = gl.MeshData(vertexes=volume.vertexes, faces=volume.faces)
+        if self.volume_item is None:
+            self.volume_item = gl.GLMeshItem(meshdata=meshdata, color=VOLUME_COLOR, smooth=False, shader="shaded", glOptions="opaque")
+            self.volume_item.setVisible(self.solid)
+            self.view.addItem(self.volume_item)
+        else:
+            self.volume_item.setMeshData(meshdata=meshdata)
+        self.volume_signature = volume.signature
+
+    def _set_hidden(self, hidden: set):
+        toggled = self.hidden ^ set(hidden)
+        self.hidden = set(hidden)
+        if not toggled:
+            return
+        for layer in toggled & self.items.keys():
+            for item in self.items[layer].values():
+                item.setVisible(layer not in self.hidden)
+        # Hidden ellipsoids leave their vertex budget to the visible ones:
+        self.lod_dirty = True
+
+    def instanced_items(self) -> list:
+        """The visible instanced items."""
+        return [
+            item
+            for layer, parts in self.items.items() if layer not in self.hidden
+            for item in parts.values() if isinstance(item, InstancedWireframeItem)
+        ]
+
+    def apply_lod(self, lod: LevelOfDetail, camera: np.ndarray, focal_px: float):
+        """Picks the level of detail of every instanced ellipsoid in the scene
+        at once, so the vertex budget is shared by all of them."""
+        items = self.instanced_items()
+        self.lod_dirty = False
+        if not items:
+            return
+        center = np.concatenate([item.center for item in items])
+        scale = np.concatenate([item.scale for item in items])
+        level = lod.levels(center, scale, camera, focal_px)
+        start = 0
+        for item in items:
+            item.set_levels(level[start:start + len(item.center)])
+            start += len(item.center)
+
+    def _layer_item(self, layer: str, part: str):
+        """The item drawing part of every feature of the layer, added to the
+        view at the first feature that has it."""
+        items = self.items.setdefault(layer, {})
+        if part not in items:
+            style = LAYER_PARTS[layer][part]
+            if part == "ellipsoids":
+                items[part] = InstancedWireframeItem(templates=level_templates(), **style)
+            else:
+                items[part] = BatchedItem(mode=part, **style)
+            items[part].setVisible(layer not in self.hidden)
+            self.view.addItem(items[part])
+        return items[part]
+
+    def _set_parts(self, key: tuple, parts: dict):
+        """Writes the parts of the feature key in the items of its layer, and
+        removes it from the items it has no part in."""
+        layer = key[0]
+        for part in parts:
+            if part != "ellipsoids":
+                self._layer_item(layer, part).set_feature(key, *parts[part])
+        for part, item in self.items.get(layer, {}).items():
+            if part not in parts and part != "ellipsoids":
+                item.remove_feature(key)
+        if "ellipsoids" in parts:
+            self.ellipsoids.setdefault(layer, {})[key] = parts["ellipsoids"]
+        elif key in self.ellipsoids.get(layer, {}):
+            del self.ellipsoids[layer][key]
+
+    def _set_ellipsoids(self, layers: set):
+        """Uploads the ellipsoids of the layers to their instanced item. They
+        are sorted by level of detail at every camera move anyway, so the
+        instances are always uploaded whole."""
+        for layer in layers:
+            instances = list(self.ellipsoids[layer].values())
+            item = self._layer_item(layer, "ellipsoids")
+            if instances:
+                item.setData(center=np.concatenate([c for c, _ in instances]), scale=np.concatenate([s for _, s in instances]))
+            else:
+                item.setData(center=np.empty((0, 3)), scale=np.empty((0, 3)))
+            self.lod_dirty = True
+
+    def _update_frame(self):
+        all_bounds = [f.bounds for (layer, _), f in self.features.items() if f.bounds is not None and layer not in self.hidden]
+        if all_bounds:
+            mins = np.min([b[0] for b in all_bounds], axis=0)
+            maxs = np.max([b[1] for b in all_bounds], axis=0)
+            bounds = (tuple(mins), tuple(maxs))
+        else:
+            bounds = None
+        if bounds == self.bounds:
+            return
+        self.bounds = bounds
+
+        for item in self.frame_items:
+            self.view.removeItem(item)
+        self.frame_items = []
+        if bounds is None:
+            return
+
+        mins, maxs = np.array(bounds[0]), np.array(bounds[1])
         center = (mins + maxs) / 2
 
         # Make it a cube using the largest dimension
@@ -311,14 +420,12 @@ def room_plotter_3d(view: gl.GLViewWidget, plot_ctx: dict):
         axis = gl.GLAxisItem()
         axis.setSize(extent, extent, extent)
         axis.translate(cube_min[0], cube_min[1], cube_min[2])
-        view.addItem(axis)
 
         # XY grid (bottom, z=min)
         grid_xy = gl.GLGridItem()
         grid_xy.setSize(extent, extent)
         grid_xy.setSpacing(spacing, spacing)
         grid_xy.translate(center[0], center[1], cube_min[2])
-        view.addItem(grid_xy)
 
         # XZ grid (back wall, y=min)
         grid_xz = gl.GLGridItem()
@@ -326,7 +433,6 @@ def room_plotter_3d(view: gl.GLViewWidget, plot_ctx: dict):
         grid_xz.setSpacing(spacing, spacing)
         grid_xz.rotate(90, 1, 0, 0)
         grid_xz.translate(center[0], cube_min[1], center[2])
-        view.addItem(grid_xz)
 
         # YZ grid (side wall, x=min)
         grid_yz = gl.GLGridItem()
@@ -334,9 +440,173 @@ def room_plotter_3d(view: gl.GLViewWidget, plot_ctx: dict):
         grid_yz.setSpacing(spacing, spacing)
         grid_yz.rotate(90, 0, 1, 0)
         grid_yz.translate(cube_min[0], center[1], center[2])
-        view.addItem(grid_yz)
+
+        self.frame_items = [axis, grid_xy, grid_xz, grid_yz]
+        for item in self.frame_items:
+            self.view.addItem(item)
 
         # Update camera center
-        view.opts['center'] = QVector3D(float(center[0]), float(center[1]), float(center[2]))
-        view.opts['distance'] = extent * 1.5
+        self.view.opts['center'] = QVector3D(float(center[0]), float(center[1]), float(center[2]))
+        self.view.opts['distance'] = extent * 1.5
+
+    def clear(self):
+        for parts in self.items.values():
+            for item in parts.values():
+                self.view.removeItem(item)
+        for item in self.frame_items:
+            self.view.removeItem(item)
+        if self.volume_item is not None:
+            self.view.removeItem(self.volume_item)
+        self.features.clear()
+        self.items.clear()
+        self.ellipsoids.clear()
+        self.frame_items = []
+        self.bounds = None
+        self.volume_item = None
+        self.volume_signature = None
+
+
+class FrameTimer:
+    """GPU time of the frames, measured without waiting for the GPU: each
+    frame is drawn inside a GL_TIME_ELAPSED query, read once the GPU has
+    finished it, usually one or two frames later. Timer queries need
+    desktop OpenGL 3.3 or GL_ARB_timer_query; supported is None until the
+    first frame tells. The first frame compiles the shaders and uploads the
+    buffers, so its time is dropped."""
+
+    def __init__(self):
+        self.supported = None
+        self.free = []  # Query objects to reuse
+        self.pending = deque()  # Queries of the frames the GPU may not have finished, oldest first
+        self.timed = 0  # Frames read back so far
+
+    def begin(self) -> bool:
+        """Starts timing a frame, returns False without timer queries."""
+        if self.supported is None:
+            context = QOpenGLContext.currentContext()
+            self.supported = not context.isOpenGLES() and (
+                context.format().version() >= (3, 3) or context.hasExtension(b"GL_ARB_timer_query")
+            )
+        if not self.supported:
+            return False
+        query = self.free.pop() if self.free else int(GL.glGenQueries(1)[0])
+        GL.glBeginQuery(GL.GL_TIME_ELAPSED, query)
+        self.pending.append(query)
+        return True
+
+    def end(self):
+        GL.glEndQuery(GL.GL_TIME_ELAPSED)
+
+    def finished(self) -> list[float]:
+        """Seconds of GPU time of the frames finished since the last call."""
+        times = []
+        nanoseconds = ctypes.c_uint64()
+        # The queries finish in order, so the first one not available stops:
+        while self.pending and GL.glGetQueryObjectiv(self.pending[0], GL.GL_QUERY_RESULT_AVAILABLE):
+            query = self.pending.popleft()
+            # PyOpenGL cannot size the output of the 64 bit getter by itself:
+            glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT, ctypes.byref(nanoseconds))
+            if self.timed:
+                times.append(nanoseconds.value / 1e9)
+            self.timed += 1
+            self.free.append(query)
+        return times
+
+
+class RoomView(gl.GLViewWidget):
+    """GLViewWidget with a RoomScene. Before painting, when the camera moved
+    or the scene changed, the ellipsoids get their level of detail. Frames
+    are timed to adapt the LOD vertex budget to the frame time target: with
+    timer queries, see FrameTimer, so the CPU never waits for the GPU.
+    Otherwise a timed frame waits for the GPU with glFinish, so only the
+    frames while the budget adapts are timed, and one in RESAMPLE_FRAMES
+    once it settled.
+    A left click that does not move the camera emits clicked with its
+    position, see ray()."""
+
+    clicked = Signal(float, float)
+
+    def __init__(self, *args, frame_time_target: float = 1 / 60, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.room_scene = RoomScene(self)
+        self.lod = LevelOfDetail(frame_time_target=frame_time_target)
+        self.lod_camera = None
+        self.frame_time = 0.0
+        self.frame_timer = FrameTimer()
+        self.frame_count = 0
+        self.press_position = None
+
+    def mousePressEvent(self, ev):
+        super().mousePressEvent(ev)
+        self.press_position = ev.position()
+
+    def mouseReleaseEvent(self, ev):
+        super().mouseReleaseEvent(ev)
+        if ev.button() != Qt.MouseButton.LeftButton or self.press_position is None:
+            return
+        if (ev.position() - self.press_position).manhattanLength() <= CLICK_SLOP_PX:
+            self.clicked.emit(ev.position().x(), ev.position().y())
+
+    def ray(self, x: float, y: float) -> tuple[np.ndarray, np.ndarray]:
+        """Origin and direction of the ray from the camera through the point
+        (x, y) of the widget."""
+        viewport = (0, 0, self.width(), self.height())
+        transform = self.projectionMatrix(viewport, viewport) * self.viewMatrix()
+        # Inverted in double precision: the near and far planes are far apart
+        inverse = np.linalg.inv(np.array(transform.data(), dtype=float).reshape(4, 4).T)
+        ndc_x, ndc_y = 2 * x / self.width() - 1, 1 - 2 * y / self.height()
+        near, middle = (inverse @ np.array([[ndc_x, ndc_y, -1.0, 1.0], [ndc_x, ndc_y, 0.0, 1.0]]).T).T
+        origin, target = near[:3] / near[3], middle[:3] / middle[3]
+        return origin, target - origin
+
+    def pixel_angle(self) -> float:
+        """Angle of a pixel seen from the camera, in radians."""
+        return 2 * tan(radians(self.opts['fov']) / 2) / self.width()
+
+    def paint(self, *, region, viewport, useItemNames=False):
+        camera = self.cameraPosition()
+        fov = self.opts['fov']
+        camera_state = (camera.toTuple(), fov, viewport[2])
+        if self.room_scene.lod_dirty or camera_state != self.lod_camera:
+            focal_px = viewport[2] / 2 / tan(radians(fov) / 2)
+            self.room_scene.apply_lod(self.lod, np.array(camera.toTuple()), focal_px)
+            self.lod_camera = camera_state
+
+        self.frame_count += 1
+        start = time.perf_counter()
+        queried = self.frame_timer.begin()
+        super().paint(region=region, viewport=viewport, useItemNames=useItemNames)
+        if queried:
+            self.frame_timer.end()
+            cpu_time = time.perf_counter() - start
+            # A frame takes the longest of issuing it and drawing it:
+            frame_times = [max(cpu_time, gpu_time) for gpu_time in self.frame_timer.finished()]
+        elif not self.lod.settled() or self.frame_count % RESAMPLE_FRAMES == 0:
+            # Wait for the GPU, so the frame time includes drawing:
+            GL.glFinish()
+            frame_times = [time.perf_counter() - start]
+        else:
+            frame_times = []
+        for frame_time in frame_times:
+            self.frame_time = frame_time
+            if self.lod.record_frame(frame_time):
+                self.room_scene.lod_dirty = True
 
+
+_SCENES = weakref.WeakKeyDictionary()
+
+
+def room_plotter_3d(view: gl.GLViewWidget, plot_ctx: dict):
+    """This method receives the GL view from the main GUI in main.py and
+    a context object with:
+        + The JSON dict defining the room,
+        + Boolean switches telling which features we need to plot, and
+          optionally show_volume for the solid preview,
+    and it plots the room. The view keeps its RoomScene between calls, so
+    only the features that changed since the last call are rebuilt.
+    """
+    scene = getattr(view, "room_scene", None) or _SCENES.get(view)
+    if scene is None:
+        scene = _SCENES[view] = RoomScene(view)
+    with span("room_plotter_3d"):
+        scene.update(plot_ctx)
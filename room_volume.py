@@ -0,0 +1,373 @@
+"""Solid preview of the space carved by a room.
+
+The FloodFillLines carve the room: every point is the half-ellipsoid drawn
+by room_viewer (see room_geometry.ffill_columns), and consecutive points of a
+line are joined by the half-ellipsoid swept between them. The
+FloodFillPillars fill rock back, as round capsules between their points. A
+signed distance approximation of the carved space, negative inside, is
+sampled on a voxel grid split in chunks, and marching cubes turns each chunk
+into triangles.
+
+A chunk only depends on the primitives that come close to it, so its mesh is
+cached under the bytes of those primitives: editing a feature only meshes
+again the chunks around it.
+"""
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from pyqtgraph import isosurface
+
+from room_geometry import ffill_columns, locations
+
+VOXEL_SIZE = 50.0  # Edge of the finest voxels, in room units
+CHUNK_VOXELS = 16  # Voxels along each edge of a chunk
+BLOCK_VOXELS = 2  # Voxels along each edge of the blocks a chunk is sampled by
+MAX_CHUNKS = 1500  # Past it, the voxels get twice as large
+# Defaults of json_builder.PillarPoint and FloodFillPillar:
+DEFAULT_PILLAR_RANGE = 100.0
+DEFAULT_PILLAR_RANGE_SCALE = 1.0
+_MIN_EXTENT = 1e-3  # Keeps flat ellipsoids from dividing by zero
+_BATCH = 1 << 19  # (sample, primitive) pairs evaluated together, to bound the arrays
+# The distances are approximations: a primitive is kept for a chunk or a
+# block until its distance from the center is this many times the half
+# diagonal, plus a voxel.
+_REACH_FACTOR = 1.5
+_BAND_VOXELS = 2  # Distances are exact this close to the surface
+
+
+def consecutive_pairs(group: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Indices a, b of the primitives of points grouped by feature, group[i]
+    being the feature of point i: every two consecutive points of a feature,
+    then every point alone in its feature paired with itself."""
+    pair = np.flatnonzero(group[:-1] == group[1:])
+    paired = np.zeros(len(group), dtype=bool)
+    paired[pair] = paired[pair + 1] = True
+    lone = np.flatnonzero(~paired)
+    return np.concatenate([pair, lone]), np.concatenate([pair + 1, lone])
+
+
+def carve_primitives(lines: list) -> np.ndarray:
+    """(K, 10) float32 rows of the half-ellipsoids swept between consecutive
+    points of the FloodFillLines: center a, center b, radius at a, radius at
+    b, height at a, height at b. A point without neighbors has a == b."""
+    columns = ffill_columns(lines)
+    a, b = consecutive_pairs(columns.line)
+    radius = np.maximum(columns.radius, _MIN_EXTENT)
+    height = np.maximum(columns.height, _MIN_EXTENT)
+    return np.column_stack([columns.center[a], columns.center[b], radius[a], radius[b], height[a], height[b]]).astype(np.float32)
+
+
+def fill_primitives(pillars: list) -> np.ndarray:
+    """(K, 8) float32 rows of the capsules between consecutive points of the
+    FloodFillPillars: point a, point b, radius at a, radius at b."""
+    points = [point for pillar in pillars for point in pillar["Points"]]
+    pillar = np.repeat(np.arange(len(pillars)), [len(p["Points"]) for p in pillars])
+    scale = np.array([p.get("RangeScale", {}).get("Max", DEFAULT_PILLAR_RANGE_SCALE) for p in pillars], dtype=float)
+    radius = np.array([p.get("Range", {}).get("Max", DEFAULT_PILLAR_RANGE) for p in points], dtype=float)
+    radius = np.maximum(radius * scale[pillar], _MIN_EXTENT)
+    location = locations(points)
+    a, b = consecutive_pairs(pillar)
+    return np.column_stack([location[a], location[b], radius[a], radius[b]]).astype(np.float32)
+
+
+def _carve_bounds(rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    a, b = rows[:, 0:3], rows[:, 3:6]
+    reach = np.maximum(rows[:, 6], rows[:, 7])[:, None]
+    mins = np.minimum(a, b) - reach
+    maxs = np.maximum(a, b) + reach
+    # The half-ellipsoids stand on their base:
+    mins[:, 2] = np.minimum(a[:, 2], b[:, 2])
+    maxs[:, 2] = np.maximum(a[:, 2] + rows[:, 8], b[:, 2] + rows[:, 9])
+    return mins, maxs
+
+
+def _fill_bounds(rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    a, b = rows[:, 0:3], rows[:, 3:6]
+    reach = np.maximum(rows[:, 6], rows[:, 7])[:, None]
+    return np.minimum(a, b) - reach, np.maximum(a, b) + reach
+
+
+def _segment_terms(a: np.ndarray, b: np.ndarray, scale: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ab = b - a, and w such that (p - a) . w is the position of the closest
+    point to p on the segment ab, from 0 at a to 1 at b, measured in space
+    divided by scale."""
+    ab = b - a
+    scaled = ab / scale ** 2
+    length2 = (ab * scaled).sum(axis=1, keepdims=True)
+    return ab, scaled / np.where(length2 > 0, length2, 1)
+
+
+def carve_terms(rows: np.ndarray) -> np.ndarray:
+    """(K, 16) float32 terms of carve_distance from the carve_primitives rows:
+    a, ab, w, radius at a and its change along ab, the same for height, and
+    w and the inverse length of ab seen from above."""
+    a, b = rows[:, 0:3], rows[:, 3:6]
+    ra, rb, ha, hb = rows[:, 6], rows[:, 7], rows[:, 8], rows[:, 9]
+    # Along a segment the ellipsoids are close to spheres in the space scaled
+    # by their mean radius and height, so the closest center is found there:
+    mean_radius = (ra + rb) / 2
+    ab, w = _segment_terms(a, b, np.stack([mean_radius, mean_radius, (ha + hb) / 2], axis=1))
+    _, w_above = _segment_terms(a[:, :2], b[:, :2], np.ones(2, dtype=rows.dtype))
+    inverse_length = 1 / np.maximum(np.hypot(ab[:, 0], ab[:, 1]), _MIN_EXTENT)
+    return np.column_stack([a, ab, w, ra, rb - ra, ha, hb - ha, w_above, inverse_length]).astype(np.float32)
+
+
+def fill_terms(rows: np.ndarray) -> np.ndarray:
+    """(K, 11) float32 terms of fill_distance from the fill_primitives rows:
+    a, ab, w, radius at a and its change along ab."""
+    ab, w = _segment_terms(rows[:, 0:3], rows[:, 3:6], np.ones(3, dtype=rows.dtype))
+    return np.column_stack([rows[:, 0:3], ab, w, rows[:, 6], rows[:, 7] - rows[:, 6]]).astype(np.float32)
+
+
+def carve_distance(p: np.ndarray, terms: np.ndarray) -> np.ndarray:
+    """Approximate signed distance from p (..., 3) to the swept half-ellipsoid
+    of each carve_terms row (..., 16), negative inside."""
+    ap = p - terms[..., 0:3]
+    t = np.clip((ap * terms[..., 6:9]).sum(axis=-1), 0, 1)
+    d = ap - t[..., None] * terms[..., 3:6]
+    radius = terms[..., 9] + t * terms[..., 10]
+    height = terms[..., 11] + t * terms[..., 12]
+    dx, dy, dz = d[..., 0], d[..., 1], d[..., 2]
+    q = np.sqrt((dx * dx + dy * dy) / (radius * radius) + dz * dz / (height * height))
+    distance = (q - 1) * np.minimum(radius, height)
+
+    # Only what is above the base circles. The floor under p is the base of
+    # the lowest ellipsoid whose circle covers p seen from above: along ab,
+    # half a chord away from the closest center seen from above. Where no
+    # circle covers p, p is outside anyway and the lowest base is used, so
+    # the distance stays an underestimate.
+    t_above = (ap[..., 0:2] * terms[..., 13:15]).sum(axis=-1)
+    side = ap[..., 0:2] - t_above[..., None] * terms[..., 3:5]
+    radius_above = terms[..., 9] + np.clip(t_above, 0, 1) * terms[..., 10]
+    chord2 = radius_above * radius_above - (side * side).sum(axis=-1)
+    down = np.sign(terms[..., 5])  # Toward a when b is higher
+    t_floor = np.where(
+        chord2 > 0,
+        np.clip(t_above - down * np.sqrt(np.maximum(chord2, 0)) * terms[..., 15], 0, 1),
+        (1 - down) / 2,
+    )
+    return np.maximum(distance, t_floor * terms[..., 5] - ap[..., 2])
+
+
+def fill_distance(p: np.ndarray, terms: np.ndarray) -> np.ndarray:
+    """Signed distance from p (..., 3) to the capsule of each fill_terms row (..., 11)."""
+    ap = p - terms[..., 0:3]
+    t = np.clip((ap * terms[..., 6:9]).sum(axis=-1), 0, 1)
+    d = ap - t[..., None] * terms[..., 3:6]
+    return np.sqrt((d * d).sum(axis=-1)) - (terms[..., 9] + t * terms[..., 10])
+
+
+def _touched_chunks(mins: np.ndarray, maxs: np.ndarray, chunk_size: float) -> tuple[np.ndarray, np.ndarray]:
+    """Every (chunk, primitive) pair whose boxes intersect, as (P, 3) chunk
+    indices and (P,) primitive indices, sorted by chunk."""
+    lo = np.floor(mins / chunk_size).astype(np.int64)
+    hi = np.floor(maxs / chunk_size).astype(np.int64)
+    extent = hi - lo + 1
+    counts = extent.prod(axis=1)
+    primitive = np.repeat(np.arange(len(mins)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    ey, ez = extent[primitive, 1], extent[primitive, 2]
+    chunk = lo[primitive] + np.stack([local // (ey * ez), (local // ez) % ey, local % ez], axis=1)
+    order = np.lexsort((primitive, chunk[:, 2], chunk[:, 1], chunk[:, 0]))
+    return chunk[order], primitive[order]
+
+
+def _near_pairs(distance, rows: np.ndarray, chunk: np.ndarray, primitive: np.ndarray, chunk_size: float, voxel: float) -> tuple[np.ndarray, np.ndarray]:
+    """The (chunk, primitive) pairs where the primitive comes close enough to
+    the chunk to change its surface. Bounding boxes of long diagonal segments touch many chunks
+    far from the primitive, which would be meshed again when it changes."""
+    center = (chunk + 0.5).astype(rows.dtype) * chunk_size
+    reach = _REACH_FACTOR * chunk_size * np.sqrt(3) / 2 + _BAND_VOXELS * voxel
+    near = distance(center, rows[primitive]) <= reach
+    return chunk[near], primitive[near]
+
+
+def _sampled(distance, points: np.ndarray, point_block: np.ndarray, centers: np.ndarray, rows: np.ndarray, spread: float, band: float) -> np.ndarray:
+    """Union distance from each of points to the primitives in rows, exact
+    between -band and band only. spread bounds how much a distance changes
+    from the center of a block to its points. A block farther than
+    spread + band from the surface is not sampled: its points get the bound
+    on their distance. The other points only meet the primitives near their
+    block."""
+    limit = spread + band
+    center_distance = distance(centers[:, None, :], rows[None])
+    block_distance = np.clip(center_distance.min(axis=1, initial=np.inf), -2 * limit, 2 * limit)
+    surface = np.abs(block_distance) <= limit
+    result = (block_distance - np.sign(block_distance) * spread)[point_block]
+
+    near_block, near_row = np.nonzero(surface[:, None] & (center_distance <= limit))
+    order = np.argsort(point_block, kind="stable")
+    point_counts = np.bincount(point_block, minlength=len(centers))
+    row_counts = np.bincount(near_block, minlength=len(centers))
+    point_starts = np.cumsum(point_counts) - point_counts
+    row_starts = np.cumsum(row_counts) - row_counts
+
+    counts = point_counts * row_counts
+    if counts.sum() * 2 > len(points) * len(rows):
+        # Few rows, near every block: all the pairs are cheaper
+        result = np.full(len(points), limit, dtype=points.dtype)
+        step = max(1, _BATCH // len(points))
+        for start in range(0, len(rows), step):
+            np.minimum(result, distance(points[:, None, :], rows[start:start + step]).min(axis=1), out=result)
+        return result
+
+    # Every (point, near row) pair of the surface blocks, grouped by point. A
+    # surface block has at least one near row:
+    pair_block = np.repeat(np.arange(len(centers)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    point = order[point_starts[pair_block] + local // row_counts[pair_block]]
+    row = near_row[row_starts[pair_block] + local % row_counts[pair_block]]
+
+    if len(point) == 0:
+        return result
+    values = np.empty(len(point), dtype=points.dtype)
+    for start in range(0, len(point), _BATCH):
+        batch = slice(start, start + _BATCH)
+        values[batch] = distance(points[point[batch]], rows[row[batch]])
+    first = np.concatenate([[0], np.flatnonzero(point[1:] != point[:-1]) + 1])
+    result[point[first]] = np.minimum.reduceat(values, first)
+    return result
+
+
+def _runs(chunk: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Start and end of the runs of equal rows of the sorted chunk array."""
+    if len(chunk) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    new = np.flatnonzero((chunk[1:] != chunk[:-1]).any(axis=1)) + 1
+    return np.concatenate([[0], new]), np.concatenate([new, [len(chunk)]])
+
+
+@dataclass
+class VolumeMesh:
+    vertexes: np.ndarray  # (V, 3) float32
+    faces: np.ndarray  # (F, 3) int32
+    signature: int  # Equal for meshes made of the same chunks
+
+
+class CaveVolume:
+    """Meshes the carved space of rooms, chunk by chunk, and keeps the chunk
+    meshes of the last room to reuse the ones an edit did not touch."""
+
+    def __init__(self, voxel_size: float = VOXEL_SIZE, chunk_voxels: int = CHUNK_VOXELS, max_chunks: int = MAX_CHUNKS):
+        self.voxel_size = voxel_size
+        self.chunk_voxels = chunk_voxels
+        self.max_chunks = max_chunks
+        self.chunks = {}  # (voxel size, chunk index) -> (key, vertexes, faces)
+        self.meshed = 0  # Chunks meshed by the last call to mesh()
+        self.voxel = voxel_size  # Voxel size of the last call to mesh()
+        self.mesh_time = 0.0
+
+    def mesh(self, room_json: dict) -> VolumeMesh:
+        start = time.perf_counter()
+        carve = carve_primitives(list(room_json["FloodFillLines"].values()))
+        fill = fill_primitives(list(room_json.get("FloodFillPillars", {}).values()))
+        carve_mins, carve_maxs = _carve_bounds(carve)
+        fill_mins, fill_maxs = _fill_bounds(fill)
+        carve, fill = carve_terms(carve), fill_terms(fill)
+
+        # The voxels double until the room fits in max_chunks chunks:
+        voxel = self.voxel_size
+        while True:
+            chunk_size = voxel * self.chunk_voxels
+            # One voxel of margin, for the chunks next to a surface:
+            chunk, primitive = _touched_chunks(carve_mins - voxel, carve_maxs + voxel, chunk_size)
+            chunk, primitive = _near_pairs(carve_distance, carve, chunk, primitive, chunk_size, voxel)
+            starts, ends = _runs(chunk)
+            if len(starts) <= self.max_chunks:
+                break
+            voxel *= 2
+
+        fill_chunk, fill_primitive = _touched_chunks(fill_mins - voxel, fill_maxs + voxel, chunk_size)
+        fill_chunk, fill_primitive = _near_pairs(fill_distance, fill, fill_chunk, fill_primitive, chunk_size, voxel)
+        fills = {}
+        for s, e in zip(*_runs(fill_chunk)):
+            fills[tuple(fill_chunk[s])] = fill_primitive[s:e]
+
+        chunks = {}
+        self.meshed = 0
+        for s, e in zip(starts, ends):
+            index = tuple(chunk[s])
+            carve_rows = carve[primitive[s:e]]
+            fill_rows = fill[fills.get(index, [])]
+            key = carve_rows.tobytes() + b"|" + fill_rows.tobytes()
+            cached = self.chunks.get((voxel, index))
+            if cached is None or cached[0] != key:
+                cached = (key, *self._mesh_chunk(index, voxel, carve_rows, fill_rows))
+                self.meshed += 1
+            chunks[(voxel, index)] = cached
+        # Only the chunks of this room are kept:
+        self.chunks = chunks
+        self.voxel = voxel
+
+        vertexes, faces = [], []
+        count = 0
+        for _, chunk_vertexes, chunk_faces in chunks.values():
+            if len(chunk_faces):
+                vertexes.append(chunk_vertexes)
+                faces.append(chunk_faces + count)
+                count += len(chunk_vertexes)
+        signature = hash(tuple((index, key) for index, (key, _, _) in chunks.items()))
+        self.mesh_time = time.perf_counter() - start
+        if not faces:
+            return VolumeMesh(np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.int32), signature)
+        return VolumeMesh(np.concatenate(vertexes), np.concatenate(faces), signature)
+
+    def _mesh_chunk(self, index: tuple, voxel: float, carve_rows: np.ndarray, fill_rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        n = self.chunk_voxels + 1  # The chunks share their boundary samples
+        origin = np.array(index, dtype=np.float32) * voxel * self.chunk_voxels
+        axis = np.arange(n, dtype=np.float32) * voxel
+        grid = np.stack(np.meshgrid(axis, axis, axis, indexing="ij"), axis=-1).reshape(-1, 3) + origin
+
+        # Each sample only meets the primitives near its block of voxels:
+        block_voxels = BLOCK_VOXELS if self.chunk_voxels % BLOCK_VOXELS == 0 else self.chunk_voxels
+        blocks = self.chunk_voxels // block_voxels
+        block = np.minimum(np.arange(n) // block_voxels, blocks - 1)
+        point_block = ((block[:, None, None] * blocks + block[None, :, None]) * blocks + block[None, None, :]).reshape(-1)
+        block_axis = (np.arange(blocks, dtype=np.float32) + 0.5) * block_voxels * voxel
+        centers = np.stack(np.meshgrid(block_axis, block_axis, block_axis, indexing="ij"), axis=-1).reshape(-1, 3) + origin
+        spread = np.float32(_REACH_FACTOR * block_voxels * voxel * np.sqrt(3) / 2)
+        # Marching cubes only interpolates between samples on both sides of
+        # the surface, which are at most about a voxel from it:
+        band = np.float32(_BAND_VOXELS * voxel)
+
+        distance = _sampled(carve_distance, grid, point_block, centers, carve_rows, spread, band)
+        if len(fill_rows):
+            distance = np.maximum(distance, -_sampled(fill_distance, grid, point_block, centers, fill_rows, spread, band))
+        if distance.min() >= 0 or distance.max() < 0:
+            # All outside or all inside: no surface crosses the chunk
+            return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.int32)
+        vertexes, faces = isosurface(np.ascontiguousarray(distance.reshape(n, n, n)), 0.0)
+        return (vertexes * voxel + origin).astype(np.float32), faces.astype(np.int32)
+
+
+def benchmark(room_json: dict) -> dict:
+    """Time to mesh a room from scratch, and again after widening the last
+    point of its last FloodFillLine."""
+    volume = CaveVolume()
+    results = {}
+    mesh = volume.mesh(room_json)
+    results["full_s"] = volume.mesh_time
+    results["chunks"] = len(volume.chunks)
+    results["voxel"] = volume.voxel
+    results["faces"] = len(mesh.faces)
+
+    name, line = list(room_json["FloodFillLines"].items())[-1]
+    point = dict(line["Points"][-1])
+    point["HRange"] += 50
+    edited = dict(room_json, FloodFillLines=dict(room_json["FloodFillLines"]))
+    edited["FloodFillLines"][name] = dict(line, Points=[*line["Points"][:-1], point])
+    volume.mesh(edited)
+    results["edit_s"] = volume.mesh_time
+    results["edit_chunks_meshed"] = volume.meshed
+    return results
+
+
+if __name__ == "__main__":
+    # Meshing benchmark: python room_volume.py <room.json>
+    import json
+    import sys
+
+    with open(sys.argv[1], "r") as f:
+        room = json.load(f)
+    print(benchmark(room))
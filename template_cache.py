@@ -0,0 +1,138 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+TEMPLATE_DIR = Path("assets") / "default_assets"
+
+
+class FrozenDict(dict):
+    """Read-only dict handed out by the registry. Templates are shared between
+    every room built in the process, so writing into one would leak into the
+    next build. copy.deepcopy() returns plain, mutable containers."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Templates from the registry are read-only, copy them first")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    __ior__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+class FrozenList(tuple):
+    """Read-only list. Serializes to a JSON array like a normal list."""
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+def freeze(obj):
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return FrozenList(freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj):
+    if isinstance(obj, dict):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+@dataclass
+class _Entry:
+    data: FrozenDict
+    mtime_ns: int
+    size: int
+    digest: str
+
+
+class TemplateRegistry:
+    """Loads each template under template_dir once per process. A template is
+    only parsed again when its mtime changes and the content hash differs
+    from the cached one."""
+
+    def __init__(self, template_dir: Path = TEMPLATE_DIR):
+        self.template_dir = Path(template_dir)
+        self._entries: dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def path(self, name: str) -> Path:
+        return self.template_dir / f"{name}.json"
+
+    def get(self, name: str) -> FrozenDict:
+        path = self.path(name)
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+                self.hits += 1
+                return entry.data
+
+            raw = path.read_bytes()
+            digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+            if entry is not None and entry.digest == digest:
+                # Touched but not modified, keep the parsed template:
+                entry.mtime_ns, entry.size = stat.st_mtime_ns, stat.st_size
+                self.hits += 1
+                return entry.data
+
+            if entry is None:
+                self.misses += 1
+            else:
+                self.reloads += 1
+                logging.info(f"Template {name} changed on disk, reloading.")
+            entry = _Entry(freeze(json.loads(raw)), stat.st_mtime_ns, stat.st_size, digest)
+            self._entries[name] = entry
+            return entry.data
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "reloads": self.reloads}
+
+    def fingerprint(self) -> str:
+        """Hash of every template file in template_dir, without parsing them."""
+        h = hashlib.blake2b(digest_size=16)
+        for path in sorted(self.template_dir.glob("*.json")):
+            h.update(path.name.encode())
+            h.update(hashlib.blake2b(path.read_bytes(), digest_size=16).digest())
+        return h.hexdigest()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.reloads = 0
+
+
+_REGISTRY = TemplateRegistry()
+
+
+def get_template(name: str) -> FrozenDict:
+    return _REGISTRY.get(name)
+
+
+def template_stats() -> dict:
+    return _REGISTRY.stats()
+
+
+def template_fingerprint() -> str:
+    return _REGISTRY.fingerprint()
@@ -0,0 +1,58 @@
+import json
+import random
+
+from json_document import JsonDocument, Utf16Offsets
+
+
+def utf16_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def qt_edit(document: JsonDocument, offsets: Utf16Offsets, text: str, position: int, removed: int, added: str) -> str:
+    """Applies an edit at a Python index the way the editor reports it:
+    position and removed in UTF-16 code units, through Utf16Offsets."""
+    qt_position = utf16_length(text[:position])
+    qt_removed = utf16_length(text[position:position + removed])
+    index, length = offsets.edit(qt_position, qt_removed, added)
+    assert (index, length) == (position, removed)
+    document.record_edit(index, length, added)
+    return text[:position] + added + text[position + removed:]
+
+
+def test_edit_after_character_outside_bmp():
+    text = '{"Name": "😀", "A": 1}'
+    document = JsonDocument(text)
+    offsets = Utf16Offsets(text)
+    # Qt reports the 1 at 20, one more than its Python index:
+    index, removed = offsets.edit(20, 1, "2")
+    assert (index, removed) == (19, 1)
+    document.record_edit(index, removed, "2")
+    assert document.sync() == {"Name": "😀", "A": 2}
+
+
+def test_span_to_qt_positions():
+    text = '{"Tags": ["🦀🦀", "x"], "B": [1, 2]}'
+    document = JsonDocument(text)
+    offsets = Utf16Offsets(text)
+    document.sync()
+    start, end = document.span(("B", 1))
+    assert text[start:end] == "2"
+    qt_start = offsets.to_utf16(start)
+    assert qt_start == utf16_length(text[:start])
+    assert offsets.to_index(qt_start) == start
+    assert offsets.to_utf16(end) - qt_start == 1
+
+
+def test_random_edits_with_characters_outside_bmp():
+    rng = random.Random(0)
+    values = ["😀", "🦀x", "é", "a", "𝄞𝄞", "1"]
+    text = json.dumps({f"K{i}": rng.choice(values) for i in range(20)}, ensure_ascii=False)
+    document = JsonDocument(text)
+    offsets = Utf16Offsets(text)
+    for _ in range(200):
+        # Replace a whole string value, so the text stays valid:
+        key = f"K{rng.randrange(20)}"
+        start, end = document.span((key,))
+        text = qt_edit(document, offsets, text, start, end - start, json.dumps(rng.choice(values), ensure_ascii=False))
+        assert document.sync() == json.loads(text)
+        assert document.text() == text
@@ -0,0 +1,151 @@
+"""Timing spans of the build and update stages, in Chrome trace-event format.
+
+Tracing is off unless the DRG_TRACE environment variable names a trace file,
+or enable() is called (main.py --trace). While it is off, span() returns one
+shared context manager that does nothing, well under a microsecond per
+span, so the spans stay on the stages and out of the per-feature loops.
+
+While it is on, every span is a complete ("X") event with the process and
+the native thread id, so the update worker, the UAssetAPI thread and the
+batch workers each get their own track. The events are written at exit, and
+the file opens in chrome://tracing or ui.perfetto.dev. Batch workers send
+the events of each room back with its result, see drain() and extend().
+
+With memory=True, or the DRG_MEMORY environment variable, every span also
+has the memory of its stage in its args, and the RSS of the process is a
+counter track, see memory_profile.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import memory_profile
+
+ENV_VAR = "DRG_TRACE"
+
+_NO_SPAN = nullcontext()
+_enabled = False
+_memory = False  # Spans also measure memory
+_path = None  # Where save() writes the events, None to only record them
+_events = []  # list.append is atomic, so every thread records without a lock
+_named_threads = set()
+
+
+class _Span:
+    __slots__ = ("name", "args", "start", "memory")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        # Measured outside of the timed block, since reading the RSS is a
+        # system call:
+        if _memory:
+            self.memory = memory_profile.begin()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        if _memory:
+            self.args.update(memory_profile.end(self.memory))
+        pid, tid = os.getpid(), threading.get_native_id()
+        if (pid, tid) not in _named_threads:
+            _named_threads.add((pid, tid))
+            _events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": threading.current_thread().name}})
+        # perf_counter is the monotonic clock of the machine, so the workers
+        # of a batch share the time axis:
+        event = {"name": self.name, "ph": "X", "ts": self.start / 1000, "dur": (end - self.start) / 1000, "pid": pid, "tid": tid}
+        if self.args:
+            event["args"] = self.args
+        _events.append(event)
+        if _memory:
+            _events.append({"name": "memory", "ph": "C", "ts": end / 1000, "pid": pid, "args": {"RSS MiB": self.args["rss_bytes"] / 2**20}})
+        return False
+
+
+def span(name: str, **args):
+    """Context manager timing its block as the span name, with args shown in
+    the trace viewer. Does nothing when tracing is off."""
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name, args)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def memory_enabled() -> bool:
+    return _memory
+
+
+def enable(path: str | Path | None = None, memory: bool = False):
+    """Turns tracing on. The events are written to path at exit, or only
+    kept for drain() with path=None (batch workers). memory=True starts
+    tracemalloc and measures the memory of every span."""
+    global _enabled, _path, _memory
+    if path is not None and _path is None:
+        atexit.register(save)
+    if memory:
+        memory_profile.start()
+    _enabled = True
+    _memory = _memory or memory
+    _path = None if path is None else Path(path)
+
+
+def drain() -> list:
+    """Removes and returns the events recorded so far."""
+    events = _events[:]
+    del _events[:len(events)]
+    return events
+
+
+def extend(events: list):
+    """Adds events recorded elsewhere, e.g. by a batch worker."""
+    _events.extend(events)
+
+
+def save(path: str | Path | None = None):
+    path = path or _path
+    if path is None:
+        return
+    with open(path, "w") as f:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, f)
+
+
+def summary(events: list) -> list[dict]:
+    """Count, total, mean and longest duration of every span name, by total
+    duration."""
+    stages = {}
+    for event in events:
+        if event["ph"] != "X":
+            continue
+        stage = stages.setdefault(event["name"], {"stage": event["name"], "count": 0, "total_s": 0.0, "max_s": 0.0})
+        seconds = event["dur"] / 1e6
+        stage["count"] += 1
+        stage["total_s"] += seconds
+        stage["max_s"] = max(stage["max_s"], seconds)
+    for stage in stages.values():
+        stage["mean_s"] = stage["total_s"] / stage["count"]
+    return sorted(stages.values(), key=lambda stage: stage["total_s"], reverse=True)
+
+
+def summary_table(events: list) -> str:
+    rows = summary(events)
+    width = max([len("stage"), *(len(row["stage"]) for row in rows)])
+    lines = [f"{'stage':<{width}} {'count':>7} {'total s':>10} {'mean ms':>10} {'max ms':>10}"]
+    for row in rows:
+        lines.append(
+            f"{row['stage']:<{width}} {row['count']:>7} {row['total_s']:>10.3f} {row['mean_s'] * 1000:>10.2f} {row['max_s'] * 1000:>10.2f}"
+        )
+    return "\n".join(lines)
+
+
+if os.environ.get(ENV_VAR) or os.environ.get(memory_profile.ENV_VAR):
+    enable(os.environ.get(ENV_VAR) or None, memory=bool(os.environ.get(memory_profile.ENV_VAR)))
@@ -0,0 +1,451 @@
+"""Pure-Python writer for the room uassets, an alternative to UAssetAPI.
+
+It only knows the pieces a room asset is made of: the cooked UE4.27 package
+header of assets/default_assets/default_asset*.json and the tagged property
+types used by the room exports (FloodFillLine, EntranceFeature,
+FloodFillPillar, RandomSelector, DropPodCalldownLocationFeature and the
+RoomGenerator). Anything else raises an UnsupportedAssetError, so the
+UAssetAPI path stays the reference. validate_against_uassetapi() compares
+both writers byte for byte.
+
+That comparison has not been run yet, so the writer is not exposed by the
+command line: only run_batch(native=True) uses it, with a warning. The
+export data has the layout of every template in assets/default_assets, but
+the header is only written from the UE4.27 package format.
+"""
+import base64
+import logging
+import re
+import struct
+import uuid
+import zlib
+from pathlib import Path
+
+from template_cache import get_template
+from tracing import span
+from uassetgen import uasset_path
+
+PACKAGE_FILE_TAG = 0x9E2A83C1
+# Versions of the cooked, unversioned UE4.27 packages the game ships:
+LEGACY_UE3_VERSION = 864
+SUPPORTED_OBJECT_VERSION = "VER_UE4_CORRECT_LICENSEE_FLAG"
+SUPPORTED_LEGACY_FILE_VERSION = -7
+
+OBJECT_FLAGS = {
+    "RF_NoFlags": 0x0,
+    "RF_Public": 0x1,
+    "RF_Standalone": 0x2,
+    "RF_MarkAsNative": 0x4,
+    "RF_Transactional": 0x8,
+    "RF_ClassDefaultObject": 0x10,
+    "RF_ArchetypeObject": 0x20,
+    "RF_Transient": 0x40,
+}
+PACKAGE_FLAGS = {
+    "PKG_None": 0x0,
+    "PKG_NewlyCreated": 0x1,
+    "PKG_ClientOptional": 0x2,
+    "PKG_ServerSideOnly": 0x4,
+    "PKG_CompiledIn": 0x10,
+    "PKG_ForDiffing": 0x20,
+    "PKG_EditorOnly": 0x40,
+    "PKG_Developer": 0x80,
+    "PKG_ContainsMapData": 0x4000,
+    "PKG_Compiling": 0x10000,
+    "PKG_ContainsMap": 0x20000,
+    "PKG_RequiresLocalizationGather": 0x40000,
+    "PKG_PlayInEditor": 0x100000,
+    "PKG_ContainsScript": 0x200000,
+    "PKG_DisallowExport": 0x400000,
+    "PKG_ReloadingForCooker": 0x40000000,
+    "PKG_FilterEditorOnly": 0x80000000,
+}
+
+# Structs that UE serializes natively instead of as tagged properties:
+NATIVE_STRUCTS = ("Vector", "Rotator", "GameplayTagContainer")
+# Element template of the struct arrays a room export can leave empty, by
+# export class. UAssetAPI keeps it in the DummyStruct of an empty array,
+# which the room templates do not have:
+EMPTY_ARRAY_ELEMENTS = {"FloodFillLine": "default_roomlinepoint", "FloodFillPillar": "default_pillar_point"}
+
+_INT32 = struct.Struct("<i")
+_UINT32 = struct.Struct("<I")
+_INT64 = struct.Struct("<q")
+_FLOAT = struct.Struct("<f")
+_VECTOR = struct.Struct("<3f")
+_FNAME = struct.Struct("<ii")
+_ZERO_GUID = bytes(16)
+_NUMBERED_NAME = re.compile(r"^(.+)_(0|[1-9][0-9]{0,8})$")
+
+
+class UnsupportedAssetError(ValueError):
+    pass
+
+
+def _crc_table_deprecated() -> list[int]:
+    # FCrc::CRCTable_DEPRECATED, used by the non case preserving name hash:
+    table = []
+    for i in range(256):
+        c = i << 24
+        for _ in range(8):
+            c = ((c << 1) ^ 0x04C11DB7 if c & 0x80000000 else c << 1) & 0xFFFFFFFF
+        table.append(c)
+    return table
+
+
+_CRC_TABLE_DEPRECATED = _crc_table_deprecated()
+
+
+def name_hash(name: str) -> int:
+    """The two 16 bit hashes cooked name maps store after every name:
+    FCrc::Strihash_DEPRECATED in the low half, FCrc::StrCrc32 in the high one."""
+    if name.isascii():
+        data = name.upper().encode("ascii")
+    else:
+        data = name.upper().encode("utf-16-le")
+    h = 0
+    for b in data:
+        h = ((h >> 8) & 0x00FFFFFF) ^ _CRC_TABLE_DEPRECATED[(h ^ b) & 0xFF]
+    # StrCrc32 feeds every character as four little endian bytes:
+    case_preserving = zlib.crc32(name.encode("utf-32-le"))
+    return (h & 0xFFFF) | ((case_preserving & 0xFFFF) << 16)
+
+
+def _flags(value: str, table: dict) -> int:
+    result = 0
+    for flag in value.split(","):
+        flag = flag.strip()
+        if flag not in table:
+            raise UnsupportedAssetError(f"Unknown flag {flag}")
+        result |= table[flag]
+    return result
+
+
+def _guid(value: str | None) -> bytes:
+    # UAssetAPI stores System.Guid, whose byte layout is uuid's bytes_le:
+    return _ZERO_GUID if value is None else uuid.UUID(value).bytes_le
+
+
+def _fstring(value: str | None) -> bytes:
+    if value is None:
+        return _INT32.pack(0)
+    if value.isascii():
+        return _INT32.pack(len(value) + 1) + value.encode("ascii") + b"\0"
+    return _INT32.pack(-(len(value) + 1)) + value.encode("utf-16-le") + b"\0\0"
+
+
+class _AssetWriter:
+
+    def __init__(self, asset: dict):
+        self.asset = asset
+        self.name_map = asset["NameMap"]
+        self.name_index = {name: ii for ii, name in enumerate(self.name_map)}
+        self.names: dict[str, bytes] = {}
+        self.none = self.fname("None")
+        self.empty_element = None  # Element struct of the empty arrays of the export being written
+
+    def fname(self, value: str) -> bytes:
+        """FName as (name map index, number). Like UAssetAPI, a trailing _N
+        becomes the FName number N + 1."""
+        cached = self.names.get(value)
+        if cached is not None:
+            return cached
+        number = 0
+        base = value
+        match = _NUMBERED_NAME.match(value)
+        if match and (match.group(1) in self.name_index or value not in self.name_index):
+            base, number = match.group(1), int(match.group(2)) + 1
+        if base not in self.name_index:
+            raise UnsupportedAssetError(f"Name {base} is not in the name map")
+        packed = _FNAME.pack(self.name_index[base], number)
+        self.names[value] = packed
+        return packed
+
+    # ---------- Properties ----------
+    def property_tag(self, prop: dict, prop_type: str, size: int, extra: bytes = b"") -> bytes:
+        return b"".join((
+            self.fname(prop["Name"]),
+            self.fname(prop_type),
+            _INT32.pack(size),
+            _INT32.pack(prop["ArrayIndex"]),
+            extra,
+            b"\0",  # HasPropertyGuid
+        ))
+
+    def property(self, prop: dict) -> bytes:
+        prop_type = prop["$type"].split(",")[0].rsplit(".", 1)[-1]
+        match prop_type:
+            case "FloatPropertyData":
+                return self.property_tag(prop, "FloatProperty", 4) + _FLOAT.pack(float(prop["Value"]))
+            case "IntPropertyData":
+                return self.property_tag(prop, "IntProperty", 4) + _INT32.pack(prop["Value"])
+            case "ObjectPropertyData":
+                return self.property_tag(prop, "ObjectProperty", 4) + _INT32.pack(prop["Value"])
+            case "EnumPropertyData":
+                tag = self.property_tag(prop, "EnumProperty", 8, self.fname(prop["EnumType"]))
+                return tag + self.fname(prop["Value"])
+            case "StructPropertyData":
+                value = self.struct_value(prop)
+                extra = self.fname(prop["StructType"]) + _guid(prop["StructGUID"])
+                return self.property_tag(prop, "StructProperty", len(value), extra) + value
+            case "ArrayPropertyData":
+                value = self.array_value(prop)
+                extra = self.fname(prop["ArrayType"])
+                return self.property_tag(prop, "ArrayProperty", len(value), extra) + value
+        raise UnsupportedAssetError(f"Property type {prop_type} is not supported")
+
+    def properties(self, props) -> bytes:
+        return b"".join([self.property(p) for p in props]) + self.none
+
+    def struct_value(self, prop: dict) -> bytes:
+        struct_type = prop["StructType"]
+        if struct_type in NATIVE_STRUCTS:
+            (native,) = prop["Value"]
+            value = native["Value"]
+            match struct_type:
+                case "Vector":
+                    return _VECTOR.pack(float(value["X"]), float(value["Y"]), float(value["Z"]))
+                case "Rotator":
+                    return _VECTOR.pack(float(value["Pitch"]), float(value["Yaw"]), float(value["Roll"]))
+                case "GameplayTagContainer":
+                    return _INT32.pack(len(value)) + b"".join([self.fname(tag) for tag in value])
+        if not prop["SerializeNone"]:
+            raise UnsupportedAssetError(f"Struct {struct_type} without a None terminator")
+        return self.properties(prop["Value"])
+
+    def array_value(self, prop: dict) -> bytes:
+        values = prop["Value"]
+        count = _INT32.pack(len(values))
+        match prop["ArrayType"]:
+            case "ObjectProperty" | "IntProperty":
+                return count + struct.pack(f"<{len(values)}i", *[v["Value"] for v in values])
+            case "StructProperty":
+                # An empty array still has its inner tag, naming the element struct:
+                first = values[0] if values else prop.get("DummyStruct") or self.empty_element
+                if first is None:
+                    raise UnsupportedAssetError(f"Empty struct array {prop['Name']} of unknown element struct")
+                data = b"".join([self.struct_value(v) for v in values])
+                # The inner tag describes the elements, with the size of all of them:
+                extra = self.fname(first["StructType"]) + _guid(first["StructGUID"])
+                return count + self.property_tag(first, "StructProperty", len(data), extra) + data
+        raise UnsupportedAssetError(f"Array of {prop['ArrayType']} is not supported")
+
+    def export_data(self, export: dict) -> bytes:
+        if not export["$type"].startswith("UAssetAPI.ExportTypes.NormalExport,"):
+            raise UnsupportedAssetError(f"Export type {export['$type']} is not supported")
+        class_index = export["ClassIndex"]
+        class_name = self.asset["Imports"][-class_index - 1]["ObjectName"] if class_index < 0 else None
+        element = EMPTY_ARRAY_ELEMENTS.get(class_name)
+        self.empty_element = None if element is None else get_template(element)
+        data = self.properties(export["Data"])
+        if export["ObjectGuid"] is None:
+            data += _INT32.pack(0)
+        else:
+            data += _INT32.pack(1) + _guid(export["ObjectGuid"])
+        return data + base64.b64decode(export["Extras"] or "")
+
+    # ---------- Header ----------
+    def summary(self, offsets: dict) -> bytes:
+        asset = self.asset
+        custom_versions = [v for v in asset["CustomVersionContainer"] if v["IsSerialized"]]
+        out = bytearray()
+        out += _UINT32.pack(PACKAGE_FILE_TAG)
+        out += _INT32.pack(asset["LegacyFileVersion"])
+        out += _INT32.pack(LEGACY_UE3_VERSION)
+        # Unversioned packages store 0 for the engine versions:
+        out += _INT32.pack(0)
+        out += _INT32.pack(0 if asset["IsUnversioned"] else asset["FileVersionLicenseeUE"])
+        out += _INT32.pack(len(custom_versions))
+        for version in custom_versions:
+            out += _guid(version["Key"]) + _INT32.pack(version["Version"])
+        out += _INT32.pack(offsets["header_size"])
+        out += _fstring(asset["FolderName"])
+        out += _UINT32.pack(_flags(asset["PackageFlags"], PACKAGE_FLAGS))
+        out += _INT32.pack(len(self.name_map)) + _INT32.pack(offsets["names"])
+        out += _INT32.pack(0) + _INT32.pack(0)  # GatherableTextData
+        out += _INT32.pack(len(asset["Exports"])) + _INT32.pack(offsets["exports"])
+        out += _INT32.pack(len(asset["Imports"])) + _INT32.pack(offsets["imports"])
+        out += _INT32.pack(offsets["depends"])
+        out += _INT32.pack(0) + _INT32.pack(0)  # SoftPackageReferences
+        out += _INT32.pack(asset["SearchableNamesOffset"])
+        out += _INT32.pack(asset["ThumbnailTableOffset"])
+        out += _guid(asset["PackageGuid"])
+        out += _INT32.pack(len(asset["Generations"]))
+        for generation in asset["Generations"]:
+            out += _INT32.pack(generation["ExportCount"]) + _INT32.pack(generation["NameCount"])
+        for version in (asset["RecordedEngineVersion"], asset["RecordedCompatibleWithEngineVersion"]):
+            out += struct.pack("<HHHI", version["Major"], version["Minor"], version["Patch"], version["Changelist"])
+            out += _fstring(version["Branch"])
+        out += _UINT32.pack(asset["CompressionFlags"])
+        out += _INT32.pack(0)  # CompressedChunks
+        out += _UINT32.pack(asset["PackageSource"])
+        out += _INT32.pack(len(asset["AdditionalPackagesToCook"]))
+        for package in asset["AdditionalPackagesToCook"]:
+            out += _fstring(package)
+        out += _INT32.pack(offsets["asset_registry"])
+        out += _INT64.pack(offsets["bulk_data"])
+        out += _INT32.pack(0)  # WorldTileInfoDataOffset
+        out += _INT32.pack(len(asset["ChunkIDs"]))
+        for chunk in asset["ChunkIDs"]:
+            out += _INT32.pack(chunk)
+        out += _INT32.pack(offsets["preload_count"]) + _INT32.pack(offsets["preload"])
+        return bytes(out)
+
+    def import_entry(self, imp: dict) -> bytes:
+        return b"".join((
+            self.fname(imp["ClassPackage"]),
+            self.fname(imp["ClassName"]),
+            _INT32.pack(imp["OuterIndex"]),
+            self.fname(imp["ObjectName"]),
+        ))
+
+    def export_entry(self, export: dict, serial_size: int, serial_offset: int, first_dependency: int) -> bytes:
+        return b"".join((
+            struct.pack("<4i", export["ClassIndex"], export["SuperIndex"], export["TemplateIndex"], export["OuterIndex"]),
+            self.fname(export["ObjectName"]),
+            _UINT32.pack(_flags(export["ObjectFlags"], OBJECT_FLAGS)),
+            _INT64.pack(serial_size),
+            _INT64.pack(serial_offset),
+            struct.pack("<3i", export["bForcedExport"], export["bNotForClient"], export["bNotForServer"]),
+            _guid(export["PackageGuid"]),
+            _UINT32.pack(_flags(export["PackageFlags"], PACKAGE_FLAGS)),
+            struct.pack("<2i", export["bNotAlwaysLoadedForEditorGame"], export["bIsAsset"]),
+            struct.pack(
+                "<5i",
+                first_dependency,
+                len(export["SerializationBeforeSerializationDependencies"]),
+                len(export["CreateBeforeSerializationDependencies"]),
+                len(export["SerializationBeforeCreateDependencies"]),
+                len(export["CreateBeforeCreateDependencies"]),
+            ),
+        ))
+
+    def write(self) -> tuple[bytearray, int]:
+        """Returns the whole package and the offset where the .uexp starts."""
+        asset = self.asset
+        if asset["ObjectVersion"] != SUPPORTED_OBJECT_VERSION or asset["LegacyFileVersion"] != SUPPORTED_LEGACY_FILE_VERSION:
+            raise UnsupportedAssetError(f"Package version {asset['ObjectVersion']} is not supported")
+        exports = asset["Exports"]
+        export_data = [self.export_data(export) for export in exports]
+
+        offsets = {}
+        # The summary has a fixed size for a given asset, so a dry run gives the name map offset:
+        placeholder = dict.fromkeys(
+            ("header_size", "names", "exports", "imports", "depends", "asset_registry", "bulk_data", "preload_count", "preload"), 0
+        )
+        body = bytearray()
+        position = len(self.summary(placeholder))
+
+        offsets["names"] = position
+        for name in self.name_map:
+            body += _fstring(name)
+            if asset["WillSerializeNameHashes"]:
+                body += _UINT32.pack(name_hash(name))
+
+        offsets["imports"] = position + len(body) if asset["Imports"] else 0
+        for imp in asset["Imports"]:
+            body += self.import_entry(imp)
+
+        offsets["exports"] = position + len(body)
+        export_map_start = len(body)
+        body += bytes(104 * len(exports))
+
+        offsets["depends"] = position + len(body)
+        depends = asset["DependsMap"] or []
+        for ii in range(len(exports)):
+            entry = depends[ii] if ii < len(depends) else []
+            body += _INT32.pack(len(entry)) + struct.pack(f"<{len(entry)}i", *entry)
+
+        offsets["asset_registry"] = position + len(body)
+        body += base64.b64decode(asset["AssetRegistryData"] or "")
+
+        offsets["preload"] = position + len(body)
+        first_dependencies = []
+        preload_count = 0
+        for export in exports:
+            dependencies = [
+                *export["SerializationBeforeSerializationDependencies"],
+                *export["CreateBeforeSerializationDependencies"],
+                *export["SerializationBeforeCreateDependencies"],
+                *export["CreateBeforeCreateDependencies"],
+            ]
+            first_dependencies.append(preload_count if dependencies else -1)
+            body += struct.pack(f"<{len(dependencies)}i", *dependencies)
+            preload_count += len(dependencies)
+        offsets["preload_count"] = preload_count
+
+        header_size = position + len(body)
+        offsets["header_size"] = header_size
+        serial_offset = header_size
+        export_map = bytearray()
+        for export, data, first_dependency in zip(exports, export_data, first_dependencies):
+            export_map += self.export_entry(export, len(data), serial_offset, first_dependency)
+            serial_offset += len(data)
+        body[export_map_start:export_map_start + len(export_map)] = export_map
+        offsets["bulk_data"] = serial_offset
+
+        package = bytearray(self.summary(offsets))
+        package += body
+        for data in export_data:
+            package += data
+        package += base64.b64decode(asset["BulkData"] or "")
+        return package, header_size
+
+
+def write_uasset_bytes(asset: dict) -> tuple[bytearray, int]:
+    """Serializes the UAssetAPI JSON of a room. Returns the package bytes and
+    the offset where the .uasset ends and the .uexp starts."""
+    return _AssetWriter(asset).write()
+
+
+def save_uasset(asset: dict, room_name: str) -> Path:
+    with span("write_uasset_bytes"):
+        package, split = write_uasset_bytes(asset)
+    save_path = uasset_path(room_name)
+    with span("Write", bytes=len(package)):
+        with open(save_path, "wb") as f:
+            f.write(package[:split])
+        with open(save_path.with_suffix(".uexp"), "wb") as f:
+            f.write(package[split:])
+    logging.info(f"Written UAsset in {save_path} (native writer)")
+    return save_path
+
+
+def validate_against_uassetapi(room_files: list) -> dict:
+    """Builds every room with both writers and compares the bytes. Returns
+    {file: None} for identical output, or the first differing offset."""
+    import json
+    from json_builder import build_asset_json
+    from uassetgen import get_session
+
+    session = get_session()
+    results = {}
+    for file in room_files:
+        with open(file, "r") as f:
+            asset = build_asset_json(json.load(f))
+        native, _ = write_uasset_bytes(asset)
+        reference = bytes(session.deserialize(asset).WriteData().ToArray())
+        if native == reference:
+            results[str(file)] = None
+        else:
+            mismatch = next(
+                (ii for ii, (a, b) in enumerate(zip(native, reference)) if a != b),
+                min(len(native), len(reference)),
+            )
+            results[str(file)] = mismatch
+    return results
+
+
+if __name__ == "__main__":
+    # Byte for byte check against UAssetAPI: python uasset_writer.py example_rooms/*.json
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    failed = False
+    for file, mismatch in validate_against_uassetapi(sys.argv[1:]).items():
+        if mismatch is None:
+            print(f"OK        {file}")
+        else:
+            failed = True
+            print(f"MISMATCH  {file} (first difference at byte {mismatch})")
+    sys.exit(1 if failed else 0)
@@ -1,21 +1,259 @@
+import ctypes
 import logging
-from pythonnet import load
-
-load("coreclr")
-import clr
 import json
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
+from tracing import span
+
+DLL_PATH = Path("libs") / "UAssetAPI.dll"
+
+_runtime_lock = threading.Lock()
+_runtime_loaded = False
+
+
+def _load_runtime():
+    # pythonnet can only load one runtime per process, whatever the number of sessions:
+    global _runtime_loaded
+    with _runtime_lock:
+        if not _runtime_loaded:
+            from pythonnet import load
+            load("coreclr")
+            _runtime_loaded = True
+
+
+# How the asset JSON crosses into .NET. "stream" writes the UTF-8 JSON into a
+# pipe that UAssetAPI reads as it deserializes, so the JSON is never whole,
+# neither as Python text nor as a UTF-16 .NET string. "string" is the
+# original json.dumps -> DeserializeJson(string) path.
+HANDOFFS = ("stream", "string")
+STREAM_CHUNK_BYTES = 1 << 16  # JSON written into the pipe at a time, about the pipe buffer
+_STREAM_DEPTH = 2  # Containers of the asset JSON written piece by piece: the asset and its lists of exports
+
+
+class JsonStreamError(Exception):
+    """The JSON could not be written into the stream, e.g. a value json.dumps
+    does not take. The cause is the error of the writer thread."""
+
+
+def _json_chunks(value, depth: int = _STREAM_DEPTH):
+    """The text of json.dumps(value), in pieces. The containers down to depth
+    are written piece by piece, so a piece is at most one export."""
+    if depth == 0 or not isinstance(value, (dict, list)) or not value:
+        yield json.dumps(value)
+    elif isinstance(value, dict):
+        separator = "{"
+        for key, item in value.items():
+            yield f"{separator}{json.dumps(key)}: "
+            yield from _json_chunks(item, depth - 1)
+            separator = ", "
+        yield "}"
+    else:
+        separator = "["
+        for item in value:
+            yield separator
+            yield from _json_chunks(item, depth - 1)
+            separator = ", "
+        yield "]"
+
+
+def _write_json(pipe, room_json: dict, errors: list):
+    """Writes the UTF-8 JSON of room_json into the pipe, then closes it."""
+    from System import Array, Byte, IntPtr
+    from System.Runtime.InteropServices import Marshal
+
+    buffer = Array.CreateInstance(Byte, STREAM_CHUNK_BYTES)
+    pieces, size = [], 0
+
+    def write():
+        nonlocal buffer
+        data = "".join(pieces).encode("utf-8")
+        pieces.clear()
+        if len(data) > buffer.Length:
+            buffer = Array.CreateInstance(Byte, len(data))
+        # One memcpy from the bytes object into the .NET array, no per-byte conversion:
+        address = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+        Marshal.Copy(IntPtr(address), buffer, 0, len(data))
+        pipe.Write(buffer, 0, len(data))
+
+    try:
+        with span("JSON stream"):
+            for piece in _json_chunks(room_json):
+                pieces.append(piece)
+                size += len(piece)
+                if size >= STREAM_CHUNK_BYTES:
+                    write()
+                    size = 0
+            write()
+    except Exception as e:
+        # Also when the reader stopped early and closed its end:
+        errors.append(e)
+    finally:
+        # The reader sees the end of the JSON, or a truncated one after an error:
+        pipe.Dispose()
+
+
+@contextmanager
+def _utf8_stream(room_json: dict):
+    """Gives a .NET Stream of the UTF-8 JSON of room_json. A thread writes the
+    JSON into an anonymous pipe while the stream is read, export by export,
+    so only a chunk of it is in memory at a time. pythonnet releases
+    the GIL during .NET calls, so the writer runs while UAssetAPI reads. An
+    error of the writer is raised as a JsonStreamError."""
+    import clr
+    clr.AddReference("System.IO.Pipes")
+    from System.IO.Pipes import AnonymousPipeClientStream, AnonymousPipeServerStream, PipeDirection
+
+    pipe = AnonymousPipeServerStream(PipeDirection.Out)
+    stream = AnonymousPipeClientStream(PipeDirection.In, pipe.ClientSafePipeHandle)
+    errors = []
+    writer = threading.Thread(target=_write_json, args=(pipe, room_json, errors), name="JSON stream", daemon=True)
+    writer.start()
+    try:
+        yield stream
+    except Exception:
+        # While the stream is open, an error of the writer is its own, and it
+        # left the reader a truncated JSON:
+        if errors:
+            raise JsonStreamError(f"Could not write the asset JSON: {errors[0]}") from errors[0]
+        raise
+    finally:
+        # A writer blocked on a full pipe fails once nobody reads it:
+        stream.Dispose()
+        writer.join()
+    if errors:
+        raise JsonStreamError(f"Could not write the asset JSON: {errors[0]}") from errors[0]
+
+
+def uasset_path(room_name: str) -> Path:
+    return Path("assets") / Path(f"{room_name}.uasset")
+
+
+class UAssetSession:
+    """Keeps CoreCLR and the UAssetAPI assembly loaded between conversions.
+    The runtime is loaded on the first call to warm_up() or convert(), so
+    importing this module is cheap.
+    """
+
+    def __init__(self, dll_path: Path = DLL_PATH, handoff: str = "stream"):
+        self.dll_path = dll_path
+        self.handoff = handoff
+        self._uasset = None
+        self._lock = threading.Lock()
+        self.load_time = None
+        self.first_conversion_time = None
+        self.conversion_times = []
+
+    def warm_up(self):
+        """Loads the runtime and the assembly, if that has not happened yet."""
+        with self._lock:
+            if self._uasset is None:
+                start = time.perf_counter()
+                with span("UAssetAPI load"):
+                    _load_runtime()
+                    import clr
+                    # The dll_path needs to be an absolute reference to libs/UAssetAPI.dll:
+                    clr.AddReference(str(Path.cwd() / self.dll_path))
+                    from UAssetAPI import UAsset
+                self._uasset = UAsset
+                self.load_time = time.perf_counter() - start
+                logging.info(f"Loaded UAssetAPI in {self.load_time:.3f}s")
+            return self._uasset
+
+    def deserialize(self, room_json: dict, handoff: str | None = None):
+        """Returns the UAssetAPI UAsset for the asset JSON."""
+        UAsset = self.warm_up()
+        if (handoff or self.handoff) == "stream":
+            try:
+                with _utf8_stream(room_json) as stream, span("DeserializeJson", handoff="stream"):
+                    return UAsset.DeserializeJson(stream)
+            except TypeError as e:
+                # pythonnet raises TypeError when no overload takes a Stream.
+                # Errors of the JSON itself are JsonStreamError, and keep the
+                # stream handoff for the next rooms:
+                logging.warning(f"UAssetAPI has no DeserializeJson(Stream), using the string handoff: {e}")
+                self.handoff = "string"
+        # DeserializeJson expects a string:
+        with span("json.dumps"):
+            text = json.dumps(room_json)
+        with span("DeserializeJson", handoff="string"):
+            return UAsset.DeserializeJson(text)
+
+    def convert(self, room_json: dict, room_name: str) -> Path:
+        self.warm_up()
+        start = time.perf_counter()
+        save_path = uasset_path(room_name)
+        with span("JSON_to_uasset"):
+            asset = self.deserialize(room_json)
+            with span("Write"):
+                asset.Write(str(save_path))
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if self.first_conversion_time is None:
+                # What a cold start costs: loading the runtime plus the first conversion.
+                self.first_conversion_time = self.load_time + elapsed
+            else:
+                self.conversion_times.append(elapsed)
+        logging.info(f"Written UAsset in {save_path} ({elapsed:.3f}s)")
+        return save_path
+
+    def compare_handoffs(self, room_json: dict, repeats: int = 5) -> dict:
+        """Times every handoff on the same asset JSON (best of repeats) and
+        checks that they serialize to the same bytes."""
+        self.warm_up()
+        results = {}
+        outputs = {}
+        for handoff in HANDOFFS:
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                asset = self.deserialize(room_json, handoff)
+                times.append(time.perf_counter() - start)
+            results[f"{handoff}_s"] = min(times)
+            outputs[handoff] = bytes(asset.WriteData().ToArray())
+        results["identical"] = outputs["stream"] == outputs["string"]
+        results["size_bytes"] = len(outputs["string"])
+        # The stream timing is the string one if UAssetAPI lacks the overload:
+        results["stream_supported"] = self.handoff == "stream"
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            times = list(self.conversion_times)
+        return {
+            "load_s": self.load_time,
+            "first_conversion_s": self.first_conversion_time,
+            "conversions": len(times) + (self.first_conversion_time is not None),
+            "mean_conversion_s": sum(times) / len(times) if times else None,
+        }
+
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session() -> UAssetSession:
+    """Returns the process-wide session shared by the GUI and batch mode."""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = UAssetSession()
+        return _SESSION
+
+
+def JSON_to_uasset(room_json: dict, room_name: str) -> Path:
+    return get_session().convert(room_json, room_name)
+
 
-def JSON_to_uasset(room_json: dict, room_name: str):
-    # Load the assembly. The dll_path needs to be an absolute reference to libs/UAssetAPI.dll:
-    dll_path = Path.cwd() / "libs" / "UAssetAPI.dll"
-    clr.AddReference(str(dll_path))
-    # We load the methods to read from JSON and save:
-    from UAssetAPI import UAsset
-    from UAssetAPI import UnrealTypes
+if __name__ == "__main__":
+    # Benchmark of the JSON handoffs: python uassetgen.py <room.json> [repeats]
+    import sys
+    from json_builder import build_asset_json
 
-    # DeserializeJson expects a string:
-    save_path = Path("assets") / Path(f"{room_name}.uasset")
-    UAsset.DeserializeJson(json.dumps(room_json)).Write(str(save_path))
-    logging.info(f"Written UAsset in assets/{room_name}.uasset")
+    logging.basicConfig(level=logging.INFO)
+    with open(sys.argv[1], "r") as f:
+        asset_json = build_asset_json(json.load(f))
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(get_session().compare_handoffs(asset_json, repeats))